@@ -0,0 +1,482 @@
+import os
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import numpy as np
+import chromadb
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+import bulk_embedder
+import process_all_files
+from lexical_index import LexicalIndex, tokenize, term_hash
+from quantized_store import QuantizedCollection
+from instrumentation import peak_rss_mb, new_run_id
+
+# --- CONFIGURATION ---
+RESULTS_DIR = "benchmark_results"
+
+# Synthetic corpus size
+NUM_FILINGS = 24
+TICKERS = ["AAPL", "MSFT", "GOOGL", "JPM", "GS", "WMT"]
+PARAGRAPHS_PER_SECTION = 25
+
+NUM_QUERIES = 200
+QUERY_WORDS = 12
+RECALL_AT = [1, 5, 10]
+
+# Chroma's defaults, recorded with every run so results stay comparable
+HNSW_M = 16
+HNSW_CONSTRUCTION_EF = 100
+HNSW_SEARCH_EF = 10
+
+# 'hashing' skips the model download: a bag-of-words embedder that measures
+# speed only; recall numbers then say nothing about the real model
+HASHING_MODEL = "hashing"
+HASHING_DIMENSIONS = 384
+
+SEED = 1234
+# ---
+
+SECTIONS = [
+    "Item 1. Business",
+    "Item 1A. Risk Factors",
+    "Item 7. Management's Discussion and Analysis",
+    "Item 7A. Quantitative and Qualitative Disclosures About Market Risk",
+    "Item 8. Financial Statements and Supplementary Data",
+]
+
+VOCABULARY = """
+revenue net income operating margin liquidity capital expenditures segment
+cybersecurity supply chain regulatory compliance litigation goodwill impairment
+interest rate foreign currency hedging derivative credit risk Basel III CET1
+ratio tier leverage deposits loan portfolio allowance share repurchase dividend
+cloud services advertising subscription hardware software retail inventory
+fiscal year quarter guidance restructuring acquisition pension obligation tax
+deferred lease assets liabilities cash flows debt maturity covenant rating
+competition customers consumers pricing demand macroeconomic inflation
+recession geopolitical tariffs intellectual property patents research
+development employees headcount sustainability emissions climate disclosure
+""".split()
+
+
+def directory_mb(path):
+    """Total size of the files under path, in MB."""
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return round(total / 1e6, 2)
+
+
+def latency_summary(seconds):
+    """p50/p95/p99/mean latency in milliseconds, plus queries per second."""
+    ms = np.array(seconds) * 1000
+    return {
+        "count": len(ms),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+        "queries_per_sec": round(len(ms) / (ms.sum() / 1000), 1),
+    }
+
+
+def stage_result(seconds, items, unit, megabytes=None):
+    """Timing record for one pipeline stage."""
+    result = {
+        "seconds": round(seconds, 3),
+        unit: items,
+        f"{unit}_per_sec": round(items / seconds, 1) if seconds else None,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    if megabytes is not None:
+        result["mb"] = round(megabytes, 2)
+        result["mb_per_sec"] = round(megabytes / seconds, 2) if seconds else None
+    return result
+
+
+class HashingEmbedder:
+    """
+    Deterministic signed bag-of-words embedder with SentenceTransformer's
+    encode() interface, for benchmarking without downloading a model.
+    """
+
+    def __init__(self, dimensions=HASHING_DIMENSIONS):
+        self.dimensions = dimensions
+
+    def encode(self, texts, batch_size=None, normalize_embeddings=True):
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in tokenize(text):
+                h = term_hash(token)
+                vectors[row, h % self.dimensions] += 1.0 if (h >> 32) & 1 else -1.0
+        if normalize_embeddings:
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors /= np.maximum(norms, 1e-12)
+        return vectors
+
+
+def load_model(model_name):
+    if model_name == HASHING_MODEL:
+        return HashingEmbedder()
+    from sentence_transformers import SentenceTransformer
+
+    return SentenceTransformer(model_name)
+
+
+def synthetic_paragraph(rng):
+    words = rng.choices(VOCABULARY, k=rng.randint(40, 90))
+    # Sprinkle in figures the way filings do
+    for _ in range(rng.randint(1, 4)):
+        words.insert(
+            rng.randrange(len(words)),
+            f"${rng.randint(1, 999)}.{rng.randint(0, 9)} billion",
+        )
+    return " ".join(words).capitalize() + "."
+
+
+def synthetic_filing(rng, ticker, year):
+    """An iXBRL-flavoured 10-K in HTML, with hidden facts, tables and scripts."""
+    parts = [
+        "<html><head><title>10-K</title><style>p {margin: 0}</style>",
+        "<script>var tracking = true;</script></head><body>",
+        '<div style="display:none"><ix:header><ix:hidden>',
+        f'<ix:nonNumeric name="dei:EntityRegistrantName">{ticker} Inc.</ix:nonNumeric>',
+        "</ix:hidden></ix:header></div>",
+        f"<h1>{ticker} Annual Report for fiscal year {year}</h1>",
+    ]
+    for section in SECTIONS:
+        parts.append(f"<h2>{section}</h2>")
+        for _ in range(PARAGRAPHS_PER_SECTION):
+            parts.append(f"<p>{synthetic_paragraph(rng)}</p>")
+        parts.append("<table>")
+        for _ in range(5):
+            cells = "".join(
+                f'<td><ix:nonFraction name="us-gaap:Revenues">{rng.randint(100, 99999)}'
+                "</ix:nonFraction></td>"
+                for _ in range(4)
+            )
+            parts.append(f"<tr><td>{rng.choice(VOCABULARY)}</td>{cells}</tr>")
+        parts.append("</table>")
+    parts.append("</body></html>")
+    return "\n".join(parts)
+
+
+def build_corpus(data_dir, num_filings, rng):
+    """Writes synthetic filings as data/TICKER/TICKER_10-K_DATE.html; returns paths."""
+    paths = []
+    for i in range(num_filings):
+        ticker = TICKERS[i % len(TICKERS)]
+        year = 2010 + i // len(TICKERS)
+        os.makedirs(os.path.join(data_dir, ticker), exist_ok=True)
+        path = os.path.join(data_dir, ticker, f"{ticker}_10-K_{year}-02-01.html")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(synthetic_filing(rng, ticker, year))
+        paths.append(path)
+    return paths
+
+
+def run_benchmark(args):
+    """Runs every stage against a fresh synthetic corpus; returns the results dict."""
+    rng = random.Random(args.seed)
+    # Everything lives in one subdirectory, so a reused --work_dir is safe to clear
+    work_dir = os.path.join(
+        args.work_dir or tempfile.mkdtemp(prefix="sec_qa_bench_"), "benchmark_corpus"
+    )
+    shutil.rmtree(work_dir, ignore_errors=True)
+    data_dir = os.path.join(work_dir, "data")
+    text_dir = os.path.join(work_dir, "processed_text")
+    stages = {}
+
+    print(
+        f"--- Building synthetic corpus of {args.num_filings} filings in {work_dir} ---"
+    )
+    html_paths = build_corpus(data_dir, args.num_filings, rng)
+
+    # 1. Clean
+    print(f"--- Cleaning with the '{args.engine}' engine ---")
+    text_paths = []
+    start = time.perf_counter()
+    for html_path in html_paths:
+        relative = os.path.relpath(html_path, data_dir)
+        text_path = os.path.join(text_dir, os.path.splitext(relative)[0] + ".txt")
+        os.makedirs(os.path.dirname(text_path), exist_ok=True)
+        _, _, error, _ = process_all_files.clean_file(
+            html_path, text_path, args.engine
+        )
+        if error:
+            raise RuntimeError(f"Cleaning {html_path} failed: {error}")
+        text_paths.append(text_path)
+    html_mb = sum(os.path.getsize(p) for p in html_paths) / 1e6
+    stages["clean"] = stage_result(
+        time.perf_counter() - start, len(html_paths), "files", html_mb
+    )
+
+    # 2. Chunk
+    if args.chunk_overlap is None:
+        args.chunk_overlap = (
+            bulk_embedder.SECTION_CHUNK_OVERLAP
+            if args.chunker == "section"
+            else bulk_embedder.CHUNK_OVERLAP
+        )
+    print(
+        f"--- Chunking with the '{args.chunker}' chunker "
+        f"(chunk_size={args.chunk_size}, overlap={args.chunk_overlap}) ---"
+    )
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap
+    )
+    documents, metadatas, ids = [], [], []
+    start = time.perf_counter()
+    for text_path in text_paths:
+        with open(text_path, "r", encoding="utf-8") as f:
+            file_text = f.read()
+        file_documents, file_metadatas, file_ids = bulk_embedder.chunk_text(
+            os.path.basename(text_path),
+            file_text,
+            bulk_embedder.hash_text(file_text),
+            text_splitter,
+            by_section=args.chunker == "section",
+        )
+        documents += file_documents
+        metadatas += file_metadatas
+        ids += file_ids
+    text_mb = sum(os.path.getsize(p) for p in text_paths) / 1e6
+    stages["chunk"] = stage_result(
+        time.perf_counter() - start, len(ids), "chunks", text_mb
+    )
+
+    # 3. Embed
+    print(f"--- Embedding {len(ids)} chunks with {args.model} ---")
+    start = time.perf_counter()
+    model = load_model(args.model)
+    load_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    embeddings = np.vstack(
+        [
+            model.encode(
+                documents[i : i + args.batch_size],
+                batch_size=args.batch_size,
+                normalize_embeddings=True,
+            )
+            for i in range(0, len(documents), args.batch_size)
+        ]
+    ).astype(np.float32)
+    stages["embed"] = stage_result(time.perf_counter() - start, len(ids), "chunks")
+    stages["embed"]["model_load_seconds"] = round(load_seconds, 3)
+
+    # 4. Index: HNSW via Chroma (or the quantized store), plus the BM25 index
+    print(f"--- Indexing into the '{args.vector_store}' vector store ---")
+    if args.vector_store == "chroma":
+        store_dir = os.path.join(work_dir, "chroma_db")
+        client = chromadb.PersistentClient(path=store_dir)
+        collection = client.create_collection(
+            name="benchmark",
+            metadata={
+                "hnsw:space": "cosine",
+                "hnsw:M": args.hnsw_m,
+                "hnsw:construction_ef": args.hnsw_construction_ef,
+                "hnsw:search_ef": args.hnsw_search_ef,
+            },
+        )
+    else:
+        store_dir = os.path.join(work_dir, "quantized_store")
+        collection = QuantizedCollection(store_dir, args.vector_store)
+    start = time.perf_counter()
+    for i in range(0, len(ids), args.batch_size):
+        collection.upsert(
+            ids=ids[i : i + args.batch_size],
+            documents=documents[i : i + args.batch_size],
+            metadatas=metadatas[i : i + args.batch_size],
+            embeddings=embeddings[i : i + args.batch_size].tolist(),
+        )
+    stages["index"] = stage_result(time.perf_counter() - start, len(ids), "chunks")
+    stages["index"]["disk_mb"] = directory_mb(store_dir)
+    if args.vector_store != "chroma":
+        stages["index"]["vector_memory_mb"] = round(collection.nbytes() / 1e6, 2)
+
+    print("--- Building the lexical index ---")
+    start = time.perf_counter()
+    lexical_index = LexicalIndex(os.path.join(work_dir, "lexical_index"))
+    lexical_index.add(ids, documents, metadatas)
+    lexical_index.commit()
+    stages["lexical_index"] = stage_result(
+        time.perf_counter() - start, len(ids), "chunks"
+    )
+
+    # 5. Query: word windows sampled from random chunks
+    queries = []
+    for _ in range(args.num_queries):
+        words = documents[rng.randrange(len(documents))].split()
+        offset = rng.randrange(max(len(words) - QUERY_WORDS, 1))
+        queries.append(" ".join(words[offset : offset + QUERY_WORDS]))
+
+    print(f"--- Running {len(queries)} queries ---")
+    start = time.perf_counter()
+    query_embeddings = model.encode(
+        queries, batch_size=args.batch_size, normalize_embeddings=True
+    )
+    stages["query_embed"] = stage_result(
+        time.perf_counter() - start, len(queries), "queries"
+    )
+
+    k = max(RECALL_AT)
+    vector_latencies, found_ids = [], []
+    for query_embedding in query_embeddings:
+        start = time.perf_counter()
+        results = collection.query(
+            query_embeddings=[query_embedding.tolist()], n_results=k
+        )
+        vector_latencies.append(time.perf_counter() - start)
+        found_ids.append(results["ids"][0])
+
+    lexical_latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        lexical_index.search(query, k)
+        lexical_latencies.append(time.perf_counter() - start)
+
+    # Exact top-k by brute-force cosine (embeddings are normalized)
+    start = time.perf_counter()
+    similarities = np.asarray(query_embeddings, dtype=np.float32) @ embeddings.T
+    exact_top = np.argsort(-similarities, axis=1)[:, :k]
+    brute_force_seconds = time.perf_counter() - start
+
+    recall = {}
+    for at in RECALL_AT:
+        hits = [
+            len(set(found[:at]) & {ids[j] for j in exact[:at]}) / at
+            for found, exact in zip(found_ids, exact_top)
+        ]
+        recall[f"recall@{at}"] = round(float(np.mean(hits)), 4)
+
+    stages["query"] = latency_summary(vector_latencies)
+    stages["query"].update(recall)
+    stages["query"]["brute_force_ms_per_query"] = round(
+        brute_force_seconds * 1000 / len(queries), 3
+    )
+    stages["lexical_query"] = latency_summary(lexical_latencies)
+
+    if not args.work_dir:
+        shutil.rmtree(os.path.dirname(work_dir), ignore_errors=True)
+
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "num_filings": args.num_filings,
+            "num_chunks": len(ids),
+            "num_queries": len(queries),
+            "engine": args.engine,
+            "chunker": args.chunker,
+            "chunk_size": args.chunk_size,
+            "chunk_overlap": args.chunk_overlap,
+            "model": args.model,
+            "batch_size": args.batch_size,
+            "vector_store": args.vector_store,
+            "hnsw_m": args.hnsw_m,
+            "hnsw_construction_ef": args.hnsw_construction_ef,
+            "hnsw_search_ef": args.hnsw_search_ef,
+            "seed": args.seed,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "chromadb": chromadb.__version__,
+            "numpy": np.__version__,
+        },
+        "stages": stages,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def print_report(results):
+    stages = results["stages"]
+    print("\n--- Benchmark results ---")
+    for name in ("clean", "chunk", "embed", "index", "lexical_index", "query_embed"):
+        stage = stages[name]
+        rate_key = next(
+            key for key in stage if key.endswith("_per_sec") and key != "mb_per_sec"
+        )
+        print(
+            f"  {name:<14} {stage['seconds']:>8.2f}s  {stage[rate_key]:>10} {rate_key}"
+        )
+    for name in ("query", "lexical_query"):
+        stage = stages[name]
+        print(
+            f"  {name:<14} p50 {stage['p50_ms']} ms, p95 {stage['p95_ms']} ms, "
+            f"p99 {stage['p99_ms']} ms ({stage['queries_per_sec']} queries/sec)"
+        )
+    print(
+        "  "
+        + ", ".join(
+            f"{k}: {v}" for k, v in stages["query"].items() if k.startswith("recall")
+        )
+    )
+    print(f"  index size on disk: {stages['index']['disk_mb']} MB")
+    if "vector_memory_mb" in stages["index"]:
+        print(f"  vectors in memory: {stages['index']['vector_memory_mb']} MB")
+    print(f"  peak RSS: {results['peak_rss_mb']} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark cleaning, chunking, embedding, indexing and retrieval "
+        "on a synthetic filings corpus."
+    )
+    parser.add_argument("--num_filings", type=int, default=NUM_FILINGS)
+    parser.add_argument("--num_queries", type=int, default=NUM_QUERIES)
+    parser.add_argument("--engine", choices=process_all_files.ENGINES, default="soup")
+    parser.add_argument(
+        "--chunker",
+        choices=bulk_embedder.CHUNKERS,
+        default=bulk_embedder.DEFAULT_CHUNKER,
+    )
+    parser.add_argument("--chunk_size", type=int, default=bulk_embedder.CHUNK_SIZE)
+    parser.add_argument(
+        "--chunk_overlap",
+        type=int,
+        help="Defaults to the chunker's own overlap setting.",
+    )
+    parser.add_argument(
+        "--model",
+        default=bulk_embedder.EMBEDDING_MODEL,
+        help=f"SentenceTransformer model, or '{HASHING_MODEL}' to run without one.",
+    )
+    parser.add_argument(
+        "--batch_size", type=int, default=bulk_embedder.DEFAULT_BATCH_SIZE
+    )
+    parser.add_argument(
+        "--vector_store",
+        choices=bulk_embedder.VECTOR_STORES,
+        default=bulk_embedder.DEFAULT_VECTOR_STORE,
+        help="'int8' or 'binary' benchmark the quantized store instead of Chroma.",
+    )
+    parser.add_argument("--hnsw_m", type=int, default=HNSW_M)
+    parser.add_argument(
+        "--hnsw_construction_ef", type=int, default=HNSW_CONSTRUCTION_EF
+    )
+    parser.add_argument("--hnsw_search_ef", type=int, default=HNSW_SEARCH_EF)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument(
+        "--work_dir",
+        help="Keep the corpus and database here instead of a temporary directory.",
+    )
+    parser.add_argument(
+        "--output",
+        help="Results JSON path (default: a timestamped file in benchmark_results/).",
+    )
+
+    args = parser.parse_args()
+    results = run_benchmark(args)
+    print_report(results)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"benchmark_{new_run_id()}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\n--- Results written to {output} ---")
@@ -1,92 +1,1003 @@
 import os
+import json
+import time
+import hashlib
+import tempfile
+import queue
+import argparse
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import chromadb
 from langchain.text_splitter import RecursiveCharacterTextSplitter
+from sentence_transformers import SentenceTransformer
 from tqdm import tqdm
+import storage
+from lexical_index import LexicalIndex, date_to_int
+from quantized_store import QuantizedCollection, PRECISIONS
+from sharding import (
+    SHARD_MODES,
+    SHARD_MAP_FILE,
+    DEFAULT_NUM_SHARDS,
+    db_path,
+    shard_name,
+    write_shard_map,
+)
+from sec_sections import split_sections
+from chunk_store import (
+    TEXT_MODES,
+    DEFAULT_TEXT_MODE,
+    START_FIELD,
+    END_FIELD,
+    has_offsets,
+    locate_chunks,
+    stored_documents,
+    resolve_documents,
+)
+from instrumentation import RunMetrics, timed, profile_call
 
 # --- CONFIGURATION ---
 PROCESSED_DIR = "processed_text"
 DB_DIR = "chroma_db"
 COLLECTION_NAME = "sec_filings"
+
+# Sidecar manifest of source files already embedded: content hash, size,
+# mtime, chunker settings and chunk count per file
+MANIFEST_PATH = os.path.join(DB_DIR, "indexed_files.json")
+MANIFEST_VERSION = 2
+# Entries finished since the manifest was last written in full, appended as one
+# JSON line per embedded batch so a checkpoint only costs the files it finished
+MANIFEST_JOURNAL_SUFFIX = ".journal"
+
+# Where vectors are written: 'chroma' (float32 HNSW index), or the compact
+# quantized store in 'int8' or 'binary' precision (see quantized_store.py).
+# The choice is recorded in the manifest, and qa_agent opens the same store.
+VECTOR_STORES = ["chroma"] + PRECISIONS
+DEFAULT_VECTOR_STORE = "chroma"
+QUANTIZED_STORE_DIR = os.path.join(DB_DIR, "quantized_store")
+
+# With --shard_by, each shard is a self-contained database directory (collection,
+# manifest, lexical index) under SHARDS_DIR, built by its own worker process
+SHARDS_DIR = os.path.join(DB_DIR, "shards")
+DEFAULT_SHARD_WORKERS = min(4, os.cpu_count() or 1)
+# Workers start fresh rather than forking a parent with torch and Chroma loaded
+WORKER_START_METHOD = "spawn"
+
+# BM25 inverted index kept in step with the collection for hybrid retrieval
+LEXICAL_INDEX_DIR = os.path.join(DB_DIR, "lexical_index")
+# Chunks buffered before the lexical index writes a new segment
+LEXICAL_COMMIT_CHUNKS = 50000
+# Page size when rebuilding the lexical index from the collection
+LEXICAL_REBUILD_PAGE = 5000
+
+# Same model Chroma's default embedding function uses, so query-time embeddings
+# in qa_agent.py stay compatible with the vectors we write here
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+# Number of chunks embedded and written per batch, across file boundaries
+DEFAULT_BATCH_SIZE = 256
+
+# How many chunked files the producer may get ahead of the embedder
+PREFETCH_FILES = 16
+
+# 'section' chunks within each 10-K/10-Q Item or 8-K item and tags chunks with
+# it; 'recursive' splits the whole file as one blob
+CHUNKERS = ["section", "recursive"]
+DEFAULT_CHUNKER = "section"
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+# Section chunks never straddle a heading, so they are stored without overlap
+SECTION_CHUNK_OVERLAP = 0
+
+# Bumped when the chunk metadata layout changes; files chunked under an older
+# version are re-chunked, which only rewrites metadata when the text is the same.
+# 2: 'date' is stored as an integer (20241101) so range filters work
+METADATA_VERSION = 2
 # ---
 
 
-def main():
+def hash_text(text):
+    """Content hash stored in chunk metadata to detect changed text."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def parse_filename(filename):
+    """Splits 'TICKER_FORM_DATE.txt' into (ticker, form_type, date), or None if malformed."""
+    parts = os.path.splitext(filename)[0].split("_")
+    if len(parts) < 3:
+        return None
+    # download_filings writes '10-K/A' as '10-K_A', so the date is the last field
+    return parts[0], "/".join(parts[1:-1]), parts[-1]
+
+
+def source_filename(filepath):
+    """Logical name of a processed text file, without any compression extension."""
+    return storage.split_compression(os.path.basename(filepath))[0]
+
+
+def file_stat(filepath):
+    """Size and mtime used to skip hashing files that have not been touched."""
+    stat = os.stat(filepath)
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def list_text_files():
+    """Every processed text file under PROCESSED_DIR, compressed or not."""
+    all_text_files = []
+    for root, _, files in os.walk(PROCESSED_DIR):
+        for file in files:
+            if storage.split_compression(file)[0].lower().endswith(".txt"):
+                all_text_files.append(os.path.join(root, file))
+    return all_text_files
+
+
+def read_manifest(manifest_path=MANIFEST_PATH):
     """
-    Main function to chunk, embed, and store all processed text files
-    into the ChromaDB vector database.
+    The manifest as last written in full, with the checkpoints journaled since
+    replayed over it, or None if there is neither.
+    """
+    manifest = None
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    journal_path = manifest_path + MANIFEST_JOURNAL_SUFFIX
+    if os.path.exists(journal_path):
+        with open(journal_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    checkpoint = json.loads(line)
+                except ValueError:
+                    # The last checkpoint was cut short by a crash
+                    break
+                if manifest is None:
+                    manifest = {"version": MANIFEST_VERSION, "files": {}}
+                manifest["files"].update(checkpoint.pop("files"))
+                manifest.update(checkpoint)
+    return manifest
+
+
+def load_manifest(
+    collection, vector_store=DEFAULT_VECTOR_STORE, manifest_path=MANIFEST_PATH
+):
+    """
+    Returns {source_file: entry} for every file already in the collection.
+    Uses the sidecar manifest when it matches the collection's item count and
+    vector store, otherwise rebuilds it from a single metadata-only pass over
+    the collection.
+    """
+    try:
+        manifest = read_manifest(manifest_path)
+        if manifest is not None:
+            if (
+                manifest.get("version") == MANIFEST_VERSION
+                and manifest.get("collection_count") == collection.count()
+                and manifest.get("vector_store", "chroma") == vector_store
+            ):
+                return manifest["files"]
+            print("--- Manifest is out of date, rebuilding from the collection ---")
+    except (OSError, ValueError, KeyError) as e:
+        print(f"--- Could not read manifest ({e}), rebuilding from the collection ---")
+
+    # Rebuilt entries carry no size/mtime, so each file is re-hashed once
+    indexed_files = {}
+    for metadata in collection.get(include=["metadatas"])["metadatas"]:
+        entry = indexed_files.setdefault(
+            metadata["source_file"],
+            {"file_hash": metadata.get("file_hash"), "chunks": 0},
+        )
+        entry["chunks"] += 1
+        for field in ("chunker", "streamed"):
+            if field in metadata:
+                entry[field] = metadata[field]
+    return indexed_files
+
+
+def save_manifest(
+    collection,
+    indexed_files,
+    vector_store=DEFAULT_VECTOR_STORE,
+    manifest_path=MANIFEST_PATH,
+):
+    """
+    Atomically writes the manifest along with the collection's current item
+    count, folding in (and removing) the journal.
+    """
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "collection_count": collection.count(),
+        "vector_store": vector_store,
+        "files": indexed_files,
+    }
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(manifest_path), suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+    journal_path = manifest_path + MANIFEST_JOURNAL_SUFFIX
+    if os.path.exists(journal_path):
+        os.remove(journal_path)
+
+
+def append_manifest(
+    collection,
+    entries,
+    vector_store=DEFAULT_VECTOR_STORE,
+    manifest_path=MANIFEST_PATH,
+):
+    """
+    Checkpoints only the given {source_file: entry} changes, with the
+    collection's current item count, by appending them to the manifest's
+    journal. The next save_manifest folds them into the manifest.
+    """
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    checkpoint = {
+        "collection_count": collection.count(),
+        "vector_store": vector_store,
+        "files": entries,
+    }
+    journal_path = manifest_path + MANIFEST_JOURNAL_SUFFIX
+    with open(journal_path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(checkpoint, sort_keys=True) + "\n")
+
+
+def sync_lexical_index(collection, lexical_index):
+    """
+    Rebuilds the lexical index from the collection's stored documents when the
+    two have drifted apart (first run, or an interrupted run).
+    """
+    if lexical_index.num_live_docs() == collection.count():
+        return
+    print("--- Lexical index is out of date, rebuilding from the collection ---")
+    lexical_index.clear()
+    offset = 0
+    while True:
+        page = collection.get(
+            include=["documents", "metadatas"],
+            limit=LEXICAL_REBUILD_PAGE,
+            offset=offset,
+        )
+        if not page["ids"]:
+            break
+        lexical_index.add(
+            page["ids"],
+            resolve_documents(page["documents"], page["metadatas"]),
+            page["metadatas"],
+        )
+        offset += len(page["ids"])
+        if lexical_index.num_pending_docs() >= LEXICAL_COMMIT_CHUNKS:
+            lexical_index.commit()
+    lexical_index.commit()
+
+
+def remove_deleted_files(collection, lexical_index, indexed_files, on_disk_files):
+    """
+    Deletes chunks whose source text file no longer exists in PROCESSED_DIR.
+    Files indexed by pipeline.py without keeping their text are left alone.
+    """
+    removed_files = sorted(
+        filename
+        for filename in set(indexed_files) - on_disk_files
+        if not indexed_files[filename].get("streamed")
+    )
+    if not removed_files:
+        return
+    print(f"--- Removing {len(removed_files)} deleted files from the collection ---")
+    collection.delete(where={"source_file": {"$in": removed_files}})
+    for filename in removed_files:
+        base_filename = os.path.splitext(filename)[0]
+        lexical_index.delete(
+            f"{base_filename}_chunk_{i}"
+            for i in range(indexed_files[filename]["chunks"])
+        )
+        del indexed_files[filename]
+
+
+def chunker_id(chunker, store_text=DEFAULT_TEXT_MODE):
+    """Identifies the chunking settings, recorded per file in the manifest."""
+    overlap = SECTION_CHUNK_OVERLAP if chunker == "section" else CHUNK_OVERLAP
+    suffix = "" if store_text == DEFAULT_TEXT_MODE else f":{store_text}"
+    return f"{chunker}:{CHUNK_SIZE}:{overlap}:m{METADATA_VERSION}{suffix}"
+
+
+def make_text_splitter(chunker):
+    return RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=SECTION_CHUNK_OVERLAP if chunker == "section" else CHUNK_OVERLAP,
+    )
+
+
+def chunk_text(
+    filename,
+    file_text,
+    file_hash,
+    text_splitter,
+    by_section=False,
+    offsets=False,
+    chunker=None,
+):
+    """
+    Splits a processed text file into chunks.
+    Returns (documents, metadatas, ids), with a content hash in each chunk's metadata.
+    With by_section, chunks stay within one Item and carry a 'section' field.
+    With offsets, each chunk's byte range in file_text is added to its metadata
+    so the vector store need not keep its text.
+    chunker (a chunker_id) is recorded in each chunk, so load_manifest can
+    rebuild the manifest's entries from the collection.
+    """
+    base_filename = os.path.splitext(filename)[0]
+    ticker, form_type, date = parse_filename(filename)
+
+    if by_section:
+        pieces = [
+            (section, chunk.page_content)
+            for section, section_text in split_sections(file_text, form_type)
+            for chunk in text_splitter.create_documents([section_text])
+        ]
+    else:
+        pieces = [
+            (None, chunk.page_content)
+            for chunk in text_splitter.create_documents([file_text])
+        ]
+    documents = [document for _, document in pieces]
+    spans = locate_chunks(file_text, documents) if offsets else [None] * len(pieces)
+
+    metadatas = []
+    for (section, document), span in zip(pieces, spans):
+        metadata = {
+            "ticker": ticker,
+            "form_type": form_type,
+            "date": date_to_int(date),
+            "source_file": filename,
+            "file_hash": file_hash,
+            "chunk_hash": hash_text(document),
+        }
+        if chunker is not None:
+            metadata["chunker"] = chunker
+        if section is not None:
+            metadata["section"] = section
+        if span is not None:
+            metadata[START_FIELD], metadata[END_FIELD] = span
+        metadatas.append(metadata)
+
+    ids = [f"{base_filename}_chunk_{i}" for i in range(len(documents))]
+    return documents, metadatas, ids
+
+
+def produce_chunks(
+    filepaths,
+    indexed_files,
+    chunk_queue,
+    chunker=DEFAULT_CHUNKER,
+    metrics=None,
+    profile_file=None,
+    store_text=DEFAULT_TEXT_MODE,
+):
+    """
+    Producer thread: hashes and chunks each file ahead of the embedder and puts
+    (filename, file_info, chunks, error) on the queue, followed by a final None.
+    chunks is None when the file's content hash and chunker match the manifest.
+    Read, hash and chunk timings per file go to metrics; the file named
+    profile_file is chunked under cProfile.
+    With store_text 'offsets', chunks of uncompressed files record their byte
+    ranges; compressed files can't be memory-mapped and keep their text.
+    """
+    text_splitter = make_text_splitter(chunker)
+    for filepath in filepaths:
+        filename = source_filename(filepath)
+        start = time.perf_counter()
+        timings = {}
+        file_info = None
+        chunks = None
+        try:
+            file_info = file_stat(filepath)
+            offsets = (
+                store_text == "offsets" and not storage.split_compression(filepath)[1]
+            )
+            with timed(timings, "read"):
+                # Offsets must match the bytes on disk, so newlines stay as stored
+                file_text = storage.read_text(filepath, "" if offsets else None)
+            with timed(timings, "hash"):
+                file_info["file_hash"] = hash_text(file_text)
+            file_info["chunker"] = chunker_id(chunker, store_text)
+
+            entry = indexed_files.get(filename)
+            if entry and all(
+                entry.get(k) == file_info[k] for k in ("file_hash", "chunker")
+            ):
+                chunk_queue.put((filename, file_info, None, None))
+                continue
+
+            chunk_args = (
+                filename,
+                file_text,
+                file_info["file_hash"],
+                text_splitter,
+                chunker == "section",
+                offsets,
+                file_info["chunker"],
+            )
+            with timed(timings, "chunk"):
+                if metrics and profile_file in (filename, os.path.splitext(filename)[0]):
+                    chunks = profile_call(
+                        metrics.profile_path(filename), chunk_text, *chunk_args
+                    )
+                else:
+                    chunks = chunk_text(*chunk_args)
+            chunk_queue.put((filename, file_info, chunks, None))
+        except Exception as e:
+            chunk_queue.put((filename, None, None, e))
+        finally:
+            if metrics:
+                metrics.record_file(
+                    filepath,
+                    time.perf_counter() - start,
+                    bytes_in=file_info["size"] if file_info else None,
+                    timings=timings,
+                    chunks=len(chunks[2]) if chunks else 0,
+                )
+    chunk_queue.put(None)
+
+
+def diff_chunks(existing, metadatas, ids):
+    """
+    Compares a file's new chunks with the ones already in the collection.
+    Returns (unchanged, reusable, to_embed, orphan_ids):
+    - unchanged: indices whose ID already holds the same text, stored the same way
+    - reusable: {index: embedding} for text that already exists under another ID
+    - to_embed: indices of chunks with new text
+    - orphan_ids: old IDs the file no longer produces
+    """
+    old_hashes = {}
+    embeddings_by_hash = {}
+    for chunk_id, document, metadata, embedding in zip(
+        existing["ids"],
+        existing["documents"],
+        existing["metadatas"],
+        existing["embeddings"],
+    ):
+        # Chunks written before hashes were stored are hashed from their text
+        chunk_hash = metadata.get("chunk_hash") or hash_text(document)
+        old_hashes[chunk_id] = (chunk_hash, has_offsets(metadata))
+        embeddings_by_hash.setdefault(chunk_hash, embedding)
+
+    unchanged, reusable, to_embed = [], {}, []
+    for i, (chunk_id, metadata) in enumerate(zip(ids, metadatas)):
+        chunk_hash = metadata["chunk_hash"]
+        if old_hashes.get(chunk_id) == (chunk_hash, has_offsets(metadata)):
+            unchanged.append(i)
+        elif chunk_hash in embeddings_by_hash:
+            reusable[i] = embeddings_by_hash[chunk_hash]
+        else:
+            to_embed.append(i)
+
+    orphan_ids = sorted(set(old_hashes) - set(ids))
+    return unchanged, reusable, to_embed, orphan_ids
+
+
+def embed_and_upsert(collection, model, documents, metadatas, ids, timings=None):
+    """
+    Embeds one batch of chunks with the local model and upserts the vectors.
+    Chunks with byte offsets are stored without their text.
+    With a timings dict, the embed and DB write steps are timed into it.
+    """
+    with timed(timings, "embed"):
+        embeddings = model.encode(
+            documents, batch_size=len(documents), normalize_embeddings=True
+        )
+    with timed(timings, "db_write"):
+        collection.upsert(
+            ids=ids,
+            documents=stored_documents(documents, metadatas),
+            metadatas=metadatas,
+            embeddings=embeddings.tolist(),
+        )
+
+
+class BatchWriter:
+    """
+    Embeds chunks from many files together in fixed-size batches and writes
+    them to the collection and the lexical index. A file already in the
+    manifest is diffed against its stored chunks first, so only new text is
+    embedded. A file's manifest entry is recorded once all of its chunks are
+    in the collection, and every batch appends the entries it finished to the
+    manifest's journal, so an interrupted run resumes with the files it had
+    not finished. finish() writes the whole manifest once.
     """
-    # 1. Set up ChromaDB client and collection
-    client = chromadb.PersistentClient(path=os.path.abspath(DB_DIR))
-    collection = client.get_or_create_collection(
+
+    def __init__(
+        self,
+        collection,
+        lexical_index,
+        indexed_files,
+        metrics,
+        batch_size=DEFAULT_BATCH_SIZE,
+        vector_store=DEFAULT_VECTOR_STORE,
+        manifest_path=MANIFEST_PATH,
+    ):
+        self.collection = collection
+        self.lexical_index = lexical_index
+        self.indexed_files = indexed_files
+        self.metrics = metrics
+        self.batch_size = batch_size
+        self.vector_store = vector_store
+        self.manifest_path = manifest_path
+        self.stats = {"embedded": 0, "reused": 0, "unchanged": 0, "deleted": 0}
+        self.model = None
+        self._documents, self._metadatas, self._ids = [], [], []
+        # Chunks of each file still waiting to be embedded, and the manifest
+        # entries recorded once they are
+        self._unwritten_chunks = {}
+        self._new_entries = {}
+        # Entries recorded since the last checkpoint
+        self._finished = {}
+
+    def add_file(self, filename, entry, chunks):
+        """
+        Queues a file's (documents, metadatas, ids), embedding full batches.
+        entry is the file's new manifest entry, without its chunk count.
+        """
+        documents, metadatas, ids = chunks
+        to_embed = list(range(len(ids)))
+        if filename in self.indexed_files:
+            to_embed = self._write_unchanged(filename, documents, metadatas, ids)
+
+        entry = dict(entry, chunks=len(ids))
+        if not to_embed:
+            self.indexed_files[filename] = self._finished[filename] = entry
+            return
+        self._new_entries[filename] = entry
+        self._unwritten_chunks[filename] = len(to_embed)
+        for i in to_embed:
+            self._documents.append(documents[i])
+            self._metadatas.append(metadatas[i])
+            self._ids.append(ids[i])
+        while len(self._ids) >= self.batch_size:
+            self.flush(self.batch_size)
+
+    def _write_unchanged(self, filename, documents, metadatas, ids):
+        """
+        Diffs a re-chunked file with its stored chunks: drops the ones it no
+        longer produces and writes unchanged or reusable ones without
+        embedding. Returns the indices of the chunks still to embed.
+        """
+        collection, lexical_index = self.collection, self.lexical_index
+        diff_start = time.perf_counter()
+        existing = collection.get(
+            where={"source_file": filename},
+            include=["documents", "metadatas", "embeddings"],
+        )
+        unchanged, reusable, to_embed, orphan_ids = diff_chunks(
+            existing, metadatas, ids
+        )
+        if orphan_ids:
+            collection.delete(ids=orphan_ids)
+            lexical_index.delete(orphan_ids)
+        if unchanged:
+            # Same text, so only metadata (file_hash, section) is stale
+            collection.update(
+                ids=[ids[i] for i in unchanged],
+                metadatas=[metadatas[i] for i in unchanged],
+            )
+            lexical_index.add(
+                [ids[i] for i in unchanged],
+                [documents[i] for i in unchanged],
+                [metadatas[i] for i in unchanged],
+            )
+        if reusable:
+            collection.upsert(
+                ids=[ids[i] for i in reusable],
+                documents=stored_documents(
+                    [documents[i] for i in reusable],
+                    [metadatas[i] for i in reusable],
+                ),
+                metadatas=[metadatas[i] for i in reusable],
+                embeddings=[list(e) for e in reusable.values()],
+            )
+            lexical_index.add(
+                [ids[i] for i in reusable],
+                [documents[i] for i in reusable],
+                [metadatas[i] for i in reusable],
+            )
+        self.stats["unchanged"] += len(unchanged)
+        self.stats["reused"] += len(reusable)
+        self.stats["deleted"] += len(orphan_ids)
+        self.metrics.add_span("diff", time.perf_counter() - diff_start)
+        return to_embed
+
+    def flush(self, size):
+        """Embeds and writes the first `size` queued chunks."""
+        if self.model is None:
+            # Loaded on first use: re-runs with no new text never pay for it
+            print(f"\n--- Loading embedding model: {EMBEDDING_MODEL} ---")
+            with self.metrics.span("load_model"):
+                self.model = SentenceTransformer(EMBEDDING_MODEL)
+        documents, self._documents = self._documents[:size], self._documents[size:]
+        metadatas, self._metadatas = self._metadatas[:size], self._metadatas[size:]
+        ids, self._ids = self._ids[:size], self._ids[size:]
+        timings = {}
+        try:
+            embed_and_upsert(
+                self.collection, self.model, documents, metadatas, ids, timings
+            )
+            self.stats["embedded"] += len(ids)
+        except Exception as e:
+            print(f"\nError embedding batch starting at {ids[0]}: {e}")
+            self.metrics.error(f"batch starting at {ids[0]}", e)
+            return
+        finally:
+            self.metrics.add_timings(timings)
+
+        with self.metrics.span("lexical_index"):
+            self.lexical_index.add(ids, documents, metadatas)
+            if self.lexical_index.num_pending_docs() >= LEXICAL_COMMIT_CHUNKS:
+                self.lexical_index.commit()
+
+        for metadata in metadatas:
+            filename = metadata["source_file"]
+            self._unwritten_chunks[filename] -= 1
+            if self._unwritten_chunks[filename] == 0:
+                del self._unwritten_chunks[filename]
+                entry = self._new_entries.pop(filename)
+                self.indexed_files[filename] = self._finished[filename] = entry
+        append_manifest(
+            self.collection, self._finished, self.vector_store, self.manifest_path
+        )
+        self._finished = {}
+
+    def finish(self):
+        """Writes the last partial batch, the lexical index and the manifest."""
+        if self._ids:
+            self.flush(len(self._ids))
+        with self.metrics.span("lexical_index"):
+            self.lexical_index.commit()
+        save_manifest(
+            self.collection, self.indexed_files, self.vector_store, self.manifest_path
+        )
+        for name, value in self.stats.items():
+            self.metrics.count(name, value)
+
+
+def remove_shard_map():
+    """Makes qa_agent search the single collection again instead of the shards."""
+    shard_map = os.path.join(SHARDS_DIR, SHARD_MAP_FILE)
+    if os.path.exists(shard_map):
+        print("--- Switching from shards back to the single collection ---")
+        os.remove(shard_map)
+
+
+def open_vector_store(vector_store, db_dir=DB_DIR):
+    """The Chroma collection, or the quantized store that stands in for it."""
+    if vector_store in PRECISIONS:
+        return QuantizedCollection(db_path(db_dir, QUANTIZED_STORE_DIR), vector_store)
+    client = chromadb.PersistentClient(path=os.path.abspath(db_dir))
+    return client.get_or_create_collection(
         name=COLLECTION_NAME, metadata={"hnsw:space": "cosine"}
     )
 
+
+def main(
+    batch_size=DEFAULT_BATCH_SIZE,
+    chunker=DEFAULT_CHUNKER,
+    vector_store=DEFAULT_VECTOR_STORE,
+    db_dir=DB_DIR,
+    text_files=None,
+    profile_file=None,
+    store_text=DEFAULT_TEXT_MODE,
+):
+    """
+    Main function to chunk, embed, and store all processed text files
+    into the ChromaDB vector database. Files are chunked on a producer thread
+    while chunks from many files are embedded together in fixed-size batches.
+    Changed files are diffed chunk by chunk, so only new text is re-embedded.
+    The BM25 lexical index is updated alongside the collection.
+    Shard workers pass their own db_dir and the text files that belong to it.
+    Stage timings, per-file byte counts and errors are written as run metrics;
+    the file named profile_file is chunked under cProfile.
+    With store_text 'offsets', chunk text is read from the processed files at
+    query time instead of being stored in the collection.
+    """
+    stage = "bulk_embedder"
+    if db_dir != DB_DIR:
+        stage += f"_{os.path.basename(db_dir)}"
+    metrics = RunMetrics(stage)
+
+    # 1. Set up ChromaDB client and collection (or the quantized store)
+    collection = open_vector_store(vector_store, db_dir)
+    manifest_path = db_path(db_dir, MANIFEST_PATH)
+
+    lexical_index = LexicalIndex(db_path(db_dir, LEXICAL_INDEX_DIR))
+
     print("Starting bulk embedding process...")
 
     # 2. Get a list of all .txt files to process
-    all_text_files = []
-    for root, _, files in os.walk(PROCESSED_DIR):
-        for file in files:
-            if file.lower().endswith(".txt"):
-                all_text_files.append(os.path.join(root, file))
+    all_text_files = list_text_files() if text_files is None else text_files
 
     if not all_text_files:
         print("No .txt files found to process.")
         return
 
-    # 3. Process each file with a progress bar
-    for filepath in tqdm(all_text_files, desc="Embedding files"):
-        filename = os.path.basename(filepath)
+    # Check which documents have already been processed and added,
+    # using the manifest loaded once instead of one query per file
+    indexed_files = load_manifest(collection, vector_store, manifest_path)
+    sync_lexical_index(collection, lexical_index)
+    remove_deleted_files(
+        collection,
+        lexical_index,
+        indexed_files,
+        {source_filename(filepath) for filepath in all_text_files},
+    )
 
-        # Check if the document has already been processed and added
-        # We query by source_file metadata to check for existence
-        existing_docs = collection.get(where={"source_file": filename})
-        if len(existing_docs["ids"]) > 0:
-            # print(f"Skipping {filename} as it already exists in the collection.")
+    # Files untouched since the last run, and chunked the same way, are skipped
+    # without being read
+    pending_files = []
+    for filepath in all_text_files:
+        filename = source_filename(filepath)
+        if parse_filename(filename) is None:
+            # print(f"Skipping malformed filename: {filename}")
             continue
+        entry = indexed_files.get(filename)
+        if (
+            entry
+            and entry.get("chunker") == chunker_id(chunker, store_text)
+            and all(entry.get(k) == v for k, v in file_stat(filepath).items())
+        ):
+            continue
+        pending_files.append(filepath)
 
-        try:
-            with open(filepath, "r", encoding="utf-8") as f:
-                file_text = f.read()
+    if not pending_files:
+        lexical_index.commit()
+        save_manifest(collection, indexed_files, vector_store, manifest_path)
+        print("All files are already in the collection.")
+        print(f"--- Total items in collection: {collection.count()} ---")
+        return
 
-            # Chunk the document
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=1000, chunk_overlap=200
-            )
-            chunks = text_splitter.create_documents([file_text])
+    # 3. Chunk files on a producer thread, embed in batches on this one
+    chunk_queue = queue.Queue(maxsize=PREFETCH_FILES)
+    producer = threading.Thread(
+        target=produce_chunks,
+        args=(
+            pending_files,
+            indexed_files,
+            chunk_queue,
+            chunker,
+            metrics,
+            profile_file,
+            store_text,
+        ),
+        daemon=True,
+    )
+    producer.start()
 
-            documents = [chunk.page_content for chunk in chunks]
+    writer = BatchWriter(
+        collection,
+        lexical_index,
+        indexed_files,
+        metrics,
+        batch_size,
+        vector_store,
+        manifest_path,
+    )
+    start = time.perf_counter()
 
-            # Create metadata and IDs
-            base_filename = os.path.splitext(filename)[0]
-            parts = base_filename.split("_")
-            if len(parts) < 3:
-                # print(f"Skipping malformed filename: {filename}")
-                continue
-            ticker, form_type, date = parts[0], parts[1], parts[2]
+    desc = "Embedding files"
+    if db_dir != DB_DIR:
+        desc += f" ({os.path.basename(db_dir)})"
+    with tqdm(total=len(pending_files), desc=desc) as progress:
+        while True:
+            item = chunk_queue.get()
+            if item is None:
+                break
+            filename, file_info, chunks, error = item
+            progress.update(1)
 
-            metadatas = [
-                {
-                    "ticker": ticker,
-                    "form_type": form_type,
-                    "date": date,
-                    "source_file": filename,
-                }
-                for _ in documents
-            ]
+            if error is not None:
+                # Already recorded in the metrics by the producer
+                print(f"\nError processing {filename}: {error}")
+                continue
 
-            ids = [f"{base_filename}_chunk_{i}" for i in range(len(documents))]
+            if chunks is None:
+                # Touched but identical content: only refresh size/mtime
+                indexed_files[filename].update(file_info)
+                continue
 
-            # Add to collection if there are any documents to add
-            if documents:
-                collection.add(documents=documents, metadatas=metadatas, ids=ids)
+            try:
+                writer.add_file(filename, file_info, chunks)
+            except Exception as e:
+                print(f"\nError processing {filename}: {e}")
+                metrics.error(filename, e)
 
-        except Exception as e:
-            print(f"\nError processing {filename}: {e}")
+    producer.join()
+    writer.finish()
+    elapsed = time.perf_counter() - start
+    stats = writer.stats
 
     print("\nBulk embedding finished!")
+    print(
+        f"--- Chunks embedded: {stats['embedded']}, reused: {stats['reused']}, "
+        f"unchanged: {stats['unchanged']}, deleted: {stats['deleted']} ---"
+    )
+    if elapsed > 0:
+        print(
+            f"--- Embedded {stats['embedded']} chunks in {elapsed:.1f}s "
+            f"({stats['embedded'] / elapsed:.1f} chunks/sec) ---"
+        )
     print(f"--- Total items in collection: {collection.count()} ---")
+    metrics.write()
+
+
+def index_shard(
+    shard,
+    text_files,
+    batch_size,
+    chunker,
+    vector_store,
+    threads,
+    profile_file=None,
+    store_text=DEFAULT_TEXT_MODE,
+):
+    """Worker process entry point: runs the normal pipeline on one shard."""
+    import torch
+
+    torch.set_num_threads(threads)
+    main(
+        batch_size,
+        chunker,
+        vector_store,
+        db_dir=os.path.join(SHARDS_DIR, shard),
+        text_files=text_files,
+        profile_file=profile_file,
+        store_text=store_text,
+    )
+    return shard
+
+
+def main_sharded(
+    batch_size=DEFAULT_BATCH_SIZE,
+    chunker=DEFAULT_CHUNKER,
+    vector_store=DEFAULT_VECTOR_STORE,
+    shard_by="ticker",
+    num_shards=DEFAULT_NUM_SHARDS,
+    workers=DEFAULT_SHARD_WORKERS,
+    profile_file=None,
+    store_text=DEFAULT_TEXT_MODE,
+):
+    """
+    Splits the processed files into shards by ticker (or ticker hash bucket) and
+    indexes each shard in a separate worker process, so embedding uses every
+    core. Each worker gets an equal share of the CPU threads.
+    """
+    shards = {}
+    for filepath in list_text_files():
+        parsed = parse_filename(source_filename(filepath))
+        if parsed is None:
+            continue
+        shards.setdefault(shard_name(parsed[0], shard_by, num_shards), []).append(
+            filepath
+        )
+    if not shards:
+        print("No .txt files found to process.")
+        return
+
+    workers = max(1, min(workers, len(shards)))
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    print(
+        f"--- Indexing {len(shards)} shards (by {shard_by}) "
+        f"with {workers} worker processes ---"
+    )
+    start = time.perf_counter()
+    failed = []
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context(WORKER_START_METHOD),
+    ) as executor:
+        # Largest shards first, so one big shard doesn't start last
+        futures = {
+            executor.submit(
+                index_shard,
+                shard,
+                files,
+                batch_size,
+                chunker,
+                vector_store,
+                threads,
+                profile_file,
+                store_text,
+            ): shard
+            for shard, files in sorted(shards.items(), key=lambda item: -len(item[1]))
+        }
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                failed.append(futures[future])
+                print(f"\nError indexing shard {futures[future]}: {e}")
+
+    # Only shards that finished are searched; a failed one is retried next run
+    write_shard_map(
+        SHARDS_DIR, shard_by, num_shards, [s for s in shards if s not in failed]
+    )
+    print(
+        f"\n--- Indexed {len(shards) - len(failed)} of {len(shards)} shards "
+        f"in {time.perf_counter() - start:.1f}s ---"
+    )
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(
+        description="Chunk, embed, and index processed SEC filings."
+    )
+    parser.add_argument(
+        "-b",
+        "--batch_size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help="Number of chunks to embed and write per batch.",
+    )
+    parser.add_argument(
+        "--chunker",
+        choices=CHUNKERS,
+        default=DEFAULT_CHUNKER,
+        help="'section' keeps each chunk within one SEC Item; 'recursive' does not.",
+    )
+    parser.add_argument(
+        "--vector_store",
+        choices=VECTOR_STORES,
+        default=DEFAULT_VECTOR_STORE,
+        help="'int8' or 'binary' store quantized vectors for a smaller index.",
+    )
+    parser.add_argument(
+        "--store_text",
+        choices=TEXT_MODES,
+        default=DEFAULT_TEXT_MODE,
+        help="'offsets' keeps only each chunk's position in its processed text "
+        "file and reads the text from there at query time.",
+    )
+
+    parser.add_argument(
+        "--shard_by",
+        choices=SHARD_MODES,
+        help="Build one index per ticker (or ticker hash bucket) in parallel "
+        "worker processes.",
+    )
+    parser.add_argument(
+        "--num_shards",
+        type=int,
+        default=DEFAULT_NUM_SHARDS,
+        help="Number of buckets for --shard_by hash.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_SHARD_WORKERS,
+        help="Worker processes for --shard_by.",
+    )
+
+    parser.add_argument(
+        "--profile_file",
+        metavar="FILENAME",
+        help="Chunk this file (e.g. AAPL_10-K_2023-11-03.txt) under cProfile and "
+        "save the stats next to the run metrics.",
+    )
+
+    args = parser.parse_args()
+    if args.shard_by:
+        main_sharded(
+            args.batch_size,
+            args.chunker,
+            args.vector_store,
+            args.shard_by,
+            args.num_shards,
+            args.workers,
+            args.profile_file,
+            args.store_text,
+        )
+    else:
+        remove_shard_map()
+        main(
+            args.batch_size,
+            args.chunker,
+            args.vector_store,
+            profile_file=args.profile_file,
+            store_text=args.store_text,
+        )
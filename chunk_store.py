@@ -0,0 +1,149 @@
+import os
+import sys
+import mmap
+import threading
+from collections import OrderedDict
+
+# --- CONFIGURATION ---
+
+# How bulk_embedder.py keeps chunk text. 'copy' stores every chunk's text in the
+# vector store; 'offsets' stores only where the chunk sits in its cleaned-text
+# file and reads it from a memory map when a question needs it.
+TEXT_MODES = ["copy", "offsets"]
+DEFAULT_TEXT_MODE = "copy"
+
+# Cleaned text files, laid out as <dir>/<ticker>/<source_file>
+PROCESSED_DIR = "processed_text"
+
+# Metadata fields holding a chunk's UTF-8 byte range in its text file
+START_FIELD = "text_start"
+END_FIELD = "text_end"
+
+# Text files kept mapped at once; the least recently used is closed first
+MAX_OPEN_FILES = 128
+# ---
+
+
+def has_offsets(metadata):
+    return START_FIELD in metadata
+
+
+def text_path(metadata, processed_dir=PROCESSED_DIR):
+    """The uncompressed cleaned-text file a chunk's offsets point into."""
+    return os.path.join(processed_dir, metadata["ticker"], metadata["source_file"])
+
+
+def locate_chunks(text, documents):
+    """
+    UTF-8 byte ranges of documents within text, which they appear in, in order
+    (as text splitters produce them). None for a document that isn't found.
+    """
+    spans = []
+    search_from = 0
+    char_position = byte_position = 0
+    for document in documents:
+        start = text.find(document, search_from) if document else -1
+        if start < 0:
+            spans.append(None)
+            continue
+        byte_position += len(text[char_position:start].encode("utf-8"))
+        char_position = start
+        spans.append((byte_position, byte_position + len(document.encode("utf-8"))))
+        search_from = start + 1
+    return spans
+
+
+def stored_documents(documents, metadatas):
+    """What the vector store keeps as each chunk's document: nothing for offset chunks."""
+    return [
+        "" if has_offsets(metadata) else document
+        for document, metadata in zip(documents, metadatas)
+    ]
+
+
+class ChunkTextReader:
+    """
+    Reads chunk text straight out of memory-mapped cleaned-text files, so the
+    OS page cache holds each filing once however many chunks are retrieved.
+    Thread-safe; maps are opened on first use and kept in a small LRU.
+    """
+
+    def __init__(self, processed_dir=PROCESSED_DIR, max_open_files=MAX_OPEN_FILES):
+        self.processed_dir = processed_dir
+        self.max_open_files = max_open_files
+        self.maps = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _map(self, path):
+        """The file's map, opened if needed; called with the lock held."""
+        mapped = self.maps.get(path)
+        if mapped is not None:
+            self.maps.move_to_end(path)
+            return mapped
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.maps[path] = mapped
+        if len(self.maps) > self.max_open_files:
+            self.maps.popitem(last=False)[1].close()
+        return mapped
+
+    def read(self, metadata, start=None, end=None):
+        """
+        The text of a chunk, or of the byte range [start, end) of its file.
+        Returns "" (with a warning) if the file is gone or shorter than the
+        range, which means it changed since bulk_embedder.py last ran.
+        """
+        start = metadata[START_FIELD] if start is None else start
+        end = metadata[END_FIELD] if end is None else end
+        path = text_path(metadata, self.processed_dir)
+        # Held while slicing, so no other thread closes the map mid-read
+        with self.lock:
+            try:
+                mapped = self._map(path)
+            except (OSError, ValueError) as e:
+                print(
+                    f"--- Could not read chunk text from {path} ({e}) ---",
+                    file=sys.stderr,
+                )
+                return ""
+            if end > len(mapped):
+                print(
+                    f"--- {path} changed since indexing; re-run bulk_embedder.py ---",
+                    file=sys.stderr,
+                )
+                return ""
+            data = mapped[start:end]
+        return data.decode("utf-8", errors="replace")
+
+    def resolve(self, documents, metadatas):
+        """documents with the text of offset chunks filled in from their files."""
+        return [
+            self.read(metadata) if metadata and has_offsets(metadata) else document
+            for document, metadata in zip(documents, metadatas)
+        ]
+
+    def close(self):
+        with self.lock:
+            for mapped in self.maps.values():
+                mapped.close()
+            self.maps.clear()
+
+
+_reader = None
+_reader_lock = threading.Lock()
+
+
+def get_reader():
+    """Returns the shared chunk text reader."""
+    global _reader
+    with _reader_lock:
+        if _reader is None:
+            _reader = ChunkTextReader()
+    return _reader
+
+
+def resolve_documents(documents, metadatas):
+    """Fills in the text of chunks indexed with --store_text offsets."""
+    if not any(metadata and has_offsets(metadata) for metadata in metadatas):
+        return documents
+    return get_reader().resolve(documents, metadatas)
@@ -0,0 +1,219 @@
+import re
+import sys
+import threading
+from chunk_store import get_reader, has_offsets, START_FIELD, END_FIELD
+
+# --- CONFIGURATION ---
+
+# Context sent to the LLM per question, in tokens
+DEFAULT_TOKEN_BUDGET = 3000
+
+# Fast Rust tokenizer used to count tokens; it is the embedding model's, so it
+# is usually cached already. Without it, tokens are estimated from characters.
+TOKENIZER_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+CHARS_PER_TOKEN = 4
+
+# Longest text repeated between neighbouring chunks (bulk_embedder overlaps
+# chunks by 200 characters; splitters may shift the boundary a little)
+MAX_OVERLAP_CHARS = 400
+# Shorter suffix/prefix matches are treated as coincidence
+MIN_OVERLAP_CHARS = 20
+
+# A span whose word shingles are mostly contained in an earlier span is a
+# near-duplicate (e.g. boilerplate repeated across quarterly filings)
+SHINGLE_WORDS = 5
+NEAR_DUPLICATE_CONTAINMENT = 0.8
+
+# A span is cut to fit the remaining budget only if this much room is left
+MIN_PARTIAL_TOKENS = 100
+# ---
+
+WORD_RE = re.compile(r"\w+")
+
+_tokenizer = None
+_tokenizer_loaded = False
+_tokenizer_lock = threading.Lock()
+
+
+def get_tokenizer():
+    """The token-counting tokenizer, loaded once; None if it isn't available."""
+    global _tokenizer, _tokenizer_loaded
+    with _tokenizer_lock:
+        if not _tokenizer_loaded:
+            _tokenizer_loaded = True
+            try:
+                from tokenizers import Tokenizer
+
+                _tokenizer = Tokenizer.from_pretrained(TOKENIZER_MODEL)
+                _tokenizer.no_truncation()
+                _tokenizer.no_padding()
+            except Exception as e:
+                print(
+                    f"--- Tokenizer unavailable ({e}); estimating tokens ---",
+                    file=sys.stderr,
+                )
+    return _tokenizer
+
+
+def count_tokens(texts):
+    """Token counts for a list of texts, encoded in one batch."""
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        return [len(text) // CHARS_PER_TOKEN + 1 for text in texts]
+    return [
+        len(encoding.ids)
+        for encoding in tokenizer.encode_batch(texts, add_special_tokens=False)
+    ]
+
+
+def truncate_to_tokens(text, max_tokens):
+    """The longest prefix of text that is at most max_tokens tokens long."""
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        return text[: max_tokens * CHARS_PER_TOKEN]
+    offsets = tokenizer.encode(text, add_special_tokens=False).offsets
+    if len(offsets) <= max_tokens:
+        return text
+    return text[: offsets[max_tokens][0]]
+
+
+def chunk_number(chunk_id):
+    """Position of a chunk in its file, from IDs like 'AAPL_10-K_2023-11-03_chunk_12'."""
+    try:
+        return int(chunk_id.rsplit("_chunk_", 1)[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def overlap_length(left, right):
+    """Length of the longest suffix of left that is also a prefix of right."""
+    for length in range(min(len(left), len(right), MAX_OVERLAP_CHARS), 0, -1):
+        if length < MIN_OVERLAP_CHARS:
+            break
+        if left.endswith(right[:length]):
+            return length
+    return 0
+
+
+def join_chunks(left, right):
+    """Joins neighbouring chunks, keeping their shared text only once."""
+    overlap = overlap_length(left, right)
+    if overlap:
+        return left + right[overlap:]
+    return left + "\n" + right
+
+
+def byte_range(metadata):
+    """A chunk's (start, end) in its text file, or None if its text is stored."""
+    if not has_offsets(metadata):
+        return None
+    return metadata[START_FIELD], metadata[END_FIELD]
+
+
+def merge_adjacent(ids, documents, metadatas):
+    """
+    Merges chunks that follow each other in the same file (and section) into
+    spans. Returns [(rank, metadata, text)] ordered by each span's best rank,
+    where rank is the retrieval position of its highest-ranked chunk.
+    Spans of chunks with byte offsets are read from their file in one piece
+    instead of being stitched together from overlapping chunks.
+    """
+    by_file = {}
+    for rank, (chunk_id, document, metadata) in enumerate(
+        zip(ids, documents, metadatas)
+    ):
+        number = chunk_number(chunk_id)
+        key = (metadata["source_file"], metadata.get("section"))
+        if number is None:
+            key = (chunk_id,)
+        by_file.setdefault(key, []).append((number or 0, rank, document, metadata))
+
+    spans = []
+
+    def span_text(metadata, text, span_range):
+        """The text of a span that started at metadata's chunk."""
+        if span_range is not None and span_range != byte_range(metadata):
+            return get_reader().read(metadata, *span_range)
+        return text
+
+    for chunks in by_file.values():
+        chunks.sort(key=lambda chunk: chunk[0])
+        number, rank, text, metadata = chunks[0]
+        span_range = byte_range(metadata)
+        for next_number, next_rank, next_text, next_metadata in chunks[1:]:
+            if next_number == number + 1:
+                next_range = byte_range(next_metadata)
+                if span_range is not None and next_range is not None:
+                    span_range = (span_range[0], max(span_range[1], next_range[1]))
+                else:
+                    # A neighbour without offsets: join text from here on
+                    text = join_chunks(span_text(metadata, text, span_range), next_text)
+                    span_range = None
+                rank = min(rank, next_rank)
+            elif next_number != number:
+                spans.append((rank, metadata, span_text(metadata, text, span_range)))
+                rank, text, metadata = next_rank, next_text, next_metadata
+                span_range = byte_range(metadata)
+            number = next_number
+        spans.append((rank, metadata, span_text(metadata, text, span_range)))
+    return sorted(spans, key=lambda span: span[0])
+
+
+def shingles(text):
+    """Hashed word n-grams of a text, for near-duplicate detection."""
+    words = WORD_RE.findall(text.lower())
+    if len(words) < SHINGLE_WORDS:
+        return {hash(tuple(words))}
+    return {
+        hash(tuple(words[i : i + SHINGLE_WORDS]))
+        for i in range(len(words) - SHINGLE_WORDS + 1)
+    }
+
+
+def drop_near_duplicates(spans):
+    """Removes spans whose text mostly repeats a higher-ranked span."""
+    kept = []
+    seen = set()
+    for span in spans:
+        span_shingles = shingles(span[2])
+        if (
+            seen
+            and len(span_shingles & seen) / len(span_shingles)
+            >= NEAR_DUPLICATE_CONTAINMENT
+        ):
+            continue
+        seen |= span_shingles
+        kept.append(span)
+    return kept
+
+
+def format_span(metadata, text):
+    return f"Source File: {metadata['source_file']}\nContent: {text}\n\n---\n\n"
+
+
+def assemble_context(ids, documents, metadatas, token_budget=DEFAULT_TOKEN_BUDGET):
+    """
+    Builds the prompt's context block from retrieved chunks: neighbouring chunks
+    are merged without their overlap, near-duplicates are dropped, and spans are
+    packed best-first into token_budget. A span that doesn't fit is cut to the
+    remaining room when enough is left, otherwise skipped for a shorter one.
+    Returns (context, source files used).
+    """
+    spans = drop_near_duplicates(merge_adjacent(ids, documents, metadatas))
+    blocks = [format_span(metadata, text) for _, metadata, text in spans]
+
+    parts = []
+    sources = set()
+    used = 0
+    for (_, metadata, text), block, tokens in zip(spans, blocks, count_tokens(blocks)):
+        room = token_budget - used
+        if tokens > room:
+            header_tokens = tokens - count_tokens([text])[0]
+            if room - header_tokens < MIN_PARTIAL_TOKENS:
+                continue
+            block = format_span(metadata, truncate_to_tokens(text, room - header_tokens))
+            tokens = room
+        parts.append(block)
+        sources.add(metadata["source_file"])
+        used += tokens
+    return "".join(parts), sorted(sources)
@@ -1,7 +1,15 @@
 import os
-import requests
+import json
 import time
+import random
+import argparse
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
+import storage
+from instrumentation import RunMetrics, timed
 
 # --- CONFIGURATION ---
 
@@ -22,96 +30,411 @@ START_DATE = "2022-01-01"
 # The folder where we will save the data
 DATA_DIR = "data"
 
+# With --sync, the latest filedAt seen per ticker is kept here and each run
+# only asks the API for filings from that day on
+SYNC_STATE_PATH = os.path.join(DATA_DIR, "sync_state.json")
+# A filing that fails this many --sync runs is given up on (its count stays in
+# the sync state), so the ticker's high-water mark can move past it
+MAX_SYNC_ATTEMPTS = 3
+
 # The base URL for the sec-api.io query API
 API_URL = "https://api.sec-api.io"
 
 # NEW LINE: Headers to mimic a browser for downloading from sec.gov
 DOWNLOAD_HEADERS = {"User-Agent": "MyCoolProject/1.0 name@domain.com"}
 
+# Filings per page of the query API (sec-api.io allows at most 50),
+# and the highest 'from' offset it accepts
+PAGE_SIZE = 50
+MAX_OFFSET = 10000
+
+# sec.gov's fair-access policy allows up to 10 requests per second
+SEC_REQUESTS_PER_SECOND = 10
+API_REQUESTS_PER_SECOND = 5
+
+# Concurrent downloads, which is also the size of the connection pool
+MAX_WORKERS = 8
+
+# Retry 429 and 5xx responses (and dropped connections) with exponential backoff
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 5
+BACKOFF_SECONDS = 1.0
+REQUEST_TIMEOUT = 60
+
 # --- SCRIPT ---
 
 
-def download_filings():
+class TokenBucket:
     """
-    Downloads SEC filings for a list of tickers and saves them as HTML files.
+    Thread-safe token bucket: allows `rate` requests per second on average,
+    with bursts of up to `capacity` requests.
     """
-    if not API_KEY:
-        print("Error: SEC_API_KEY not found. Please check your .env file.")
-        return
 
-    print("Starting download process...")
-    # Create the main data directory if it doesn't exist
-    os.makedirs(DATA_DIR, exist_ok=True)
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
 
-    # Headers for the sec-api.io API call
-    api_headers = {"Authorization": API_KEY}
+    def acquire(self):
+        """Blocks until a token is available, then takes it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def create_session(pool_size=MAX_WORKERS):
+    """Creates a session whose connection pool is shared by all worker threads."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def retry_delay(response, attempt):
+    """Seconds to wait before retrying: the server's Retry-After, else exponential backoff."""
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+    return BACKOFF_SECONDS * (2**attempt) * (1 + random.random() / 2)
 
-    for ticker in TICKERS:
-        print(f"\nProcessing Ticker: {ticker}")
 
-        # Create a subdirectory for the ticker
-        ticker_dir = os.path.join(DATA_DIR, ticker)
-        os.makedirs(ticker_dir, exist_ok=True)
+def request_with_retry(session, limiter, method, url, **kwargs):
+    """
+    Sends a rate-limited request, retrying 429/5xx responses and connection
+    errors with backoff. Raises requests.exceptions.RequestException on failure.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        limiter.acquire()
+        try:
+            response = session.request(method, url, timeout=REQUEST_TIMEOUT, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if attempt == MAX_RETRIES:
+                raise
+            time.sleep(retry_delay(None, attempt))
+            continue
+
+        if response.status_code in RETRY_STATUS_CODES and attempt < MAX_RETRIES:
+            time.sleep(retry_delay(response, attempt))
+            continue
+
+        response.raise_for_status()
+        return response
+
+
+def fetch_filing_list(session, limiter, ticker, api_url=API_URL, start_date=START_DATE):
+    """Pages through the query API with the 'from' offset and returns every matching filing."""
+    api_headers = {"Authorization": API_KEY}
+    filings = []
+    offset = 0
 
+    while offset < MAX_OFFSET:
         # Construct the query for the API
         query = {
             "query": {
                 "query_string": {
-                    "query": f"ticker:{ticker} AND formType:({' OR '.join(FILING_TYPES)}) AND filedAt:[{START_DATE} TO *]"
+                    "query": f"ticker:{ticker} AND formType:({' OR '.join(FILING_TYPES)}) AND filedAt:[{start_date} TO *]"
                 }
             },
-            "from": "0",
-            "size": "50",
+            "from": str(offset),
+            "size": str(PAGE_SIZE),
             "sort": [{"filedAt": {"order": "desc"}}],
         }
 
-        # Make the API call to get the list of filings
-        try:
-            response = requests.post(API_URL, json=query, headers=api_headers)
-            response.raise_for_status()
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching filing list for {ticker}: {e}")
-            continue
+        response = request_with_retry(
+            session, limiter, "POST", api_url, json=query, headers=api_headers
+        )
+        page = response.json().get("filings", [])
+        filings.extend(page)
+
+        if len(page) < PAGE_SIZE:
+            break
+        offset += PAGE_SIZE
+
+    return filings
+
+
+def filing_filename(ticker, filing):
+    """Local file name of a filing from the query API, 'TICKER_FORM_DATE.html'."""
+    form_type = filing["formType"].replace("/", "_")
+    filed_at = filing["filedAt"].split("T")[0]
+    return f"{ticker}_{form_type}_{filed_at}.html"
+
+
+def load_sync_state(path=SYNC_STATE_PATH):
+    """
+    Returns {"marks": {ticker: latest filedAt synced}, "failures": {filename:
+    failed sync runs}}, empty before the first sync.
+    """
+    state = {}
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    if "marks" not in state:
+        # Older state files held only the marks
+        state = {"marks": state}
+    state.setdefault("failures", {})
+    return state
+
+
+def save_sync_state(state, path=SYNC_STATE_PATH):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    storage.write_text_atomic(path, json.dumps(state, indent=1, sort_keys=True))
+
+
+def sync_start_date(state, ticker):
+    """First filing date to query for a ticker: the day of its high-water mark."""
+    marks = state.get("marks", {}) if state else {}
+    return marks.get(ticker, START_DATE).split("T")[0]
+
+
+def high_water_mark(filings, finished, previous=None):
+    """
+    The new high-water mark for one ticker's listed filings: the latest
+    filedAt if every filing finished, otherwise the earliest unfinished one,
+    so the next sync lists it again. `finished` tells whether a filing made it.
+    """
+    unfinished = [filing["filedAt"] for filing in filings if not finished(filing)]
+    if unfinished:
+        return min(unfinished)
+    return max([filing["filedAt"] for filing in filings], default=previous)
 
-        filings = response.json().get("filings", [])
 
-        if not filings:
-            print(f"No filings found for {ticker} with the specified criteria.")
+def advance_sync_state(state, ticker, filings, failed):
+    """
+    Moves a ticker's high-water mark past the listed filings after a sync run.
+    failed(filing) tells whether a filing failed this run. Failures are counted
+    per filing, and one that failed MAX_SYNC_ATTEMPTS runs no longer holds the
+    mark back.
+    """
+    failures = state["failures"]
+    retry = set()
+    for filing in filings:
+        filename = filing_filename(ticker, filing)
+        if not failed(filing):
+            failures.pop(filename, None)
             continue
+        failures[filename] = failures.get(filename, 0) + 1
+        if failures[filename] < MAX_SYNC_ATTEMPTS:
+            retry.add(filename)
+        else:
+            print(f"Giving up on {filename} after {failures[filename]} failed syncs")
+
+    mark = high_water_mark(
+        filings,
+        lambda filing: filing_filename(ticker, filing) not in retry,
+        state["marks"].get(ticker),
+    )
+    if mark:
+        state["marks"][ticker] = mark
+
+
+def download_filing(session, limiter, file_url, filepath, timings=None):
+    """
+    Downloads one filing document from sec.gov and saves it to filepath,
+    compressed according to its extension. Returns (bytes downloaded, bytes
+    written); with a timings dict, the fetch and write steps are timed into it.
+    """
+    with timed(timings, "fetch"):
+        file_response = request_with_retry(
+            session, limiter, "GET", file_url, headers=DOWNLOAD_HEADERS
+        )
+    with timed(timings, "write"):
+        storage.write_text_atomic(filepath, file_response.text)
+    return len(file_response.content), os.path.getsize(filepath)
+
 
-        print(f"Found {len(filings)} filings for {ticker}. Downloading...")
+def download_filings(
+    tickers=TICKERS,
+    api_url=API_URL,
+    max_workers=MAX_WORKERS,
+    requests_per_second=SEC_REQUESTS_PER_SECOND,
+    compression=storage.DEFAULT_COMPRESSION,
+    sync=False,
+    sync_state_path=SYNC_STATE_PATH,
+):
+    """
+    Downloads SEC filings for a list of tickers and saves them as HTML files,
+    optionally compressed. Filing lists and documents are fetched concurrently
+    over a pooled session, rate-limited by a token bucket.
+    With sync, only filings since each ticker's saved high-water mark are
+    listed, and the marks are advanced past everything downloaded (or
+    given up on after MAX_SYNC_ATTEMPTS failed runs).
+    Per-filing timings and byte counts are written as run metrics.
+    """
+    if not API_KEY:
+        print("Error: SEC_API_KEY not found. Please check your .env file.")
+        return
+
+    metrics = RunMetrics("download_filings")
+    sync_state = load_sync_state(sync_state_path) if sync else {}
+
+    print("Starting download process...")
+    # Create the main data directory if it doesn't exist
+    os.makedirs(DATA_DIR, exist_ok=True)
+
+    session = create_session(max_workers)
+    api_limiter = TokenBucket(API_REQUESTS_PER_SECOND)
+    sec_limiter = TokenBucket(requests_per_second)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # 1. Fetch every ticker's filing list in parallel
+        def timed_filing_list(ticker):
+            start_date = sync_start_date(sync_state, ticker)
+            with metrics.span("list"):
+                return fetch_filing_list(
+                    session, api_limiter, ticker, api_url, start_date
+                )
+
+        list_futures = {
+            executor.submit(timed_filing_list, ticker): ticker for ticker in tickers
+        }
 
-        for filing in filings:
-            file_url = filing["linkToFilingDetails"]
-            form_type = filing["formType"].replace("/", "_")
-            filed_at = filing["filedAt"].split("T")[0]
+        download_futures = {}
+        queued_paths = set()
+        listed = {}
+        skipped = 0
+        for future in as_completed(list_futures):
+            ticker = list_futures[future]
+            try:
+                filings = future.result()
+            except requests.exceptions.RequestException as e:
+                print(f"Error fetching filing list for {ticker}: {e}")
+                metrics.error(ticker, e)
+                continue
 
-            filename = f"{ticker}_{form_type}_{filed_at}.html"
-            filepath = os.path.join(ticker_dir, filename)
+            listed[ticker] = filings
+            if not filings:
+                print(f"No filings found for {ticker} with the specified criteria.")
+                continue
 
-            if not os.path.exists(filepath):
-                try:
-                    time.sleep(1)
+            print(f"Found {len(filings)} filings for {ticker}. Downloading...")
 
-                    print(f"  -> Downloading {filename}")
+            # Create a subdirectory for the ticker
+            ticker_dir = os.path.join(DATA_DIR, ticker)
+            os.makedirs(ticker_dir, exist_ok=True)
 
-                    # NEW LINE: Use the DOWNLOAD_HEADERS for this request
-                    file_response = requests.get(file_url, headers=DOWNLOAD_HEADERS)
-                    file_response.raise_for_status()
+            # 2. Queue every filing we don't already have for download
+            for filing in filings:
+                file_url = filing["linkToFilingDetails"]
+                filepath = os.path.join(ticker_dir, filing_filename(ticker, filing))
 
-                    with open(filepath, "w", encoding="utf-8") as f:
-                        f.write(file_response.text)
+                if storage.find_existing(filepath) or filepath in queued_paths:
+                    skipped += 1
+                    continue
+                queued_paths.add(filepath)
 
-                except requests.exceptions.RequestException as e:
-                    print(f"    - Could not download {filename}. Reason: {e}")
-                except Exception as e:
-                    print(
-                        f"    - An error occurred while saving {filename}. Reason: {e}"
-                    )
-            else:
-                print(f"  -> Skipping {filename} (already exists)")
+                filepath = storage.with_compression(filepath, compression)
+                timings = {}
+                future = executor.submit(
+                    download_filing, session, sec_limiter, file_url, filepath, timings
+                )
+                download_futures[future] = (filepath, timings, time.perf_counter())
+
+        downloaded = failed = 0
+        failed_paths = set()
+        for future in as_completed(download_futures):
+            filepath, timings, submitted = download_futures[future]
+            filename = os.path.basename(filepath)
+            bytes_in = bytes_out = error = None
+            try:
+                bytes_in, bytes_out = future.result()
+                downloaded += 1
+                print(f"  -> Downloaded {filename}")
+            except requests.exceptions.RequestException as e:
+                failed += 1
+                error = str(e)
+                print(f"    - Could not download {filename}. Reason: {e}")
+            except Exception as e:
+                failed += 1
+                error = str(e) or type(e).__name__
+                print(f"    - An error occurred while saving {filename}. Reason: {e}")
+            if error is not None:
+                failed_paths.add(storage.split_compression(filepath)[0])
+            # Seconds from queueing to completion include waiting for a worker
+            # and the rate limiter; the fetch and write timings don't
+            metrics.record_file(
+                filepath,
+                time.perf_counter() - submitted,
+                bytes_in,
+                bytes_out,
+                error,
+                timings,
+            )
+
+    if sync:
+        for ticker, filings in listed.items():
+            ticker_dir = os.path.join(DATA_DIR, ticker)
+            advance_sync_state(
+                sync_state,
+                ticker,
+                filings,
+                lambda filing: os.path.join(ticker_dir, filing_filename(ticker, filing))
+                in failed_paths,
+            )
+        save_sync_state(sync_state, sync_state_path)
+
+    metrics.count("downloaded", downloaded)
+    metrics.count("skipped", skipped)
+    metrics.count("failed", failed)
+    print(
+        f"\nDownloaded: {downloaded}, skipped (already exist): {skipped}, failed: {failed}"
+    )
+    metrics.write()
 
 
 if __name__ == "__main__":
-    download_filings()
+    parser = argparse.ArgumentParser(description="Download SEC filings as HTML.")
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=MAX_WORKERS,
+        help="Number of concurrent downloads.",
+    )
+    parser.add_argument(
+        "-r",
+        "--rate",
+        type=float,
+        default=SEC_REQUESTS_PER_SECOND,
+        help="Maximum requests per second to sec.gov.",
+    )
+    parser.add_argument(
+        "-c",
+        "--compression",
+        choices=storage.COMPRESSIONS,
+        default=storage.DEFAULT_COMPRESSION,
+        help="Compression for the downloaded HTML files.",
+    )
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help=f"Only fetch filings newer than the last sync (state in {SYNC_STATE_PATH}).",
+    )
+    parser.add_argument(
+        "--api_url",
+        default=API_URL,
+        help="Query API endpoint, e.g. a local stub_sec_api.py server.",
+    )
+
+    args = parser.parse_args()
+    download_filings(
+        api_url=args.api_url,
+        max_workers=args.workers,
+        requests_per_second=args.rate,
+        compression=args.compression,
+        sync=args.sync,
+    )
     print("\nDownload process finished.")
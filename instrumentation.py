@@ -0,0 +1,220 @@
+import os
+import sys
+import csv
+import json
+import time
+import uuid
+import cProfile
+import threading
+from contextlib import contextmanager
+
+# --- CONFIGURATION ---
+
+# Each run writes <stage>_<run id>.json (spans, counters, totals, errors) and,
+# when it handled files, <stage>_<run id>_files.csv with one row per file
+METRICS_DIR = "metrics"
+
+# Number of slowest files listed in the JSON summary
+SLOWEST_FILES_IN_SUMMARY = 20
+# ---
+
+
+def new_run_id():
+    """
+    Timestamp plus a random suffix, so runs started in the same second (or
+    several runs in one process) don't overwrite each other's files.
+    """
+    return f"{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+
+
+def peak_rss_mb(children=False):
+    """
+    Peak resident set size so far in MB: of this process, or with children of
+    the largest finished child process (e.g. pool workers). None where unsupported.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    peak = resource.getrusage(who).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+@contextmanager
+def timed(timings, name):
+    """Adds the seconds spent in the block to timings[name]; a no-op if timings is None."""
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+
+def profile_call(path, func, *args, **kwargs):
+    """
+    Runs func under cProfile and dumps the stats to path (inspect with
+    `python -m pstats path`). Returns func's result.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        profiler.dump_stats(path)
+        print(f"--- cProfile stats written to {path} ---")
+
+
+class RunMetrics:
+    """
+    Collects metrics for one run of a pipeline stage: named timing spans
+    (count, total and slowest seconds), counters, one record per file with
+    its byte counts and per-step timings, and errors. Thread-safe, so worker
+    threads can record into the same run; worker processes return their
+    timings and the parent records them.
+    """
+
+    def __init__(self, stage, metrics_dir=METRICS_DIR):
+        self.stage = stage
+        self.metrics_dir = metrics_dir
+        self.run_id = new_run_id()
+        self.started = time.strftime("%Y-%m-%dT%H:%M:%S")
+        self.start = time.perf_counter()
+        self.spans = {}
+        self.counters = {}
+        self.files = []
+        self.errors = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name):
+        """Times the block as one occurrence of the span `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_span(name, time.perf_counter() - start)
+
+    def add_span(self, name, seconds):
+        with self.lock:
+            span = self.spans.setdefault(
+                name, {"count": 0, "seconds": 0.0, "max_seconds": 0.0}
+            )
+            span["count"] += 1
+            span["seconds"] += seconds
+            span["max_seconds"] = max(span["max_seconds"], seconds)
+
+    def add_timings(self, timings):
+        """Records a {span name: seconds} dict, e.g. one returned by a worker."""
+        for name, seconds in timings.items():
+            self.add_span(name, seconds)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def error(self, item, error):
+        """Records a failure that the stage reported and moved past."""
+        with self.lock:
+            self.errors.append({"item": item, "error": str(error) or type(error).__name__})
+
+    def record_file(
+        self,
+        path,
+        seconds,
+        bytes_in=None,
+        bytes_out=None,
+        error=None,
+        timings=None,
+        **fields,
+    ):
+        """
+        Records one processed file: total seconds, bytes read and written,
+        its per-step timings (also added to the run's spans) and any error.
+        """
+        record = {
+            "file": os.path.basename(path),
+            "seconds": round(seconds, 4),
+            "bytes_in": bytes_in,
+            "bytes_out": bytes_out,
+            "error": error,
+        }
+        record.update(fields)
+        for name, step_seconds in (timings or {}).items():
+            record[f"{name}_seconds"] = round(step_seconds, 4)
+        if timings:
+            self.add_timings(timings)
+        if error:
+            self.error(record["file"], error)
+        with self.lock:
+            self.files.append(record)
+
+    def summary(self):
+        """The run's metrics as a JSON-serializable dict."""
+        with self.lock:
+            spans = {
+                name: {
+                    "count": span["count"],
+                    "seconds": round(span["seconds"], 4),
+                    "mean_seconds": round(span["seconds"] / span["count"], 4),
+                    "max_seconds": round(span["max_seconds"], 4),
+                }
+                for name, span in sorted(
+                    self.spans.items(), key=lambda item: -item[1]["seconds"]
+                )
+            }
+            files = list(self.files)
+            return {
+                "stage": self.stage,
+                "run_id": self.run_id,
+                "started": self.started,
+                "wall_seconds": round(time.perf_counter() - self.start, 3),
+                "peak_rss_mb": peak_rss_mb(),
+                "peak_rss_children_mb": peak_rss_mb(children=True),
+                "counters": dict(self.counters),
+                "spans": spans,
+                "files": len(files),
+                "bytes_in": sum(f["bytes_in"] or 0 for f in files),
+                "bytes_out": sum(f["bytes_out"] or 0 for f in files),
+                "slowest_files": [
+                    {"file": f["file"], "seconds": f["seconds"]}
+                    for f in sorted(files, key=lambda f: -f["seconds"])[
+                        :SLOWEST_FILES_IN_SUMMARY
+                    ]
+                ],
+                "errors": list(self.errors),
+            }
+
+    def profile_path(self, name):
+        """Where a cProfile dump for `name` goes in this run."""
+        return os.path.join(
+            self.metrics_dir, f"{self.stage}_{self.run_id}_{os.path.basename(name)}.prof"
+        )
+
+    def write(self, log=None):
+        """
+        Writes the JSON summary and the per-file CSV, and says where on `log`
+        (stdout by default). Returns the JSON path.
+        """
+        os.makedirs(self.metrics_dir, exist_ok=True)
+        base = os.path.join(self.metrics_dir, f"{self.stage}_{self.run_id}")
+        with open(base + ".json", "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, indent=2)
+
+        with self.lock:
+            files = list(self.files)
+        if files:
+            columns = []
+            for record in files:
+                columns += [key for key in record if key not in columns]
+            with open(base + "_files.csv", "w", encoding="utf-8", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=columns)
+                writer.writeheader()
+                writer.writerows(files)
+
+        print(f"--- Metrics written to {base}.json ---", file=log)
+        return base + ".json"
@@ -0,0 +1,509 @@
+import os
+import re
+import json
+import shutil
+import hashlib
+import tempfile
+from collections import Counter
+import numpy as np
+
+# --- CONFIGURATION ---
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Compact into a single segment once a run leaves more than this many
+MAX_SEGMENTS = 8
+
+# Query terms found in more than this fraction of chunks carry almost no BM25
+# weight (idf < ln 2) and are skipped when the query has rarer terms
+MAX_DF_FRACTION = 0.5
+
+# Metadata stored per chunk so lexical search can honour Chroma-style filters
+CODED_FIELDS = ["ticker", "form_type", "section"]
+
+# Very common words add nothing to BM25 ranking but make postings long
+STOPWORDS = set(
+    "a an and are as at be by for from has have in is it its of on or that the "
+    "their this to was were what which who will with".split()
+)
+# ---
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+_term_hashes = {}
+
+
+def tokenize(text):
+    """Lowercased alphanumeric tokens, minus stopwords ('CET1 ratio' -> cet1, ratio)."""
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+def term_hash(term):
+    """Stable 64-bit hash of a term; postings are keyed by these instead of strings."""
+    value = _term_hashes.get(term)
+    if value is None:
+        digest = hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest()
+        value = _term_hashes[term] = int.from_bytes(digest, "little")
+    return value
+
+
+def date_to_int(value):
+    """'2024-11-01' (or 20241101) -> 20241101, so dates compare numerically."""
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    try:
+        return int(str(value).replace("-", "")[:8] or 0)
+    except ValueError:
+        # Unparseable dates (e.g. "A" from older amended-filing metadata) sort first
+        return 0
+
+
+def _save_array(directory, name, array):
+    np.save(os.path.join(directory, name + ".npy"), array)
+
+
+def _load_array(directory, name):
+    # Plain ndarray view of the mapping, without np.memmap's per-index overhead
+    return np.load(os.path.join(directory, name + ".npy"), mmap_mode="r").view(
+        np.ndarray
+    )
+
+
+class Segment:
+    """One immutable, memory-mapped slice of the index, plus its deletion mask."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.term_hashes = _load_array(directory, "term_hashes")
+        self.term_offsets = _load_array(directory, "term_offsets")
+        self.post_docs = _load_array(directory, "post_docs")
+        self.post_tfs = _load_array(directory, "post_tfs")
+        self.doc_lengths = _load_array(directory, "doc_lengths")
+        self.doc_dates = _load_array(directory, "doc_dates")
+        self.doc_id_offsets = _load_array(directory, "doc_id_offsets")
+        self.codes = {}
+        for field in CODED_FIELDS:
+            if os.path.exists(os.path.join(directory, f"doc_{field}.npy")):
+                self.codes[field] = _load_array(directory, f"doc_{field}")
+            else:
+                # Segments written before the field existed: every chunk lacks it
+                self.meta["codes"][field] = [None]
+                self.codes[field] = np.zeros(self.num_docs, dtype=np.uint16)
+        self.doc_id_blob = (
+            np.memmap(
+                os.path.join(directory, "doc_ids.bin"), dtype=np.uint8, mode="r"
+            ).view(np.ndarray)
+            if self.meta["num_docs"]
+            else np.zeros(0, dtype=np.uint8)
+        )
+        deleted_path = os.path.join(directory, "deleted.npy")
+        self.deleted = (
+            np.load(deleted_path)
+            if os.path.exists(deleted_path)
+            else np.zeros(self.meta["num_docs"], dtype=bool)
+        )
+        self._norms = None
+
+    @property
+    def num_docs(self):
+        return self.meta["num_docs"]
+
+    def length_norms(self, avg_length):
+        """BM25 length normalisation per doc, cached for the current average length."""
+        if self._norms is None or self._norms[0] != avg_length:
+            lengths = np.asarray(self.doc_lengths, dtype=np.float32)
+            self._norms = (
+                avg_length,
+                BM25_K1 * (1 - BM25_B + BM25_B * lengths / avg_length),
+            )
+        return self._norms[1]
+
+    def doc_id(self, doc):
+        start, end = self.doc_id_offsets[doc], self.doc_id_offsets[doc + 1]
+        return bytes(self.doc_id_blob[start:end]).decode("utf-8")
+
+    def all_doc_ids(self):
+        blob = bytes(self.doc_id_blob).decode("utf-8")
+        offsets = np.asarray(self.doc_id_offsets)
+        # IDs are ASCII in practice; fall back to byte slicing otherwise
+        if len(blob) == len(self.doc_id_blob):
+            return [blob[offsets[i] : offsets[i + 1]] for i in range(self.num_docs)]
+        return [self.doc_id(i) for i in range(self.num_docs)]
+
+    def postings(self, hashes):
+        """Returns {hash: (docs, tfs)} for the query terms present in this segment."""
+        found = {}
+        if not len(self.term_hashes):
+            return found
+        positions = np.searchsorted(self.term_hashes, hashes)
+        for h, pos in zip(hashes, positions):
+            if pos < len(self.term_hashes) and self.term_hashes[pos] == h:
+                start, end = self.term_offsets[pos], self.term_offsets[pos + 1]
+                found[int(h)] = (self.post_docs[start:end], self.post_tfs[start:end])
+        return found
+
+    def filter_mask(self, where, docs):
+        """Evaluates a Chroma-style where filter on the given docs."""
+        if not where:
+            return np.ones(len(docs), dtype=bool)
+        mask = np.ones(len(docs), dtype=bool)
+        for key, condition in where.items():
+            if key == "$and":
+                for sub in condition:
+                    mask &= self.filter_mask(sub, docs)
+            elif key == "$or":
+                any_mask = np.zeros(len(docs), dtype=bool)
+                for sub in condition:
+                    any_mask |= self.filter_mask(sub, docs)
+                mask &= any_mask
+            else:
+                mask &= self._field_mask(key, condition, docs)
+        return mask
+
+    def _field_mask(self, field, condition, docs):
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+
+        if field == "date":
+            values = np.asarray(self.doc_dates[docs])
+            convert = date_to_int
+        elif field in self.codes:
+            values = np.asarray(self.codes[field][docs])
+            lookup = {v: i for i, v in enumerate(self.meta["codes"][field])}
+            convert = lambda v: lookup.get(v, -1)  # noqa: E731
+        else:
+            # Fields the lexical index doesn't store never restrict results
+            return np.ones(len(docs), dtype=bool)
+
+        mask = np.ones(len(docs), dtype=bool)
+        for op, operand in condition.items():
+            if op == "$eq":
+                mask &= values == convert(operand)
+            elif op == "$ne":
+                mask &= values != convert(operand)
+            elif op == "$in":
+                mask &= np.isin(values, [convert(v) for v in operand])
+            elif op == "$nin":
+                mask &= ~np.isin(values, [convert(v) for v in operand])
+            elif op == "$gt":
+                mask &= values > convert(operand)
+            elif op == "$gte":
+                mask &= values >= convert(operand)
+            elif op == "$lt":
+                mask &= values < convert(operand)
+            elif op == "$lte":
+                mask &= values <= convert(operand)
+        return mask
+
+
+def write_segment(directory, ids, documents, metadatas):
+    """Tokenizes chunks and writes them as a new segment directory."""
+    os.makedirs(directory)
+    codes = {field: [] for field in CODED_FIELDS}
+    code_lookup = {field: {} for field in CODED_FIELDS}
+    doc_codes = {field: np.zeros(len(ids), dtype=np.uint16) for field in CODED_FIELDS}
+    doc_lengths = np.zeros(len(ids), dtype=np.uint32)
+    doc_dates = np.zeros(len(ids), dtype=np.int32)
+
+    # Map tokens to per-segment term numbers, then count (doc, term) pairs in numpy
+    vocabulary = {}
+    term_numbers = []
+    for doc, (document, metadata) in enumerate(zip(documents, metadatas)):
+        tokens = [vocabulary.setdefault(t, len(vocabulary)) for t in tokenize(document)]
+        doc_lengths[doc] = len(tokens)
+        term_numbers.append(tokens)
+        doc_dates[doc] = date_to_int(metadata.get("date", 0))
+        for field in CODED_FIELDS:
+            value = metadata.get(field)
+            if value not in code_lookup[field]:
+                code_lookup[field][value] = len(codes[field])
+                codes[field].append(value)
+            doc_codes[field][doc] = code_lookup[field][value]
+
+    hashes = np.array([term_hash(t) for t in vocabulary], dtype=np.uint64)
+    all_terms = np.fromiter(
+        (t for tokens in term_numbers for t in tokens),
+        dtype=np.int64,
+        count=int(doc_lengths.sum()),
+    )
+    all_docs = np.repeat(np.arange(len(ids), dtype=np.int64), doc_lengths)
+    pairs, tfs = np.unique(
+        all_docs * max(len(vocabulary), 1) + all_terms, return_counts=True
+    )
+    post_docs, post_terms = np.divmod(pairs, max(len(vocabulary), 1))
+
+    _write_postings(
+        directory,
+        hashes[post_terms],
+        post_docs.astype(np.uint32),
+        np.minimum(tfs, 65535).astype(np.uint16),
+    )
+    _write_docs(directory, ids, doc_lengths, doc_dates, doc_codes, codes)
+
+
+def _write_postings(directory, hashes, docs, tfs):
+    order = np.lexsort((docs, hashes))
+    hashes, docs, tfs = hashes[order], docs[order], tfs[order]
+    term_hashes, starts = np.unique(hashes, return_index=True)
+    _save_array(directory, "term_hashes", term_hashes)
+    _save_array(
+        directory, "term_offsets", np.append(starts, len(hashes)).astype(np.int64)
+    )
+    _save_array(directory, "post_docs", docs)
+    _save_array(directory, "post_tfs", tfs)
+
+
+def _write_docs(directory, ids, doc_lengths, doc_dates, doc_codes, codes):
+    encoded = [chunk_id.encode("utf-8") for chunk_id in ids]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(e) for e in encoded])
+    with open(os.path.join(directory, "doc_ids.bin"), "wb") as f:
+        f.write(b"".join(encoded))
+    _save_array(directory, "doc_id_offsets", offsets)
+    _save_array(directory, "doc_lengths", doc_lengths)
+    _save_array(directory, "doc_dates", doc_dates)
+    for field in CODED_FIELDS:
+        _save_array(directory, f"doc_{field}", doc_codes[field])
+    meta = {
+        "num_docs": len(ids),
+        "total_length": int(np.sum(doc_lengths, dtype=np.int64)),
+        "codes": codes,
+    }
+    with open(os.path.join(directory, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index stored next to the Chroma collection.
+    Each commit writes a new immutable segment of array-backed postings (sorted
+    64-bit term hashes, offsets, doc numbers and term frequencies) that is
+    memory-mapped at query time. Replaced or deleted chunks are masked out per
+    segment, and segments are merged once there are more than MAX_SEGMENTS.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.segment_names = []
+        self.next_segment = 0
+        index_file = os.path.join(path, "index.json")
+        if os.path.exists(index_file):
+            with open(index_file, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            self.segment_names = state["segments"]
+            self.next_segment = state["next_segment"]
+        self.segments = [
+            Segment(os.path.join(path, name)) for name in self.segment_names
+        ]
+
+        # Write-side state, built lazily
+        self._locations = None
+        self._pending = {}
+        self._dirty_segments = set()
+
+    # --- reading ---
+
+    def num_live_docs(self):
+        """Number of chunks currently searchable (excluding deleted ones)."""
+        return sum(int(s.num_docs - np.count_nonzero(s.deleted)) for s in self.segments)
+
+    def search(self, query_text, k=10, where=None):
+        """Returns up to k (chunk_id, bm25_score) pairs, best first."""
+        hashes = np.array(
+            sorted({term_hash(t) for t in tokenize(query_text)}), dtype=np.uint64
+        )
+        if not len(hashes) or not self.segments:
+            return []
+
+        total_docs = sum(s.num_docs for s in self.segments)
+        avg_length = max(
+            sum(s.meta["total_length"] for s in self.segments) / total_docs, 1
+        )
+
+        per_segment = [segment.postings(hashes) for segment in self.segments]
+        df = Counter()
+        for found in per_segment:
+            for h, (docs, _) in found.items():
+                df[h] += len(docs)
+        common = {h for h in df if df[h] > MAX_DF_FRACTION * total_docs}
+        if common != set(df):
+            per_segment = [
+                {h: p for h, p in found.items() if h not in common}
+                for found in per_segment
+            ]
+
+        results = []
+        for segment, found in zip(self.segments, per_segment):
+            if not found:
+                continue
+            norms = segment.length_norms(avg_length)
+            scores = np.zeros(segment.num_docs, dtype=np.float32)
+            for h, (docs, tfs) in found.items():
+                idf = np.log(1 + (total_docs - df[h] + 0.5) / (df[h] + 0.5))
+                tfs = np.asarray(tfs, dtype=np.float32)
+                # A term lists each doc once, so a plain indexed add is safe
+                scores[docs] += idf * (BM25_K1 + 1) * tfs / (tfs + norms[docs])
+
+            num_postings = sum(len(docs) for docs, _ in found.values())
+            if num_postings < segment.num_docs // 16:
+                docs = np.sort(np.concatenate([docs for docs, _ in found.values()]))
+                docs = docs[np.append(True, docs[1:] != docs[:-1])]
+            else:
+                docs = np.flatnonzero(scores)
+            docs = docs[~segment.deleted[docs]]
+            docs = docs[segment.filter_mask(where, docs)]
+            if len(docs) > k:
+                docs = docs[np.argpartition(-scores[docs], k)[:k]]
+            results.extend((segment.doc_id(d), float(scores[d])) for d in docs)
+
+        results.sort(key=lambda r: r[1], reverse=True)
+        return results[:k]
+
+    # --- writing ---
+
+    def _build_locations(self):
+        if self._locations is None:
+            self._locations = {}
+            for number, segment in enumerate(self.segments):
+                for doc, chunk_id in enumerate(segment.all_doc_ids()):
+                    if not segment.deleted[doc]:
+                        self._locations[chunk_id] = (number, doc)
+        return self._locations
+
+    def _mask(self, chunk_id):
+        location = self._build_locations().pop(chunk_id, None)
+        if location is not None:
+            number, doc = location
+            self.segments[number].deleted[doc] = True
+            self._dirty_segments.add(number)
+
+    def add(self, ids, documents, metadatas):
+        """Queues chunks for the next commit, replacing any chunk with the same ID."""
+        for chunk_id, document, metadata in zip(ids, documents, metadatas):
+            self._mask(chunk_id)
+            self._pending[chunk_id] = (document, metadata)
+
+    def delete(self, ids):
+        """Removes chunks from the index at the next commit."""
+        for chunk_id in ids:
+            self._mask(chunk_id)
+            self._pending.pop(chunk_id, None)
+
+    def num_pending_docs(self):
+        return len(self._pending)
+
+    def has_pending_changes(self):
+        return bool(self._pending or self._dirty_segments)
+
+    def commit(self):
+        """Writes queued chunks as a new segment and persists deletions."""
+        if not self.has_pending_changes():
+            return
+        os.makedirs(self.path, exist_ok=True)
+
+        if self._pending:
+            name = f"seg_{self.next_segment:06d}"
+            self.next_segment += 1
+            ids = list(self._pending)
+            documents = [self._pending[i][0] for i in ids]
+            metadatas = [self._pending[i][1] for i in ids]
+            write_segment(os.path.join(self.path, name), ids, documents, metadatas)
+            self.segment_names.append(name)
+            self.segments.append(Segment(os.path.join(self.path, name)))
+            locations = self._build_locations()
+            for doc, chunk_id in enumerate(ids):
+                locations[chunk_id] = (len(self.segments) - 1, doc)
+            self._pending = {}
+
+        for number in self._dirty_segments:
+            segment = self.segments[number]
+            fd, tmp_path = tempfile.mkstemp(dir=segment.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, segment.deleted)
+            os.replace(tmp_path, os.path.join(segment.directory, "deleted.npy"))
+        self._dirty_segments = set()
+
+        if len(self.segments) > MAX_SEGMENTS:
+            self._compact()
+        self._save_state()
+
+    def _save_state(self):
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(
+                {"segments": self.segment_names, "next_segment": self.next_segment}, f
+            )
+        os.replace(tmp_path, os.path.join(self.path, "index.json"))
+
+        # Remove segment directories no longer referenced
+        for name in os.listdir(self.path):
+            if name.startswith("seg_") and name not in self.segment_names:
+                shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+
+    def _compact(self):
+        """Merges segments into one, dropping deleted chunks, without re-tokenizing."""
+        hashes, docs, tfs = [], [], []
+        ids, lengths, dates = [], [], []
+        codes = {field: [] for field in CODED_FIELDS}
+        doc_codes = {field: [] for field in CODED_FIELDS}
+        base = 0
+        for segment in self.segments:
+            keep = ~segment.deleted
+            new_numbers = np.cumsum(keep) - 1 + base
+
+            for start, end, h in zip(
+                segment.term_offsets[:-1], segment.term_offsets[1:], segment.term_hashes
+            ):
+                seg_docs = np.asarray(segment.post_docs[start:end])
+                live = keep[seg_docs]
+                hashes.append(np.full(np.count_nonzero(live), h, dtype=np.uint64))
+                docs.append(new_numbers[seg_docs[live]].astype(np.uint32))
+                tfs.append(np.asarray(segment.post_tfs[start:end])[live])
+
+            kept_docs = np.flatnonzero(keep)
+            seg_ids = segment.all_doc_ids()
+            ids.extend(seg_ids[d] for d in kept_docs)
+            lengths.append(np.asarray(segment.doc_lengths)[kept_docs])
+            dates.append(np.asarray(segment.doc_dates)[kept_docs])
+            for field in CODED_FIELDS:
+                remap = []
+                for value in segment.meta["codes"][field]:
+                    if value not in codes[field]:
+                        codes[field].append(value)
+                    remap.append(codes[field].index(value))
+                remap = np.array(remap or [0], dtype=np.uint16)
+                doc_codes[field].append(
+                    remap[np.asarray(segment.codes[field])[kept_docs]]
+                )
+            base += len(kept_docs)
+
+        name = f"seg_{self.next_segment:06d}"
+        self.next_segment += 1
+        directory = os.path.join(self.path, name)
+        os.makedirs(directory)
+        _write_postings(
+            directory,
+            np.concatenate(hashes) if hashes else np.zeros(0, dtype=np.uint64),
+            np.concatenate(docs) if docs else np.zeros(0, dtype=np.uint32),
+            np.concatenate(tfs) if tfs else np.zeros(0, dtype=np.uint16),
+        )
+        _write_docs(
+            directory,
+            ids,
+            np.concatenate(lengths).astype(np.uint32),
+            np.concatenate(dates).astype(np.int32),
+            {f: np.concatenate(doc_codes[f]).astype(np.uint16) for f in CODED_FIELDS},
+            codes,
+        )
+        self.segment_names = [name]
+        self.segments = [Segment(directory)]
+        self._locations = None
+
+    def clear(self):
+        """Drops every segment, e.g. before rebuilding the index from the collection."""
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.__init__(self.path)
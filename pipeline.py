@@ -0,0 +1,488 @@
+import os
+import time
+import queue
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from tqdm import tqdm
+import storage
+import bulk_embedder
+import download_filings
+from process_all_files import clean_html
+from lexical_index import LexicalIndex
+from instrumentation import RunMetrics, timed
+
+# --- CONFIGURATION ---
+
+# Filings waiting between stages. A full queue makes the stage before it wait,
+# so memory stays bounded however far downloads get ahead of embedding.
+DEFAULT_QUEUE_SIZE = 16
+
+# Processes that clean and chunk filings, each with a couple of filings in flight
+DEFAULT_CLEAN_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+CLEAN_IN_FLIGHT_PER_WORKER = 2
+
+# High-water marks for --sync, next to the index they describe (separate from
+# download_filings.py's, which track downloads rather than indexed filings)
+SYNC_STATE_PATH = os.path.join(bulk_embedder.DB_DIR, "sync_state.json")
+# ---
+
+
+def text_filename(ticker, filing):
+    """Name of a filing's cleaned text, as process_all_files.py would write it."""
+    raw_name = download_filings.filing_filename(ticker, filing)
+    return os.path.splitext(raw_name)[0] + ".txt"
+
+
+def clean_and_chunk(filename, html, chunker):
+    """
+    Worker process: cleans one filing's HTML and chunks the text.
+    Returns (text, file_hash, (documents, metadatas, ids), timings).
+    """
+    timings = {}
+    text = clean_html(html, timings)
+    if not text:
+        raise ValueError("no text extracted")
+    with timed(timings, "hash"):
+        file_hash = bulk_embedder.hash_text(text)
+    with timed(timings, "chunk"):
+        chunks = bulk_embedder.chunk_text(
+            filename,
+            text,
+            file_hash,
+            bulk_embedder.make_text_splitter(chunker),
+            by_section=chunker == "section",
+            chunker=bulk_embedder.chunker_id(chunker),
+        )
+    return text, file_hash, chunks, timings
+
+
+def run_stage(stage, errors, out_queue, *args):
+    """
+    Thread body: runs one stage, recording an exception that stops it in
+    `errors`, and always ends out_queue with a None so the next stage finishes.
+    """
+    try:
+        stage(*args)
+    except BaseException as e:
+        errors.append(e)
+    finally:
+        out_queue.put(None)
+
+
+def download_stage(
+    tickers,
+    done,
+    html_queue,
+    metrics,
+    workers,
+    rate,
+    keep_raw,
+    compression,
+    api_url=download_filings.API_URL,
+    sync_state=None,
+    listed=None,
+):
+    """
+    Lists each ticker's filings and puts (ticker, text filename, html) on
+    html_queue for every filing not in `done`. Filings already in DATA_DIR are
+    read from disk instead of downloaded.
+    With sync_state, each ticker is listed from its high-water mark; every
+    successful listing is stored in `listed` as {ticker: filings}.
+    """
+    session = download_filings.create_session(workers)
+    api_limiter = download_filings.TokenBucket(
+        download_filings.API_REQUESTS_PER_SECOND
+    )
+    sec_limiter = download_filings.TokenBucket(rate)
+
+    def fetch(ticker, filing):
+        filename = download_filings.filing_filename(ticker, filing)
+        raw_path = os.path.join(download_filings.DATA_DIR, ticker, filename)
+        start = time.perf_counter()
+        try:
+            existing = storage.find_existing(raw_path)
+            if existing:
+                html = storage.read_text(existing)
+            else:
+                response = download_filings.request_with_retry(
+                    session,
+                    sec_limiter,
+                    "GET",
+                    filing["linkToFilingDetails"],
+                    headers=download_filings.DOWNLOAD_HEADERS,
+                )
+                html = response.text
+                if keep_raw:
+                    os.makedirs(os.path.dirname(raw_path), exist_ok=True)
+                    storage.write_text_atomic(
+                        storage.with_compression(raw_path, compression), html
+                    )
+        except Exception as e:
+            print(f"    - Could not download {filename}. Reason: {e}")
+            metrics.error(filename, e)
+            return
+        metrics.add_span("download", time.perf_counter() - start)
+        # Blocks while cleaning is behind
+        html_queue.put((ticker, text_filename(ticker, filing), html))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list_futures = {
+            executor.submit(
+                download_filings.fetch_filing_list,
+                session,
+                api_limiter,
+                ticker,
+                api_url,
+                download_filings.sync_start_date(sync_state or {}, ticker),
+            ): ticker
+            for ticker in tickers
+        }
+        queued = set()
+        for future in as_completed(list_futures):
+            ticker = list_futures[future]
+            try:
+                filings = future.result()
+            except Exception as e:
+                print(f"Error fetching filing list for {ticker}: {e}")
+                metrics.error(ticker, e)
+                continue
+
+            if listed is not None:
+                listed[ticker] = filings
+            for filing in filings:
+                filename = text_filename(ticker, filing)
+                if filename in done or filename in queued:
+                    metrics.count("skipped")
+                    continue
+                queued.add(filename)
+                executor.submit(fetch, ticker, filing)
+
+
+def clean_stage(html_queue, chunk_queue, chunker, workers, metrics):
+    """
+    Cleans and chunks filings from html_queue in a process pool and puts
+    (ticker, filename, text, file_hash, chunks) on chunk_queue until it reads
+    a None. At most CLEAN_IN_FLIGHT_PER_WORKER filings per worker are
+    submitted at once, so the pool never holds more HTML than that.
+    """
+    in_flight = deque()
+
+    def emit(job):
+        future, ticker, filename, html_bytes, submitted = job
+        try:
+            text, file_hash, chunks, timings = future.result()
+        except BrokenProcessPool:
+            # A worker died; every other filing would fail the same way
+            raise
+        except Exception as e:
+            print(f"\nError cleaning {filename}: {e}")
+            metrics.record_file(
+                filename,
+                time.perf_counter() - submitted,
+                html_bytes,
+                error=str(e) or type(e).__name__,
+            )
+            return
+        metrics.record_file(
+            filename,
+            time.perf_counter() - submitted,
+            html_bytes,
+            len(text.encode("utf-8")),
+            timings=timings,
+            chunks=len(chunks[2]),
+        )
+        # Blocks while embedding is behind
+        chunk_queue.put((ticker, filename, text, file_hash, chunks))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while True:
+            item = html_queue.get()
+            if item is None:
+                break
+            ticker, filename, html = item
+            if len(in_flight) >= workers * CLEAN_IN_FLIGHT_PER_WORKER:
+                emit(in_flight.popleft())
+            in_flight.append(
+                (
+                    executor.submit(clean_and_chunk, filename, html, chunker),
+                    ticker,
+                    filename,
+                    len(html.encode("utf-8")),
+                    time.perf_counter(),
+                )
+            )
+        while in_flight:
+            emit(in_flight.popleft())
+
+
+def run_pipeline(
+    tickers=download_filings.TICKERS,
+    batch_size=bulk_embedder.DEFAULT_BATCH_SIZE,
+    chunker=bulk_embedder.DEFAULT_CHUNKER,
+    vector_store=bulk_embedder.DEFAULT_VECTOR_STORE,
+    download_workers=download_filings.MAX_WORKERS,
+    clean_workers=DEFAULT_CLEAN_WORKERS,
+    requests_per_second=download_filings.SEC_REQUESTS_PER_SECOND,
+    queue_size=DEFAULT_QUEUE_SIZE,
+    keep_raw=False,
+    keep_text=False,
+    compression=storage.DEFAULT_COMPRESSION,
+    api_url=download_filings.API_URL,
+    sync=False,
+    sync_state_path=SYNC_STATE_PATH,
+):
+    """
+    Downloads, cleans, chunks and embeds filings in one pass. Downloading runs
+    on a thread pool, cleaning and chunking in a process pool, and embedding on
+    this thread, connected by bounded queues so the three overlap.
+    Raw HTML and cleaned text are only written to disk with keep_raw/keep_text.
+    The manifest is the checkpoint: every embedded batch journals the filings
+    whose chunks are all written, so an interrupted run resumes with the
+    filings it had not finished.
+    With sync, only filings since each ticker's high-water mark are listed,
+    so a nightly run handles just the new ones; a ticker's mark only moves
+    past filings that made it into the index, or that failed too many runs.
+    """
+    if not download_filings.API_KEY:
+        print("Error: SEC_API_KEY not found. Please check your .env file.")
+        return
+
+    metrics = RunMetrics("pipeline")
+    collection = bulk_embedder.open_vector_store(vector_store)
+    lexical_index = LexicalIndex(bulk_embedder.LEXICAL_INDEX_DIR)
+    indexed_files = bulk_embedder.load_manifest(collection, vector_store)
+    bulk_embedder.sync_lexical_index(collection, lexical_index)
+
+    current_chunker = bulk_embedder.chunker_id(chunker)
+    done = {
+        filename
+        for filename, entry in indexed_files.items()
+        if entry.get("chunker") == current_chunker
+    }
+    print(f"--- {len(done)} filings already indexed; streaming the rest ---")
+    sync_state = download_filings.load_sync_state(sync_state_path) if sync else None
+    listed = {}
+
+    html_queue = queue.Queue(maxsize=queue_size)
+    chunk_queue = queue.Queue(maxsize=queue_size)
+    # Exceptions that stopped a stage, raised here once its queue is drained
+    stage_errors = []
+    threads = [
+        threading.Thread(
+            target=run_stage,
+            args=(
+                download_stage,
+                stage_errors,
+                html_queue,
+                tickers,
+                done,
+                html_queue,
+                metrics,
+                download_workers,
+                requests_per_second,
+                keep_raw,
+                compression,
+                api_url,
+                sync_state,
+                listed,
+            ),
+            daemon=True,
+        ),
+        threading.Thread(
+            target=run_stage,
+            args=(
+                clean_stage,
+                stage_errors,
+                chunk_queue,
+                html_queue,
+                chunk_queue,
+                chunker,
+                clean_workers,
+                metrics,
+            ),
+            daemon=True,
+        ),
+    ]
+    for thread in threads:
+        thread.start()
+
+    writer = bulk_embedder.BatchWriter(
+        collection, lexical_index, indexed_files, metrics, batch_size, vector_store
+    )
+    with tqdm(desc="Indexed filings", unit="filing") as progress:
+        while True:
+            item = chunk_queue.get()
+            if item is None:
+                break
+            ticker, filename, text, file_hash, chunks = item
+            progress.update(1)
+
+            try:
+                if keep_text:
+                    text_path = storage.with_compression(
+                        os.path.join(bulk_embedder.PROCESSED_DIR, ticker, filename),
+                        compression,
+                    )
+                    os.makedirs(os.path.dirname(text_path), exist_ok=True)
+                    storage.write_text_atomic(text_path, text)
+                    file_info = bulk_embedder.file_stat(text_path)
+                else:
+                    # No text file to stat; bulk_embedder leaves these entries be
+                    file_info = {
+                        "size": len(text.encode("utf-8")),
+                        "mtime": None,
+                        "streamed": True,
+                    }
+                    # Also kept per chunk, for a manifest rebuilt from the collection
+                    for metadata in chunks[1]:
+                        metadata["streamed"] = True
+
+                # A filing chunked with other settings before is diffed, so
+                # only chunks with new text are embedded again
+                writer.add_file(
+                    filename,
+                    dict(file_info, file_hash=file_hash, chunker=current_chunker),
+                    chunks,
+                )
+            except Exception as e:
+                print(f"\nError processing {filename}: {e}")
+                metrics.error(filename, e)
+
+    # A stage that failed may have left the one before it blocked on a full
+    # queue, so only join the threads when both finished
+    if not stage_errors:
+        for thread in threads:
+            thread.join()
+    writer.finish()
+    if stage_errors:
+        metrics.error("pipeline", stage_errors[0])
+        metrics.write()
+        raise RuntimeError(
+            f"Pipeline stopped; finished filings are checkpointed: {stage_errors[0]}"
+        ) from stage_errors[0]
+
+    if sync:
+        for ticker, filings in listed.items():
+            download_filings.advance_sync_state(
+                sync_state,
+                ticker,
+                filings,
+                lambda filing: indexed_files.get(text_filename(ticker, filing), {}).get(
+                    "chunker"
+                )
+                != current_chunker,
+            )
+        download_filings.save_sync_state(sync_state, sync_state_path)
+
+    print("\nPipeline finished!")
+    print(
+        f"--- Chunks embedded: {writer.stats['embedded']}, "
+        f"reused: {writer.stats['reused']}, "
+        f"unchanged: {writer.stats['unchanged']} ---"
+    )
+    print(f"--- Total items in collection: {collection.count()} ---")
+    metrics.write()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Download, clean and index SEC filings in one streaming pass."
+    )
+    parser.add_argument(
+        "--tickers",
+        nargs="+",
+        default=download_filings.TICKERS,
+        help="Tickers to fetch filings for.",
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=bulk_embedder.DEFAULT_BATCH_SIZE,
+        help="Number of chunks embedded and written per batch.",
+    )
+    parser.add_argument(
+        "--chunker",
+        choices=bulk_embedder.CHUNKERS,
+        default=bulk_embedder.DEFAULT_CHUNKER,
+        help="'section' keeps chunks within one SEC Item; 'recursive' ignores Items.",
+    )
+    parser.add_argument(
+        "--vector_store",
+        choices=bulk_embedder.VECTOR_STORES,
+        default=bulk_embedder.DEFAULT_VECTOR_STORE,
+        help="'int8' or 'binary' store quantized vectors for a smaller index.",
+    )
+    parser.add_argument(
+        "--download_workers",
+        type=int,
+        default=download_filings.MAX_WORKERS,
+        help="Concurrent downloads.",
+    )
+    parser.add_argument(
+        "--clean_workers",
+        type=int,
+        default=DEFAULT_CLEAN_WORKERS,
+        help="Processes cleaning and chunking filings.",
+    )
+    parser.add_argument(
+        "-r",
+        "--rate",
+        type=float,
+        default=download_filings.SEC_REQUESTS_PER_SECOND,
+        help="Maximum requests per second to sec.gov.",
+    )
+    parser.add_argument(
+        "--queue_size",
+        type=int,
+        default=DEFAULT_QUEUE_SIZE,
+        help="Filings buffered between stages.",
+    )
+    parser.add_argument(
+        "--keep_raw",
+        action="store_true",
+        help="Also save downloaded HTML under data/.",
+    )
+    parser.add_argument(
+        "--keep_text",
+        action="store_true",
+        help="Also save cleaned text under processed_text/.",
+    )
+    parser.add_argument(
+        "-c",
+        "--compression",
+        choices=storage.COMPRESSIONS,
+        default=storage.DEFAULT_COMPRESSION,
+        help="Compression for files saved with --keep_raw/--keep_text.",
+    )
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="Only index filings newer than the last sync "
+        f"(state in {SYNC_STATE_PATH}).",
+    )
+    parser.add_argument(
+        "--api_url",
+        default=download_filings.API_URL,
+        help="Query API endpoint, e.g. a local stub_sec_api.py server.",
+    )
+
+    args = parser.parse_args()
+    bulk_embedder.remove_shard_map()
+    run_pipeline(
+        args.tickers,
+        args.batch_size,
+        args.chunker,
+        args.vector_store,
+        args.download_workers,
+        args.clean_workers,
+        args.rate,
+        args.queue_size,
+        args.keep_raw,
+        args.keep_text,
+        args.compression,
+        args.api_url,
+        args.sync,
+    )
@@ -1,27 +1,48 @@
 import os
 import re
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from bs4 import BeautifulSoup
+from lxml import etree
 from tqdm import tqdm  # This is the correct way to import for our use case
+import storage
+from instrumentation import RunMetrics, timed, profile_call
 
 # --- CONFIGURATION ---
 
 SOURCE_DIR = "data"
 TARGET_DIR = "processed_text"
 
+# Cleaning engine: "soup" builds a full BeautifulSoup tree, "stream" parses
+# the filing as an event stream and writes text without building a DOM
+DEFAULT_ENGINE = "soup"
+ENGINES = ["soup", "stream"]
+
+# Bytes of HTML fed to the streaming parser at a time
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Tags whose whole subtree the streaming engine drops. script/style match the
+# soup engine's decompose list; template/rt/rp match strings that BeautifulSoup's
+# get_text() already leaves out, so both engines produce the same text.
+STREAM_SKIPPED_TAGS = {"script", "style", "template", "rt", "rp"}
+
+# Number of slowest files to list in the end-of-run summary
+SLOWEST_FILES_TO_REPORT = 5
+
 # --- LOGIC ---
 
 
-def parse_and_clean_html(filepath):
+def clean_html(html_content, timings=None):
     """
-    Opens an HTML filing, cleans it by removing XBRL and other tags,
-    and returns the clean narrative text.
+    Cleans an HTML filing string by removing XBRL and other tags,
+    and returns the clean narrative text. Raises on parser errors.
+    With a timings dict, the parse, decompose and get_text steps are timed into it.
     """
-    try:
-        with open(filepath, "r", encoding="utf-8") as f:
-            html_content = f.read()
-
+    with timed(timings, "parse"):
         soup = BeautifulSoup(html_content, "lxml")
 
+    with timed(timings, "decompose"):
         tags_to_remove = soup.find_all(
             [
                 "ix:nonnumeric",
@@ -38,53 +59,247 @@ def parse_and_clean_html(filepath):
         for tag in tags_to_remove:
             tag.decompose()
 
-        clean_text = soup.get_text(separator=" ", strip=True)
-        return clean_text
+    with timed(timings, "get_text"):
+        return soup.get_text(separator=" ", strip=True)
+
+
+def parse_and_clean_html(filepath):
+    """
+    Opens an HTML filing, cleans it by removing XBRL and other tags,
+    and returns the clean narrative text.
+    """
+    try:
+        return clean_html(storage.read_text(filepath))
 
     except Exception as e:
         print(f"  - Error processing {os.path.basename(filepath)}: {e}")
         return None
 
 
-def main():
+class StreamingTextTarget:
+    """
+    lxml parser target that writes the visible text of a filing as it is parsed.
+    Mirrors soup.get_text(separator=" ", strip=True): each text node is stripped,
+    empty ones are dropped and the rest are joined with single spaces.
+    """
+
+    def __init__(self, out):
+        self.out = out
+        self.skip_depth = 0
+        self.buffer = []
+        self.wrote_text = False
+
+    def _flush(self):
+        # A text node ends at the next tag, comment or processing instruction
+        if not self.buffer:
+            return
+        text = "".join(self.buffer).strip()
+        self.buffer = []
+        if text:
+            if self.wrote_text:
+                self.out.write(" ")
+            self.out.write(text)
+            self.wrote_text = True
+
+    def start(self, tag, attrib):
+        self._flush()
+        if self.skip_depth or tag.startswith("ix:") or tag in STREAM_SKIPPED_TAGS:
+            self.skip_depth += 1
+
+    def end(self, tag):
+        self._flush()
+        if self.skip_depth:
+            self.skip_depth -= 1
+
+    def data(self, data):
+        if not self.skip_depth:
+            self.buffer.append(data)
+
+    def comment(self, text):
+        self._flush()
+
+    def pi(self, target, data):
+        self._flush()
+
+    def doctype(self, *args):
+        self._flush()
+
+    def close(self):
+        self._flush()
+        return self.wrote_text
+
+
+def stream_clean_html(source_filepath, out):
+    """
+    Cleans an HTML filing without building a DOM, writing the narrative text to
+    the open text file `out` as it goes. Returns True if any text was written.
+    """
+    target = StreamingTextTarget(out)
+    parser = etree.HTMLParser(target=target, recover=True)
+    with storage.open_text(source_filepath) as f:
+        while True:
+            chunk = f.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            parser.feed(chunk)
+    try:
+        return parser.close()
+    except etree.XMLSyntaxError:
+        # lxml refuses to close a document with no elements at all
+        target.close()
+        return target.wrote_text
+
+
+def clean_file(source_filepath, target_filepath, engine=DEFAULT_ENGINE):
+    """
+    Cleans a single filing with the chosen engine and writes the result atomically,
+    compressed according to the target's extension. Safe to run inside a worker
+    process: errors are returned instead of printed.
+    Returns a (source_filepath, seconds, error, details) tuple; error is None on
+    success and details holds the bytes read and written and per-step timings.
+    """
+    start = time.perf_counter()
+    error = None
+    timings = {}
+    details = {"bytes_in": None, "bytes_out": None}
+    try:
+        # Inside the try, so a file removed since listing is reported, not raised
+        details["bytes_in"] = os.path.getsize(source_filepath)
+        if engine == "stream":
+            # Reading, parsing and writing are interleaved in the stream engine
+            with timed(timings, "stream"), storage.atomic_write_text(
+                target_filepath
+            ) as f:
+                if not stream_clean_html(source_filepath, f):
+                    # Raising discards the temporary file
+                    raise ValueError("no text extracted")
+        else:
+            with timed(timings, "read"):
+                html_content = storage.read_text(source_filepath)
+            clean_text = clean_html(html_content, timings)
+            if not clean_text:
+                raise ValueError("no text extracted")
+            with timed(timings, "write"):
+                storage.write_text_atomic(target_filepath, clean_text)
+        details["bytes_out"] = os.path.getsize(target_filepath)
+    except Exception as e:
+        error = str(e) or type(e).__name__
+
+    details["timings"] = timings
+    return source_filepath, time.perf_counter() - start, error, details
+
+
+def is_profiled(filepath, profile_file):
+    """Whether filepath is the file chosen with --profile_file (matched by name)."""
+    name = storage.split_compression(os.path.basename(filepath))[0]
+    return profile_file in (name, os.path.splitext(name)[0], os.path.basename(filepath))
+
+
+def print_summary(results, skipped):
+    """Prints the per-file timing and error summary for a processing run."""
+    failed = [(path, error) for path, _, error, _ in results if error]
+    total_seconds = sum(seconds for _, seconds, _, _ in results)
+
+    print("\n--- Processing summary ---")
+    print(f"Cleaned: {len(results) - len(failed)}")
+    print(f"Skipped (already exist): {skipped}")
+    print(f"Failed: {len(failed)}")
+
+    if results:
+        print(
+            f"Total time spent cleaning: {total_seconds:.1f}s "
+            f"(avg {total_seconds / len(results):.2f}s per file)"
+        )
+        slowest = sorted(results, key=lambda r: r[1], reverse=True)
+        print(f"\nSlowest {min(SLOWEST_FILES_TO_REPORT, len(slowest))} files:")
+        for path, seconds, _, _ in slowest[:SLOWEST_FILES_TO_REPORT]:
+            print(f"  {seconds:8.2f}s  {os.path.basename(path)}")
+
+    if failed:
+        print("\nErrors:")
+        for path, error in failed:
+            print(f"  - {os.path.basename(path)}: {error}")
+
+
+def main(
+    workers=1,
+    engine=DEFAULT_ENGINE,
+    compression=storage.DEFAULT_COMPRESSION,
+    profile_file=None,
+):
     """
     Main function to walk through the source directory, process each HTML file,
     and save the clean text to the target directory.
+    With workers > 1, files are cleaned in parallel across a process pool.
+    Source files may be compressed; output is written with `compression`.
+    Per-file timings and byte counts are written as run metrics; the file
+    named profile_file is cleaned in this process under cProfile.
     """
+    metrics = RunMetrics("process_all_files")
     print(f"Starting bulk processing from '{SOURCE_DIR}' to '{TARGET_DIR}'...")
+    print(f"--- Cleaning engine: {engine}, output compression: {compression} ---")
 
     os.makedirs(TARGET_DIR, exist_ok=True)
 
     all_files = []
     for root, _, files in os.walk(SOURCE_DIR):
         for file in files:
-            if file.lower().endswith(".html"):
+            if storage.split_compression(file)[0].lower().endswith(".html"):
                 all_files.append(os.path.join(root, file))
 
     if not all_files:
         print("No HTML files found to process.")
         return
 
-    # This loop will now work correctly because of the fixed import at the top
-    for source_filepath in tqdm(all_files, desc="Processing files"):
+    # Build the list of (source, target) jobs, skipping files already cleaned
+    jobs = []
+    for source_filepath in all_files:
         relative_path = os.path.relpath(os.path.dirname(source_filepath), SOURCE_DIR)
         target_subdir = os.path.join(TARGET_DIR, relative_path)
         os.makedirs(target_subdir, exist_ok=True)
 
-        base_filename = os.path.basename(source_filepath)
+        base_filename = storage.split_compression(os.path.basename(source_filepath))[0]
         target_filename = os.path.splitext(base_filename)[0] + ".txt"
         target_filepath = os.path.join(target_subdir, target_filename)
 
-        if not os.path.exists(target_filepath):
-            clean_text = parse_and_clean_html(source_filepath)
+        # A filing counts as cleaned whatever compression its text was stored with
+        if not storage.find_existing(target_filepath):
+            jobs.append(
+                (source_filepath, storage.with_compression(target_filepath, compression))
+            )
+
+    skipped = len(all_files) - len(jobs)
+    metrics.count("skipped", skipped)
+    results = []
+
+    profiled = [
+        job for job in jobs if profile_file and is_profiled(job[0], profile_file)
+    ]
+    jobs = [job for job in jobs if job not in profiled]
+
+    with tqdm(total=len(jobs) + len(profiled), desc="Processing files") as progress:
+        for job in profiled:
+            results.append(
+                profile_call(metrics.profile_path(job[0]), clean_file, *job, engine)
+            )
+            progress.update(1)
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(clean_file, *job, engine) for job in jobs]
+                for future in as_completed(futures):
+                    results.append(future.result())
+                    progress.update(1)
+        else:
+            for job in jobs:
+                results.append(clean_file(*job, engine))
+                progress.update(1)
 
-            if clean_text:
-                try:
-                    with open(target_filepath, "w", encoding="utf-8") as f:
-                        f.write(clean_text)
-                except Exception as e:
-                    print(f"  - Error writing to {target_filepath}: {e}")
+    for path, seconds, error, details in results:
+        metrics.record_file(path, seconds, error=error, **details)
+    metrics.count("cleaned", sum(1 for result in results if not result[2]))
 
+    print_summary(results, skipped)
+    metrics.write()
     print("\nBulk processing finished!")
 
 
@@ -92,4 +307,38 @@ def main():
 # Simplified this block to remove the buggy check. Since tqdm is installed,
 # we can just call main() directly.
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(
+        description="Clean downloaded SEC filings into plain text."
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes to clean files in parallel.",
+    )
+    parser.add_argument(
+        "-e",
+        "--engine",
+        choices=ENGINES,
+        default=DEFAULT_ENGINE,
+        help="Cleaning engine: 'soup' (BeautifulSoup DOM) or 'stream' (event stream, low memory).",
+    )
+
+    parser.add_argument(
+        "-c",
+        "--compression",
+        choices=storage.COMPRESSIONS,
+        default=storage.DEFAULT_COMPRESSION,
+        help="Compression for the cleaned text files.",
+    )
+
+    parser.add_argument(
+        "--profile_file",
+        metavar="FILENAME",
+        help="Clean this filing (e.g. AAPL_10-K_2023-11-03) under cProfile and "
+        "save the stats next to the run metrics.",
+    )
+
+    args = parser.parse_args()
+    main(args.workers, args.engine, args.compression, args.profile_file)
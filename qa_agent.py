@@ -1,14 +1,62 @@
 import os
-import chromadb
+import time
+import json
+import socket
+import hashlib
 import argparse
-import google.generativeai as genai
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from query_cache import QueryCache, normalize_query
+from sec_sections import parse_section
+from sharding import ShardedCollection, ShardedLexicalIndex, db_path, read_shard_map
+from query_planner import plan_query, describe_plan, extract_tickers
+from reranker import CrossEncoderReranker, DEFAULT_RERANK_CANDIDATES
+from context_builder import assemble_context, DEFAULT_TOKEN_BUDGET
+from chunk_store import resolve_documents
+from instrumentation import RunMetrics, timed
+
+# chromadb, google.generativeai, numpy and the models are imported where they
+# are first used, so --help, server clients and error paths start quickly
+# (check with startup_benchmark.py)
 
 # --- CONFIGURATION ---
 load_dotenv()
 DB_DIR = "chroma_db"
 COLLECTION_NAME = "sec_filings"
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+GEMINI_MODEL = "gemini-1.5-flash"
+
+# Written by bulk_embedder.py whenever the collection's contents change, with
+# checkpoints appended to the journal (MANIFEST_PATH + suffix) while it runs
+MANIFEST_PATH = os.path.join(DB_DIR, "indexed_files.json")
+MANIFEST_JOURNAL_SUFFIX = ".journal"
+QUERY_CACHE_PATH = os.path.join(DB_DIR, "query_cache.sqlite")
+
+# Used instead of Chroma when bulk_embedder.py was run with --vector_store int8/binary
+QUANTIZED_STORE_DIR = os.path.join(DB_DIR, "quantized_store")
+
+# Per-ticker (or ticker hash bucket) databases from bulk_embedder.py --shard_by,
+# searched instead of the single collection while their shard map exists
+SHARDS_DIR = os.path.join(DB_DIR, "shards")
+
+# BM25 index maintained by bulk_embedder.py, used by --hybrid retrieval
+LEXICAL_INDEX_DIR = os.path.join(DB_DIR, "lexical_index")
+# Candidates taken from each ranking before fusion, per requested result
+HYBRID_CANDIDATE_FACTOR = 4
+# Reciprocal-rank fusion constant; larger values flatten the rank weighting
+RRF_K = 60
+
+# Per-company sub-queries run at the same time for multi-company questions
+MAX_PARALLEL_SUBQUERIES = 8
+
+# Where `qa_agent.py --serve` listens; the CLI sends questions there when it is up
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8765
+SERVER_URL = os.getenv("QA_SERVER_URL", f"http://{SERVER_HOST}:{SERVER_PORT}")
+SERVER_CONNECT_TIMEOUT = 0.5
+SERVER_REQUEST_TIMEOUT = 300
 
 # NEW: A map to connect company names to tickers for better recognition
 COMPANY_MAP = {
@@ -24,26 +72,331 @@ COMPANY_MAP = {
 }
 # ---
 
+_collection = None
+_embedding_function = None
+_lexical_index = None
+_reranker = None
+# {path: ((mtime_ns, size), sha256 hex digest)} of manifest files
+_file_digests = {}
+
 
 def smart_ticker_extraction(query):
     """Smarter method to find a ticker using a company name map."""
-    query_lower = query.lower()
-    for name, ticker in COMPANY_MAP.items():
-        if name in query_lower:
-            return ticker
+    tickers = extract_tickers(query, COMPANY_MAP)
+    return tickers[0] if tickers else None
+
+
+def open_store(db_dir=DB_DIR):
+    """
+    Opens the vector store in one database directory: the persistent ChromaDB
+    collection, or the quantized store if the manifest says that was written.
+    """
+    vector_store = "chroma"
+    manifest_path = db_path(db_dir, MANIFEST_PATH)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            vector_store = json.load(f).get("vector_store", "chroma")
+    if vector_store != "chroma":
+        from quantized_store import QuantizedCollection
+
+        return QuantizedCollection(
+            db_path(db_dir, QUANTIZED_STORE_DIR), read_only=True
+        )
+    import chromadb
+
+    client = chromadb.PersistentClient(path=os.path.abspath(db_dir))
+    return client.get_collection(name=COLLECTION_NAME)
+
+
+def open_collection():
+    """
+    Opens the vector store built by bulk_embedder.py. Shards are opened together
+    and searched as one collection.
+    """
+    shard_map = read_shard_map(SHARDS_DIR)
+    if shard_map is None:
+        return open_store()
+    return ShardedCollection(
+        {
+            shard: open_store(os.path.join(SHARDS_DIR, shard))
+            for shard in shard_map["shards"]
+        },
+        shard_map["shard_by"],
+        shard_map["num_shards"],
+    )
+
+
+def get_collection():
+    """Returns the vector store, opened on first use and shared afterwards."""
+    global _collection
+    if _collection is None:
+        _collection = open_collection()
+    return _collection
+
+
+def get_embedding_function():
+    """Returns the query embedding function, loading the model once per process."""
+    global _embedding_function
+    if _embedding_function is None:
+        from chromadb.utils import embedding_functions
+
+        _embedding_function = embedding_functions.DefaultEmbeddingFunction()
+    return _embedding_function
+
+
+def get_reranker():
+    """Returns the cross-encoder reranker, loading the model once per process."""
+    global _reranker
+    if _reranker is None:
+        _reranker = CrossEncoderReranker()
+    return _reranker
+
+
+def get_lexical_index():
+    """Returns the memory-mapped lexical index, or None if it hasn't been built yet."""
+    global _lexical_index
+    if _lexical_index is not None:
+        return _lexical_index
+    from lexical_index import LexicalIndex
+
+    shard_map = read_shard_map(SHARDS_DIR)
+    if shard_map is None:
+        if os.path.exists(os.path.join(LEXICAL_INDEX_DIR, "index.json")):
+            _lexical_index = LexicalIndex(LEXICAL_INDEX_DIR)
+        return _lexical_index
+
+    indexes = {}
+    for shard in shard_map["shards"]:
+        index_dir = db_path(os.path.join(SHARDS_DIR, shard), LEXICAL_INDEX_DIR)
+        if os.path.exists(os.path.join(index_dir, "index.json")):
+            indexes[shard] = LexicalIndex(index_dir)
+    if indexes:
+        _lexical_index = ShardedLexicalIndex(
+            indexes, shard_map["shard_by"], shard_map["num_shards"]
+        )
+    return _lexical_index
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """Fuses ranked ID lists; each ID scores the sum of 1 / (k + rank) across lists."""
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, 1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+def fuse_with_lexical(collection, query_text, num_results, where, vector_results):
+    """
+    Fuses a vector ranking (ids, documents, metadatas) with the BM25 ranking for
+    the same query and filter. Returns the top num_results as
+    (ids, documents, metadatas).
+    """
+    ids, documents, metadatas = vector_results
+    lexical_index = get_lexical_index()
+    if lexical_index is None:
+        return ids[:num_results], documents[:num_results], metadatas[:num_results]
+
+    lexical_ids = [
+        chunk_id
+        for chunk_id, _ in lexical_index.search(
+            query_text, num_results * HYBRID_CANDIDATE_FACTOR, where
+        )
+    ]
+    fused_ids = reciprocal_rank_fusion([ids, lexical_ids])[:num_results]
+
+    by_id = dict(zip(ids, zip(documents, metadatas)))
+    missing = [chunk_id for chunk_id in fused_ids if chunk_id not in by_id]
+    if missing:
+        fetched = collection.get(ids=missing, include=["documents", "metadatas"])
+        by_id.update(
+            zip(fetched["ids"], zip(fetched["documents"], fetched["metadatas"]))
+        )
+    # A chunk deleted since the lexical index was written is simply dropped
+    fused_ids = [chunk_id for chunk_id in fused_ids if chunk_id in by_id]
+    return (
+        fused_ids,
+        [by_id[chunk_id][0] for chunk_id in fused_ids],
+        [by_id[chunk_id][1] for chunk_id in fused_ids],
+    )
+
+
+def file_digest(path):
+    """Hash of a file's contents, read again only when its mtime or size changes."""
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    cached = _file_digests.get(path)
+    if cached is None or cached[0] != key:
+        with open(path, "rb") as f:
+            cached = _file_digests[path] = (key, hashlib.sha256(f.read()).hexdigest())
+    return cached[1]
+
+
+def collection_fingerprint(collection):
+    """
+    Identifies the current contents of the collection, so cached retrievals
+    can be invalidated when bulk_embedder changes them.
+    """
+    shard_map = read_shard_map(SHARDS_DIR)
+    if shard_map is None:
+        manifest_paths = [MANIFEST_PATH]
+    else:
+        manifest_paths = [
+            db_path(os.path.join(SHARDS_DIR, shard), MANIFEST_PATH)
+            for shard in shard_map["shards"]
+        ]
+    digests = []
+    for path in manifest_paths:
+        for part in (path, path + MANIFEST_JOURNAL_SUFFIX):
+            try:
+                digests.append(file_digest(part))
+            except FileNotFoundError:
+                digests.append("")
+    if any(digests):
+        return hashlib.sha256("".join(digests).encode("ascii")).hexdigest()
+    return f"count:{collection.count()}"
+
+
+def search(collection, query_text, embedding, num_results, where, hybrid=False):
+    """
+    One vector search within a filter, fused with BM25 results when hybrid.
+    Returns (ids, documents, metadatas).
+    """
+    results = collection.query(
+        query_embeddings=[embedding],
+        n_results=num_results * HYBRID_CANDIDATE_FACTOR if hybrid else num_results,
+        where=where,
+    )
+    ids, documents, metadatas = (
+        results["ids"][0],
+        results["documents"][0],
+        results["metadatas"][0],
+    )
+    if hybrid:
+        return fuse_with_lexical(
+            collection, query_text, num_results, where, (ids, documents, metadatas)
+        )
+    return ids, documents, metadatas
+
+
+def merge_rankings(rankings, num_results):
+    """
+    Interleaves sub-query results rank by rank (each company's best chunk, then
+    each company's second best, ...), so every partition is represented.
+    Returns the first num_results as (ids, documents, metadatas).
+    """
+    merged = {}
+    for rank in range(max((len(ids) for ids, _, _ in rankings), default=0)):
+        for ids, documents, metadatas in rankings:
+            if rank < len(ids) and ids[rank] not in merged:
+                merged[ids[rank]] = (documents[rank], metadatas[rank])
+    ids = list(merged)[:num_results]
+    return ids, [merged[i][0] for i in ids], [merged[i][1] for i in ids]
+
+
+def results_key(filters, hybrid=False):
+    """Cache key parts for a search: its filter (or list of them) and mode."""
+    where = filters[0] if len(filters) == 1 else filters
+    return where, "hybrid" if hybrid else "vector"
+
+
+def get_cached_results(
+    collection, cache, query, filters, num_results, fingerprint, hybrid=False
+):
+    """
+    Returns the cached (ids, documents, metadatas) of a normalized query's
+    search, with documents as stored, or None if the results are missing,
+    stale, or name a chunk that has since been deleted.
+    """
+    where, mode = results_key(filters, hybrid)
+    ids = cache.get_ids(query, where, num_results, fingerprint, mode)
+    if ids == []:
+        return [], [], []
+    if ids:
+        hit = collection.get(ids=ids, include=["documents", "metadatas"])
+        if len(hit["ids"]) == len(ids):
+            by_id = dict(zip(hit["ids"], zip(hit["documents"], hit["metadatas"])))
+            return (
+                ids,
+                [by_id[chunk_id][0] for chunk_id in ids],
+                [by_id[chunk_id][1] for chunk_id in ids],
+            )
     return None
 
 
-def generate_response(context, query):
-    """Generates a response using the Gemini LLM based on the provided context."""
-    if not GOOGLE_API_KEY:
-        return "Error: GOOGLE_API_KEY not found. Please set it in your .env file."
+def put_cached_results(
+    cache, query, filters, num_results, fingerprint, ids, hybrid=False
+):
+    """Stores the chunk IDs a normalized query's search returned."""
+    where, mode = results_key(filters, hybrid)
+    cache.put_ids(query, where, num_results, fingerprint, ids, mode)
 
-    try:
-        genai.configure(api_key=GOOGLE_API_KEY)
-        model = genai.GenerativeModel("gemini-1.5-flash")
 
-        prompt = f"""
+def retrieve(collection, query_text, num_results, where, cache=None, hybrid=False):
+    """
+    Returns (ids, documents, metadatas) for the chunks most similar to the query.
+    `where` is one Chroma filter, or a list of filters from the query planner
+    that are searched as parallel sub-queries and merged.
+    With hybrid, vector and BM25 rankings are fused with reciprocal-rank fusion.
+    With a cache, repeat questions skip embedding and vector search.
+    Chunks indexed with --store_text offsets are read from their text files.
+    """
+    query = normalize_query(query_text)
+    fingerprint = collection_fingerprint(collection) if cache else None
+    filters = where if isinstance(where, list) else [where]
+
+    if cache:
+        cached = get_cached_results(
+            collection, cache, query, filters, num_results, fingerprint, hybrid
+        )
+        if cached is not None:
+            print("--- Using cached retrieval results ---")
+            ids, documents, metadatas = cached
+            return ids, resolve_documents(documents, metadatas), metadatas
+
+    embedding = cache.get_embedding(query) if cache else None
+    if embedding is None:
+        embedding = get_embedding_function()([query_text])[0]
+        if cache:
+            cache.put_embedding(query, embedding)
+
+    if len(filters) == 1:
+        ids, documents, metadatas = search(
+            collection, query_text, embedding, num_results, filters[0], hybrid
+        )
+    else:
+        with ThreadPoolExecutor(
+            max_workers=min(len(filters), MAX_PARALLEL_SUBQUERIES)
+        ) as executor:
+            rankings = list(
+                executor.map(
+                    lambda f: search(
+                        collection, query_text, embedding, num_results, f, hybrid
+                    ),
+                    filters,
+                )
+            )
+        ids, documents, metadatas = merge_rankings(rankings, num_results)
+
+    if cache:
+        put_cached_results(
+            cache, query, filters, num_results, fingerprint, ids, hybrid
+        )
+    return ids, resolve_documents(documents, metadatas), metadatas
+
+
+def build_context(ids, documents, metadatas, token_budget=DEFAULT_TOKEN_BUDGET):
+    """
+    Formats retrieved chunks into the context block of the prompt, merging
+    neighbouring chunks, dropping repeated text and fitting it in token_budget.
+    Returns (context, source files used).
+    """
+    return assemble_context(ids, documents, metadatas, token_budget)
+
+
+def build_prompt(context, query):
+    """Builds the LLM prompt asking for a sourced answer from the context."""
+    return f"""
         You are a helpful financial analyst assistant. Your task is to answer the user's question based *only* on the provided context from SEC filings.
 
         Follow these rules:
@@ -62,59 +415,330 @@ def generate_response(context, query):
         ANSWER:
         """
 
-        response = model.generate_content(prompt)
-        return response.text
+
+class Generator:
+    """
+    Interface for answer generators. stream(prompt) yields the answer's text
+    as it is produced; generate(prompt) returns it whole. Subclasses implement
+    at least one of the two.
+    """
+
+    def generate(self, prompt):
+        return "".join(self.stream(prompt))
+
+    def stream(self, prompt):
+        yield self.generate(prompt)
+
+
+class GeminiGenerator(Generator):
+    """Generates answers with Google's Gemini API, configured once and reused."""
+
+    def __init__(self, model_name=GEMINI_MODEL):
+        import google.generativeai as genai
+
+        genai.configure(api_key=GOOGLE_API_KEY)
+        self.model = genai.GenerativeModel(model_name)
+
+    def generate(self, prompt):
+        return self.model.generate_content(prompt).text
+
+    def stream(self, prompt):
+        for chunk in self.model.generate_content(prompt, stream=True):
+            yield chunk.text
+
+
+class EchoGenerator(Generator):
+    """
+    Offline stand-in for the LLM, for tests and debugging without network access:
+    answers with the source files found in the prompt's context, streamed one
+    word at a time (with an optional per-word delay to mimic a real model).
+    """
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+
+    def generate(self, prompt):
+        sources = []
+        for line in prompt.splitlines():
+            line = line.strip()
+            if line.startswith("Source File: ") and line[13:] not in sources:
+                sources.append(line[13:])
+        return "Retrieved context from: " + ", ".join(sources)
+
+    def stream(self, prompt):
+        words = self.generate(prompt).split(" ")
+        for i, word in enumerate(words):
+            if self.delay:
+                time.sleep(self.delay)
+            yield word if i == len(words) - 1 else word + " "
+
+
+GENERATORS = {"gemini": GeminiGenerator, "echo": EchoGenerator}
+
+
+def generate_response(context, query, generator=None, on_token=None):
+    """
+    Generates a response with the given generator (a Generator, or any object
+    with a generate(prompt) method), defaulting to the Gemini LLM.
+    With on_token, the answer is streamed and on_token is called with each
+    piece of text as it arrives; the full answer is still returned.
+    """
+    if generator is None:
+        if not GOOGLE_API_KEY:
+            error = "Error: GOOGLE_API_KEY not found. Please set it in your .env file."
+            if on_token:
+                on_token(error)
+            return error
+        generator = GeminiGenerator()
+
+    pieces = []
+    try:
+        if on_token is None:
+            return generator.generate(build_prompt(context, query))
+        for piece in generator.stream(build_prompt(context, query)):
+            pieces.append(piece)
+            on_token(piece)
+        return "".join(pieces)
 
     except Exception as e:
-        return f"An error occurred during generation: {e}"
+        error = f"An error occurred during generation: {e}"
+        if on_token:
+            on_token(("\n" if pieces else "") + error)
+        return "".join(pieces) + error
 
 
-def main(query_text, num_results=7):
+class GenerationTimer:
     """
-    Main function to filter, query the vector database, and generate a response.
+    Wraps an on_token callback to record time to first token and total time,
+    in seconds from when the timer was created.
     """
-    client = chromadb.PersistentClient(path=os.path.abspath(DB_DIR))
-    collection = client.get_collection(name=COLLECTION_NAME)
-
-    # --- CORRECTED FILTER LOGIC ---
-    # Initialize filter to None
-    ticker_filter = None
-    extracted_ticker = smart_ticker_extraction(query_text)
-    if extracted_ticker:
-        # Only create the filter dictionary if a ticker is found
-        ticker_filter = {"ticker": extracted_ticker}
-        print(f"--- Filtering results for ticker: {extracted_ticker} ---")
+
+    def __init__(self, on_token=None):
+        self.on_token = on_token
+        self.start = time.perf_counter()
+        self.first_token = None
+        self.total = None
+
+    def __call__(self, piece):
+        if self.first_token is None:
+            self.first_token = time.perf_counter() - self.start
+        if self.on_token:
+            self.on_token(piece)
+
+    def stop(self):
+        self.total = time.perf_counter() - self.start
+        if self.first_token is None:
+            self.first_token = self.total
+
+    def report(self):
+        return (
+            f"--- First token after {self.first_token:.2f}s, "
+            f"answer complete after {self.total:.2f}s ---"
+        )
+
+
+def answer_question(
+    collection,
+    query_text,
+    num_results=7,
+    generator=None,
+    use_cache=True,
+    hybrid=False,
+    section=None,
+    rerank=False,
+    rerank_candidates=DEFAULT_RERANK_CANDIDATES,
+    token_budget=DEFAULT_TOKEN_BUDGET,
+    on_token=None,
+):
+    """
+    Runs filtering, retrieval and generation for one question.
+    With rerank, rerank_candidates chunks are retrieved and the cross-encoder
+    keeps the best num_results that fit in token_budget. The context sent to
+    the LLM is packed into token_budget either way.
+    With on_token, the answer is streamed to it piece by piece.
+    Returns a dict with the answer, the ticker filter, the source files used,
+    the time to first token and total time, and per-step timings in seconds.
+    """
+    timer = GenerationTimer(on_token)
+    timings = {}
+    with timed(timings, "plan"):
+        section = parse_section(section) if section else None
+        plan = plan_query(query_text, COMPANY_MAP, section)
+
+    cache = QueryCache(QUERY_CACHE_PATH) if use_cache else None
+    try:
+        with timed(timings, "retrieve"):
+            ids, documents, metadatas = retrieve(
+                collection,
+                query_text,
+                max(num_results, rerank_candidates) if rerank else num_results,
+                plan["filters"],
+                cache,
+                hybrid,
+            )
+    finally:
+        if cache:
+            cache.close()
+    if rerank and documents:
+        with timed(timings, "rerank"):
+            ids, documents, metadatas = get_reranker().rerank(
+                query_text, ids, documents, metadatas, num_results, token_budget
+            )
+
+    sources = []
+    if not documents:
+        answer = "No relevant documents found for your query."
+        timer(answer)
     else:
-        print("--- No specific company found in query, searching all documents. ---")
+        with timed(timings, "context"):
+            context, sources = build_context(ids, documents, metadatas, token_budget)
+        with timed(timings, "generate"):
+            answer = generate_response(
+                context, query_text, generator, timer if on_token else None
+            )
+    timer.stop()
 
-    # The 'where' parameter can now correctly handle 'None'
-    results = collection.query(
-        query_texts=[query_text],
-        n_results=num_results,
-        where=ticker_filter if ticker_filter else None,
+    return {
+        "query": query_text,
+        "ticker": plan["tickers"][0] if plan["tickers"] else None,
+        "tickers": plan["tickers"],
+        "form_types": plan["form_types"],
+        "date_range": plan["date_range"],
+        "section": section,
+        "answer": answer,
+        "sources": sources,
+        "first_token_seconds": round(timer.first_token, 3),
+        "total_seconds": round(timer.total, 3),
+        "timings": {name: round(seconds, 4) for name, seconds in timings.items()},
+    }
+
+
+def server_is_up(server_url=SERVER_URL):
+    """Quickly checks whether something is listening at the server address."""
+    parts = urllib.parse.urlsplit(server_url)
+    try:
+        with socket.create_connection(
+            (parts.hostname, parts.port or 80), timeout=SERVER_CONNECT_TIMEOUT
+        ):
+            return True
+    except OSError:
+        return False
+
+
+def ask_server(
+    query_text,
+    num_results,
+    hybrid=None,
+    section=None,
+    rerank=None,
+    rerank_candidates=DEFAULT_RERANK_CANDIDATES,
+    token_budget=DEFAULT_TOKEN_BUDGET,
+    on_token=None,
+    server_url=SERVER_URL,
+):
+    """
+    Sends the question to a running `qa_agent.py --serve` process.
+    With on_token, the server streams the answer and on_token is called with
+    each piece of text as it arrives. hybrid and rerank left as None are not
+    sent, so the modes the server was started with apply.
+    Returns the answer dict, or None if no server is listening.
+    """
+    if not server_is_up(server_url):
+        return None
+    body = {
+        "query": query_text,
+        "num_results": num_results,
+        "section": section,
+        "rerank_candidates": rerank_candidates,
+        "token_budget": token_budget,
+        "stream": on_token is not None,
+    }
+    if hybrid is not None:
+        body["hybrid"] = hybrid
+    if rerank is not None:
+        body["rerank"] = rerank
+    request = urllib.request.Request(
+        f"{server_url}/ask",
+        data=json.dumps(body).encode(),
+        headers={"Content-Type": "application/json"},
     )
-    # --- END OF CORRECTIONS ---
+    with urllib.request.urlopen(request, timeout=SERVER_REQUEST_TIMEOUT) as response:
+        if on_token is None:
+            return json.loads(response.read())
+        # Streamed answers arrive as JSON lines: {"token": ...} pieces, then
+        # {"done": true, "result": {...}} with the full answer dict, or
+        # {"error": ...} if answering failed part way
+        for line in response:
+            event = json.loads(line)
+            if event.get("done"):
+                return event["result"]
+            if "error" in event:
+                raise RuntimeError(f"Server error: {event['error']}")
+            on_token(event["token"])
+    raise ConnectionError("Server closed the stream before the answer was complete")
 
-    documents = results["documents"][0]
-    if not documents:
-        print("No relevant documents found for your query.")
-        return
 
-    context = ""
-    for i, doc in enumerate(documents):
-        metadata = results["metadatas"][0][i]
-        context += f"Source File: {metadata['source_file']}\nContent: {doc}\n\n---\n\n"
+def main(
+    query_text,
+    num_results=7,
+    use_cache=True,
+    generator=None,
+    hybrid=False,
+    section=None,
+    rerank=False,
+    rerank_candidates=DEFAULT_RERANK_CANDIDATES,
+    token_budget=DEFAULT_TOKEN_BUDGET,
+    write_metrics=False,
+):
+    """
+    Main function to filter, query the vector database, and generate a response.
+    The answer is streamed to stdout as it is generated. With write_metrics,
+    the time spent in each step is saved as run metrics.
+    """
+    metrics = RunMetrics("qa_agent")
+    timer = GenerationTimer(lambda piece: print(piece, end="", flush=True))
+
+    # The plan is made again by answer_question; here it is only reported
+    plan = plan_query(
+        query_text, COMPANY_MAP, parse_section(section) if section else None
+    )
+    if not plan["tickers"]:
+        print("--- No specific company found in query, searching all documents. ---")
+    for restriction in describe_plan(plan):
+        print(f"--- Filtering results by {restriction} ---")
 
-    print("\n--- Generating final answer... ---\n")
-    final_answer = generate_response(context, query_text)
-    print(final_answer)
+    with metrics.span("open_collection"):
+        collection = get_collection()
+    print("\n--- Searching and generating final answer... ---\n")
+    response = answer_question(
+        collection,
+        query_text,
+        num_results,
+        generator,
+        use_cache,
+        hybrid,
+        section,
+        rerank,
+        rerank_candidates,
+        token_budget,
+        timer,
+    )
+    timer.stop()
+    print("\n")
+    print(timer.report())
+    if write_metrics:
+        metrics.add_timings(response["timings"])
+        metrics.add_span("first_token", timer.first_token)
+        metrics.write()
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Query the SEC Filings knowledge base."
     )
-    parser.add_argument("query", type=str, help="The question you want to ask.")
+    parser.add_argument(
+        "query", type=str, nargs="?", help="The question you want to ask."
+    )
     parser.add_argument(
         "-n",
         "--num_results",
@@ -122,6 +746,149 @@ if __name__ == "__main__":
         default=7,
         help="Number of context chunks to retrieve.",
     )
+    parser.add_argument(
+        "--no_cache",
+        action="store_true",
+        help="Bypass the on-disk query embedding and retrieval cache.",
+    )
+    parser.add_argument(
+        "--hybrid",
+        action="store_true",
+        # None rather than False when not given, so a running server's default applies
+        default=None,
+        help="Fuse BM25 keyword matches with vector search (needs the lexical index).",
+    )
+    parser.add_argument(
+        "--section",
+        type=parse_section,
+        help="Only search one SEC Item, e.g. '1A' (Risk Factors) or 'Part II Item 1A'.",
+    )
+    parser.add_argument(
+        "--rerank",
+        action="store_true",
+        default=None,
+        help="Rerank a larger candidate set with a local cross-encoder and keep "
+        "the best -n chunks within --token_budget.",
+    )
+    parser.add_argument(
+        "--rerank_candidates",
+        type=int,
+        default=DEFAULT_RERANK_CANDIDATES,
+        help="Chunks retrieved for --rerank to choose from.",
+    )
+    parser.add_argument(
+        "--token_budget",
+        type=int,
+        default=DEFAULT_TOKEN_BUDGET,
+        help="Tokens of context sent to the LLM (and kept by --rerank).",
+    )
+    parser.add_argument(
+        "--metrics",
+        action="store_true",
+        help="Save per-step timings and peak memory for this question as run metrics.",
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Run a long-lived server that keeps the database and models warm.",
+    )
+    parser.add_argument(
+        "--port", type=int, default=SERVER_PORT, help="Port for --serve."
+    )
+    parser.add_argument(
+        "--generator",
+        choices=GENERATORS,
+        default="gemini",
+        help="Answer generator; 'echo' is an offline stub that lists the sources.",
+    )
+    parser.add_argument(
+        "--local",
+        action="store_true",
+        help="Answer in this process even if a server is running.",
+    )
+    parser.add_argument(
+        "--batch",
+        metavar="QUESTIONS_JSONL",
+        help='Answer every question in a JSONL file (one {"query": ...} per line).',
+    )
+    parser.add_argument(
+        "--output",
+        metavar="ANSWERS_JSONL",
+        help="Where --batch writes answers; defaults to stdout.",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=8,
+        help="Maximum generation calls in flight during --batch.",
+    )
 
     args = parser.parse_args()
-    main(args.query, args.num_results)
+    if args.serve:
+        import qa_server
+
+        qa_server.serve(
+            SERVER_HOST,
+            args.port,
+            GENERATORS[args.generator](),
+            bool(args.hybrid),
+            bool(args.rerank),
+        )
+    elif args.batch:
+        import qa_batch
+
+        qa_batch.run_batch(
+            args.batch,
+            args.output,
+            args.num_results,
+            None if args.generator == "gemini" else GENERATORS[args.generator](),
+            not args.no_cache,
+            args.concurrency,
+            bool(args.hybrid),
+            args.section,
+            bool(args.rerank),
+            args.rerank_candidates,
+            args.token_budget,
+        )
+    elif not args.query:
+        parser.error("a query is required unless --serve or --batch is given")
+    else:
+        if not args.local and server_is_up():
+            print(f"--- Answering with server at {SERVER_URL} ---\n")
+            timer = GenerationTimer(lambda piece: print(piece, end="", flush=True))
+            response = ask_server(
+                args.query,
+                args.num_results,
+                args.hybrid,
+                args.section,
+                args.rerank,
+                args.rerank_candidates,
+                args.token_budget,
+                timer,
+            )
+            timer.stop()
+            print("\n")
+            print(timer.report())
+            if args.metrics:
+                # Step timings come from the server, latency from this client
+                metrics = RunMetrics("qa_agent")
+                metrics.add_timings(response.get("timings", {}))
+                metrics.add_span("first_token", timer.first_token)
+                metrics.add_span("total", timer.total)
+                metrics.write()
+        else:
+            generator = (
+                None if args.generator == "gemini" else GENERATORS[args.generator]()
+            )
+            main(
+                args.query,
+                args.num_results,
+                not args.no_cache,
+                generator,
+                bool(args.hybrid),
+                args.section,
+                bool(args.rerank),
+                args.rerank_candidates,
+                args.token_budget,
+                args.metrics,
+            )
@@ -0,0 +1,315 @@
+import sys
+import json
+import time
+import asyncio
+import qa_agent
+from sec_sections import parse_section
+from query_planner import plan_query
+from query_cache import QueryCache, normalize_query
+from reranker import DEFAULT_RERANK_CANDIDATES, select_within_budget
+from context_builder import DEFAULT_TOKEN_BUDGET
+from chunk_store import resolve_documents
+from instrumentation import RunMetrics
+
+# --- CONFIGURATION ---
+
+# Generation calls in flight at once
+MAX_CONCURRENT_GENERATIONS = 8
+# ---
+
+
+def read_questions(input_path, num_results, section=None):
+    """
+    Reads one JSON object per line with a "query" and optional "id",
+    "num_results" and "section". Blank lines are skipped.
+    """
+    questions = []
+    with open(input_path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            question_section = record.get("section") or section
+            if question_section:
+                question_section = parse_section(question_section)
+            plan = plan_query(record["query"], qa_agent.COMPANY_MAP, question_section)
+            questions.append(
+                {
+                    "id": record.get("id", line_number),
+                    "query": record["query"],
+                    "num_results": int(record.get("num_results", num_results)),
+                    "ticker": plan["tickers"][0] if plan["tickers"] else None,
+                    "tickers": plan["tickers"],
+                    "section": question_section,
+                    "filters": plan["filters"],
+                }
+            )
+    return questions
+
+
+def retrieve_all(collection, questions, cache=None, hybrid=False):
+    """
+    Retrieves context for every question. Missing query embeddings are computed
+    in one batched call, and each (filter, num_results) group is searched with a
+    single multi-query collection.query; questions naming several companies take
+    part in one group per company and their sub-query results are merged.
+    With hybrid, each sub-query's vector results are fused with its BM25 results.
+    Chunks indexed with --store_text offsets are read from their text files.
+    Returns a list of (ids, documents, metadatas) in question order.
+    """
+    fingerprint = qa_agent.collection_fingerprint(collection) if cache else None
+    retrieved = [None] * len(questions)
+
+    # 1. Serve what we can from the retrieval cache
+    misses = []
+    for i, question in enumerate(questions):
+        if cache:
+            retrieved[i] = qa_agent.get_cached_results(
+                collection,
+                cache,
+                normalize_query(question["query"]),
+                question["filters"],
+                question["num_results"],
+                fingerprint,
+                hybrid,
+            )
+        if retrieved[i] is None:
+            misses.append(i)
+
+    # 2. Embed all remaining queries together
+    embeddings = {}
+    to_embed = []
+    for i in misses:
+        key = normalize_query(questions[i]["query"])
+        embedding = cache.get_embedding(key) if cache else None
+        if embedding is None:
+            to_embed.append(i)
+        else:
+            embeddings[i] = embedding
+    if to_embed:
+        vectors = qa_agent.get_embedding_function()(
+            [questions[i]["query"] for i in to_embed]
+        )
+        for i, vector in zip(to_embed, vectors):
+            embeddings[i] = vector
+            if cache:
+                cache.put_embedding(normalize_query(questions[i]["query"]), vector)
+
+    # 3. One multi-query search per (filter, num_results) group
+    groups = {}
+    for i in misses:
+        question = questions[i]
+        for n, where in enumerate(question["filters"]):
+            group_key = (json.dumps(where, sort_keys=True), question["num_results"])
+            groups.setdefault(group_key, []).append((i, n))
+
+    rankings = {i: {} for i in misses}
+    for members in groups.values():
+        i, n = members[0]
+        where = questions[i]["filters"][n]
+        num_results = questions[members[0][0]]["num_results"]
+        results = collection.query(
+            query_embeddings=[embeddings[i] for i, _ in members],
+            n_results=(
+                num_results * qa_agent.HYBRID_CANDIDATE_FACTOR
+                if hybrid
+                else num_results
+            ),
+            where=where,
+        )
+        for row, (i, n) in enumerate(members):
+            ranking = (
+                results["ids"][row],
+                results["documents"][row],
+                results["metadatas"][row],
+            )
+            if hybrid:
+                ranking = qa_agent.fuse_with_lexical(
+                    collection, questions[i]["query"], num_results, where, ranking
+                )
+            rankings[i][n] = ranking
+
+    # 4. Merge each question's sub-queries (in filter order) and cache the result
+    for i in misses:
+        question = questions[i]
+        if len(rankings[i]) == 1:
+            ids, documents, metadatas = rankings[i][0]
+        else:
+            ids, documents, metadatas = qa_agent.merge_rankings(
+                [rankings[i][n] for n in range(len(rankings[i]))],
+                question["num_results"],
+            )
+        retrieved[i] = (ids, documents, metadatas)
+        if cache:
+            qa_agent.put_cached_results(
+                cache,
+                normalize_query(question["query"]),
+                question["filters"],
+                question["num_results"],
+                fingerprint,
+                ids,
+                hybrid,
+            )
+
+    return [
+        (ids, resolve_documents(documents, metadatas), metadatas)
+        for ids, documents, metadatas in retrieved
+    ]
+
+
+def rerank_all(questions, retrieved, keep, token_budget):
+    """
+    Reranks every question's candidates with the cross-encoder, scoring all
+    (question, chunk) pairs of the batch together, and keeps each question's
+    best keep[i] chunks within token_budget.
+    """
+    reranker = qa_agent.get_reranker()
+    pairs = [
+        (question["query"], doc)
+        for question, (_, documents, _) in zip(questions, retrieved)
+        for doc in documents
+    ]
+    scores = reranker.score(pairs)
+
+    reranked = []
+    start = 0
+    for i, (ids, documents, metadatas) in enumerate(retrieved):
+        end = start + len(documents)
+        selected = select_within_budget(
+            scores[start:end], documents, keep[i], token_budget
+        )
+        reranked.append(
+            (
+                [ids[j] for j in selected],
+                [documents[j] for j in selected],
+                [metadatas[j] for j in selected],
+            )
+        )
+        start = end
+    return reranked
+
+
+async def generate_all(
+    questions,
+    retrieved,
+    generator,
+    out,
+    max_concurrency,
+    token_budget=DEFAULT_TOKEN_BUDGET,
+    metrics=None,
+):
+    """
+    Runs generation for every question with at most `max_concurrency` calls in
+    flight, writing each answer to `out` as a JSON line as soon as it is ready.
+    Each generation call is timed into metrics as a 'generate' span.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def answer(question, ids, documents, metadatas):
+        sources = []
+        if not documents:
+            text = "No relevant documents found for your query."
+        else:
+            context, sources = qa_agent.build_context(
+                ids, documents, metadatas, token_budget
+            )
+            async with semaphore:
+                start = time.perf_counter()
+                text = await asyncio.to_thread(
+                    qa_agent.generate_response, context, question["query"], generator
+                )
+                if metrics:
+                    metrics.add_span("generate", time.perf_counter() - start)
+        return {
+            "id": question["id"],
+            "query": question["query"],
+            "ticker": question["ticker"],
+            "tickers": question["tickers"],
+            "section": question["section"],
+            "answer": text,
+            "sources": sources,
+        }
+
+    tasks = [
+        asyncio.create_task(answer(question, *context))
+        for question, context in zip(questions, retrieved)
+    ]
+    for task in asyncio.as_completed(tasks):
+        out.write(json.dumps(await task) + "\n")
+        out.flush()
+
+
+def run_batch(
+    input_path,
+    output_path=None,
+    num_results=7,
+    generator=None,
+    use_cache=True,
+    max_concurrency=MAX_CONCURRENT_GENERATIONS,
+    hybrid=False,
+    section=None,
+    rerank=False,
+    rerank_candidates=DEFAULT_RERANK_CANDIDATES,
+    token_budget=DEFAULT_TOKEN_BUDGET,
+):
+    """
+    Answers every question in a JSONL file and streams the answers as JSONL
+    to output_path (or stdout), in completion order.
+    With rerank, each question retrieves rerank_candidates chunks and keeps
+    its best num_results after cross-encoder reranking.
+    """
+    metrics = RunMetrics("qa_batch")
+    with metrics.span("plan"):
+        questions = read_questions(input_path, num_results, section)
+    if not questions:
+        print("No questions found in the input file.", file=sys.stderr)
+        return
+
+    if generator is None:
+        if not qa_agent.GOOGLE_API_KEY:
+            print(
+                "Error: GOOGLE_API_KEY not found. Please set it in your .env file.",
+                file=sys.stderr,
+            )
+            return
+        generator = qa_agent.GeminiGenerator()
+
+    keep = [question["num_results"] for question in questions]
+    if rerank:
+        for question in questions:
+            question["num_results"] = max(question["num_results"], rerank_candidates)
+
+    collection = qa_agent.open_collection()
+    print(f"--- Retrieving context for {len(questions)} questions ---", file=sys.stderr)
+    cache = QueryCache(qa_agent.QUERY_CACHE_PATH) if use_cache else None
+    try:
+        with metrics.span("retrieve"):
+            retrieved = retrieve_all(collection, questions, cache, hybrid)
+    finally:
+        if cache:
+            cache.close()
+
+    if rerank:
+        print("--- Reranking candidates ---", file=sys.stderr)
+        with metrics.span("rerank"):
+            retrieved = rerank_all(questions, retrieved, keep, token_budget)
+
+    print("--- Generating answers ---", file=sys.stderr)
+    out = open(output_path, "w", encoding="utf-8") if output_path else sys.stdout
+    try:
+        asyncio.run(
+            generate_all(
+                questions,
+                retrieved,
+                generator,
+                out,
+                max_concurrency,
+                token_budget,
+                metrics,
+            )
+        )
+    finally:
+        if output_path:
+            out.close()
+    metrics.count("questions", len(questions))
+    metrics.write(log=sys.stderr)
@@ -0,0 +1,232 @@
+import json
+import asyncio
+import qa_agent
+from sec_sections import parse_section
+
+# --- CONFIGURATION ---
+
+# Questions answered at the same time; the rest wait their turn
+MAX_CONCURRENT_QUESTIONS = 8
+
+# Largest request body accepted, in bytes
+MAX_REQUEST_BYTES = 64 * 1024
+# ---
+
+STATUS_TEXT = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+
+
+class QAServer:
+    """
+    Long-lived question-answering service. Opens the collection, loads the
+    embedding model and creates the generator once, then answers questions
+    from an asyncio event loop. Blocking retrieval and generation run in
+    worker threads, so slow LLM calls don't hold up other clients.
+    """
+
+    def __init__(self, generator=None, use_cache=True, hybrid=False, rerank=False):
+        self.collection = qa_agent.open_collection()
+        # Load the embedding model now instead of on the first question
+        qa_agent.get_embedding_function()(["warm up"])
+        self.generator = generator or qa_agent.GeminiGenerator()
+        self.use_cache = use_cache
+        # Map the lexical index now too; requests may still override the mode
+        self.hybrid = hybrid
+        if hybrid:
+            qa_agent.get_lexical_index()
+        # Likewise the cross-encoder, when reranking is the default
+        self.rerank = rerank
+        if rerank:
+            qa_agent.get_reranker()
+        self.semaphore = asyncio.Semaphore(MAX_CONCURRENT_QUESTIONS)
+
+    async def answer(self, query_text, num_results, hybrid, section, context_options):
+        async with self.semaphore:
+            return await asyncio.to_thread(
+                qa_agent.answer_question,
+                self.collection,
+                query_text,
+                num_results,
+                self.generator,
+                self.use_cache,
+                hybrid,
+                section,
+                *context_options,
+            )
+
+    async def stream_answer(
+        self, query_text, num_results, hybrid, section, context_options
+    ):
+        """
+        Answers like answer(), but yields {"token": ...} events as the answer is
+        generated and finally {"done": True, "result": answer dict}.
+        """
+        loop = asyncio.get_running_loop()
+        pieces = asyncio.Queue()
+
+        def on_token(piece):
+            loop.call_soon_threadsafe(pieces.put_nowait, piece)
+
+        def run():
+            try:
+                return qa_agent.answer_question(
+                    self.collection,
+                    query_text,
+                    num_results,
+                    self.generator,
+                    self.use_cache,
+                    hybrid,
+                    section,
+                    *context_options,
+                    on_token,
+                )
+            finally:
+                # Queued after every piece, so it marks the end of the stream
+                loop.call_soon_threadsafe(pieces.put_nowait, None)
+
+        async with self.semaphore:
+            task = asyncio.create_task(asyncio.to_thread(run))
+            while True:
+                piece = await pieces.get()
+                if piece is None:
+                    break
+                yield {"token": piece}
+            yield {"done": True, "result": await task}
+
+    async def handle(self, method, path, body):
+        """
+        Routes one request and returns (status, response dict), or for a
+        streamed answer (200, async iterator of event dicts).
+        """
+        if method == "GET" and path == "/health":
+            return 200, {"status": "ok", "items": self.collection.count()}
+
+        if method == "POST" and path == "/ask":
+            try:
+                request = json.loads(body or b"{}")
+                query_text = request["query"]
+                num_results = int(request.get("num_results", 7))
+                hybrid = bool(request.get("hybrid", self.hybrid))
+                section = request.get("section")
+                section = parse_section(section) if section else None
+                context_options = (
+                    bool(request.get("rerank", self.rerank)),
+                    int(
+                        request.get(
+                            "rerank_candidates", qa_agent.DEFAULT_RERANK_CANDIDATES
+                        )
+                    ),
+                    int(request.get("token_budget", qa_agent.DEFAULT_TOKEN_BUDGET)),
+                )
+            except (ValueError, KeyError, TypeError) as e:
+                return 400, {"error": f"Invalid request: {e}"}
+            if request.get("stream"):
+                return 200, self.stream_answer(
+                    query_text, num_results, hybrid, section, context_options
+                )
+            return 200, await self.answer(
+                query_text, num_results, hybrid, section, context_options
+            )
+
+        return 404, {"error": f"No route for {method} {path}"}
+
+    async def handle_connection(self, reader, writer):
+        """
+        Minimal HTTP/1.1: one JSON request and one JSON response per connection.
+        Streamed responses are JSON lines, written as they are produced and
+        ended by closing the connection. A failed answer is a 500 response,
+        or an {"error": ...} line once a stream has started.
+        """
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if not line:
+                    break
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            length = int(headers.get("content-length", 0))
+            if len(request_line) < 2:
+                status, response = 400, {"error": "Malformed request line"}
+            elif length > MAX_REQUEST_BYTES:
+                status, response = 413, {"error": "Request body too large"}
+            else:
+                body = await reader.readexactly(length) if length else b""
+                try:
+                    status, response = await self.handle(
+                        request_line[0], request_line[1], body
+                    )
+                except Exception as e:
+                    print(f"  - Error handling {request_line[1]}: {e!r}")
+                    status, response = 500, {"error": f"Internal error: {e}"}
+
+            if not isinstance(response, dict):
+                writer.write(
+                    (
+                        f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+                        "Content-Type: application/x-ndjson\r\n"
+                        "Connection: close\r\n\r\n"
+                    ).encode("latin-1")
+                )
+                try:
+                    async for event in response:
+                        writer.write(json.dumps(event).encode("utf-8") + b"\n")
+                        await writer.drain()
+                except ConnectionError:
+                    raise
+                except Exception as e:
+                    print(f"  - Error streaming {request_line[1]}: {e!r}")
+                    error = {"error": f"Internal error: {e}"}
+                    writer.write(json.dumps(error).encode("utf-8") + b"\n")
+                    await writer.drain()
+                return
+
+            payload = json.dumps(response).encode("utf-8")
+            writer.write(
+                (
+                    f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+                    "Content-Type: application/json\r\n"
+                    f"Content-Length: {len(payload)}\r\n"
+                    "Connection: close\r\n\r\n"
+                ).encode("latin-1")
+                + payload
+            )
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError) as e:
+            print(f"  - Dropped connection: {e}")
+        finally:
+            writer.close()
+
+
+async def run_server(
+    host, port, generator=None, use_cache=True, ready=None, hybrid=False, rerank=False
+):
+    """Starts the service and serves until cancelled. Sets `ready` once listening."""
+    server = QAServer(generator, use_cache, hybrid, rerank)
+    listener = await asyncio.start_server(server.handle_connection, host, port)
+    print(f"--- QA server listening on http://{host}:{port} ---")
+    if ready is not None:
+        ready.set()
+    async with listener:
+        await listener.serve_forever()
+
+
+def serve(
+    host=qa_agent.SERVER_HOST,
+    port=qa_agent.SERVER_PORT,
+    generator=None,
+    hybrid=False,
+    rerank=False,
+):
+    """Runs the QA server in the foreground until interrupted."""
+    try:
+        asyncio.run(run_server(host, port, generator, hybrid=hybrid, rerank=rerank))
+    except KeyboardInterrupt:
+        print("\n--- QA server stopped ---")
@@ -0,0 +1,642 @@
+import os
+import re
+import json
+import sqlite3
+import threading
+from pathlib import Path
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# --- CONFIGURATION ---
+
+# 'int8' keeps one signed byte per dimension in memory (4x smaller than float32).
+# 'binary' keeps one sign bit per dimension in memory (32x smaller) for a coarse
+# Hamming pass, and reads the int8 codes from disk only to re-score candidates.
+PRECISIONS = ["int8", "binary"]
+
+# Candidates re-scored with the float query, per requested result
+BINARY_RESCORE_FACTOR = 10
+
+# Rows scored per block, bounding the temporary float copy of the codes
+SCAN_BLOCK_ROWS = 65536
+
+# Metadata fields with an SQLite expression index, for filtered queries and deletes
+INDEXED_FIELDS = ["ticker", "form_type", "date", "section", "source_file"]
+
+# The vector files are rewritten without deleted rows once they exceed this share
+COMPACT_DEAD_FRACTION = 0.5
+
+# SQLite bound-parameter limit per statement, with room to spare
+SQL_BATCH = 900
+
+# Lock file held by the one process allowed to write (and repair) a store
+WRITER_LOCK = "writer.lock"
+# ---
+
+FIELD_RE = re.compile(r"^\w+$")
+COMPARISONS = {
+    "$eq": "=",
+    "$ne": "!=",
+    "$gt": ">",
+    "$gte": ">=",
+    "$lt": "<",
+    "$lte": "<=",
+}
+
+
+def normalize(vectors):
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def quantize(vectors):
+    """
+    Symmetric per-vector int8 quantization.
+    Returns (codes, scales) with vector ~= codes * scale.
+    """
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales[scales == 0] = 1.0
+    codes = np.rint(vectors / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def binarize(vectors):
+    """One sign bit per dimension, packed eight to a byte."""
+    return np.packbits(vectors > 0, axis=1)
+
+
+def top_k(scores, k):
+    """Positions of the k highest scores, best first."""
+    if k < len(scores):
+        positions = np.argpartition(-scores, k - 1)[:k]
+    else:
+        positions = np.arange(len(scores))
+    return positions[np.argsort(-scores[positions], kind="stable")]
+
+
+def placeholders(values):
+    return ", ".join("?" * len(values))
+
+
+def field_sql(field):
+    if not FIELD_RE.match(field):
+        raise ValueError(f"Unsupported metadata field: {field!r}")
+    return f"json_extract(metadata, '$.{field}')"
+
+
+def where_sql(where, params):
+    """
+    Translates a Chroma where filter into an SQL condition on the metadata JSON,
+    appending its bound values to params.
+    """
+    conditions = []
+    for key, value in where.items():
+        if key in ("$and", "$or"):
+            parts = [where_sql(clause, params) for clause in value]
+            joiner = " AND " if key == "$and" else " OR "
+            conditions.append("(" + joiner.join(parts or ["1"]) + ")")
+            continue
+        column = field_sql(key)
+        if not isinstance(value, dict):
+            value = {"$eq": value}
+        for op, operand in value.items():
+            if op in COMPARISONS:
+                conditions.append(f"{column} {COMPARISONS[op]} ?")
+                params.append(operand)
+            elif op in ("$in", "$nin"):
+                if not operand:
+                    conditions.append("0" if op == "$in" else "1")
+                    continue
+                negate = "NOT " if op == "$nin" else ""
+                conditions.append(f"{column} {negate}IN ({placeholders(operand)})")
+                params.extend(operand)
+            else:
+                raise ValueError(f"Unsupported filter operator: {op}")
+    return " AND ".join(conditions) or "1"
+
+
+def hamming_distances(query_bits, bits):
+    """Number of differing bits between one packed query and each packed row."""
+    return np.bitwise_count(np.bitwise_xor(bits, query_bits)).sum(
+        axis=1, dtype=np.int32
+    )
+
+
+def lock_writer(path):
+    """
+    Takes the store's writer lock without waiting; the lock is held until the
+    returned file is closed (or the process exits).
+    """
+    f = open(os.path.join(path, WRITER_LOCK), "a+b")
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        f.close()
+        raise RuntimeError(f"{path} is already being written by another process")
+    return f
+
+
+def grow(array, used, extra):
+    """Returns `array`, reallocated if needed, with room for `extra` more rows."""
+    if used + extra <= len(array):
+        return array
+    grown = np.empty(
+        (max(2 * len(array), used + extra),) + array.shape[1:], dtype=array.dtype
+    )
+    grown[:used] = array[:used]
+    return grown
+
+
+class QuantizedCollection:
+    """
+    Compact vector store with the parts of Chroma's Collection API that
+    bulk_embedder and qa_agent use: upsert, update, delete, get, query and count.
+    Documents and metadata live in SQLite. Vectors are kept only as int8 codes
+    with a per-vector scale (plus packed sign bits for 'binary'), in append-only
+    files addressed by row number. Queries are exhaustive scans over the
+    quantized vectors of the rows that pass the filter, with the surviving
+    candidates scored by the float query against their int8 codes.
+    Vectors are normalized on the way in, so scores are cosine similarities.
+
+    One process writes a store (holding WRITER_LOCK) while others may open it
+    with read_only=True. Readers never modify the files: they ignore bytes past
+    the committed rows and reload when a writer has committed since.
+    """
+
+    def __init__(self, path, precision=None, read_only=False):
+        self.path = path
+        self.read_only = read_only
+        self.lock = threading.Lock()
+        self.writer_lock = None
+        database = os.path.join(path, "store.sqlite")
+        if read_only:
+            self.conn = sqlite3.connect(
+                Path(os.path.abspath(database)).as_uri() + "?mode=ro",
+                uri=True,
+                check_same_thread=False,
+            )
+            self._load_state()
+            return
+
+        os.makedirs(path, exist_ok=True)
+        self.writer_lock = lock_writer(path)
+        self.conn = sqlite3.connect(database, check_same_thread=False)
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS chunks (
+                row INTEGER PRIMARY KEY,
+                id TEXT NOT NULL UNIQUE,
+                document TEXT,
+                metadata TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            """
+        )
+        with self.conn:
+            for field in INDEXED_FIELDS:
+                self.conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS chunks_{field}"
+                    f" ON chunks ({field_sql(field)})"
+                )
+
+        meta = dict(self.conn.execute("SELECT key, value FROM meta"))
+        stored = meta.get("precision")
+        if stored and precision and stored != precision:
+            raise ValueError(
+                f"{path} holds {stored} vectors; delete it to rebuild as {precision}"
+            )
+        self.precision = stored or precision or PRECISIONS[0]
+        if self.precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision: {self.precision}")
+        self.dimensions = int(meta.get("dimensions", 0))
+        self.num_rows = int(meta.get("num_rows", 0))
+        self.generation = int(meta.get("generation", 0))
+        if not stored:
+            self._set_meta(precision=self.precision)
+        self._repair()
+        self._load_vectors()
+
+    # --- storage ---
+
+    def _file(self, name, generation=None):
+        generation = self.generation if generation is None else generation
+        return os.path.join(self.path, f"{name}.{generation}.bin")
+
+    def _set_meta(self, **values):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                [(key, str(value)) for key, value in values.items()],
+            )
+
+    def _widths(self):
+        """{file name: (dtype, values per row)} of the vector files."""
+        width = max(self.dimensions, 1)
+        widths = {"scales": (np.float32, 1), "codes": (np.int8, width)}
+        if self.precision == "binary":
+            widths["bits"] = (np.uint8, (width + 7) // 8)
+        return widths
+
+    def _read(self, name):
+        """Loads the committed rows of one vector file; bytes past them are ignored."""
+        dtype, width = self._widths()[name]
+        count = self.num_rows * width
+        if not count:
+            return np.zeros((0, width), dtype=dtype)
+        values = np.fromfile(self._file(name), dtype=dtype, count=count)
+        if len(values) < count:
+            raise ValueError(f"{self._file(name)} is missing committed rows")
+        return values.reshape(-1, width)
+
+    def _load_vectors(self):
+        self.scales = self._read("scales")[:, 0]
+        if self.precision == "binary":
+            self.bits = self._read("bits")
+            # Only re-scored candidates are read, so the codes stay on disk
+            self._codes_map = None
+            self._int8_codes(self.num_rows)
+        else:
+            self.codes = self._read("codes")
+        self.live = np.zeros(self.num_rows, dtype=bool)
+        rows = np.fromiter(
+            (row for (row,) in self.conn.execute("SELECT row FROM chunks")),
+            dtype=np.int64,
+        )
+        self.live[rows] = True
+        self.num_live = len(rows)
+
+    def _repair(self):
+        """
+        Writer only: cuts torn appends back to the committed rows and removes the
+        files of other generations, left by an interrupted or finished compaction.
+        """
+        for name, (dtype, width) in self._widths().items():
+            path = self._file(name)
+            size = self.num_rows * width * np.dtype(dtype).itemsize
+            if not os.path.exists(path):
+                open(path, "wb").close()
+            elif os.path.getsize(path) > size:
+                os.truncate(path, size)
+        for name in os.listdir(self.path):
+            if name.endswith(".bin") and not name.endswith(f".{self.generation}.bin"):
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except OSError:
+                    pass  # Still mapped by a reader; a later writer removes it
+
+    def _load_state(self):
+        """
+        Reader only: reads the committed state and loads its vectors. The read
+        transaction keeps a writer from committing (and so from removing the
+        files of this generation) until the vectors are loaded.
+        """
+        self.conn.execute("BEGIN")
+        try:
+            meta = dict(self.conn.execute("SELECT key, value FROM meta"))
+            self.precision = meta.get("precision", PRECISIONS[0])
+            self.dimensions = int(meta.get("dimensions", 0))
+            self.num_rows = int(meta.get("num_rows", 0))
+            self.generation = int(meta.get("generation", 0))
+            self._load_vectors()
+        finally:
+            self.conn.rollback()
+
+    def _refresh(self):
+        """Reader only: reloads if a writer has appended or compacted since loading."""
+        meta = dict(self.conn.execute("SELECT key, value FROM meta"))
+        committed = (int(meta.get("num_rows", 0)), int(meta.get("generation", 0)))
+        if committed != (self.num_rows, self.generation):
+            self._load_state()
+
+    def _int8_codes(self, num_rows):
+        if self.precision != "binary":
+            return self.codes
+        if self._codes_map is None or len(self._codes_map) != num_rows:
+            self._codes_map = (
+                np.memmap(
+                    self._file("codes"),
+                    dtype=np.int8,
+                    mode="r",
+                    shape=(num_rows, self.dimensions),
+                )
+                if num_rows
+                else np.zeros((0, self.dimensions), dtype=np.int8)
+            )
+        return self._codes_map
+
+    def _append_vectors(self, vectors):
+        """Appends normalized vectors as new rows; returns their row numbers."""
+        if not self.dimensions:
+            self.dimensions = vectors.shape[1]
+            self._set_meta(dimensions=self.dimensions)
+            self._repair()
+            self._load_vectors()
+        if vectors.shape[1] != self.dimensions:
+            raise ValueError(
+                f"Expected {self.dimensions}-dimensional embeddings,"
+                f" got {vectors.shape[1]}"
+            )
+        codes, scales = quantize(vectors)
+        added = {"codes": codes, "scales": scales}
+        if self.precision == "binary":
+            added["bits"] = binarize(vectors)
+        for name, array in added.items():
+            with open(self._file(name), "ab") as f:
+                f.write(array.tobytes())
+
+        first, count = self.num_rows, len(vectors)
+        self.scales = grow(self.scales, first, count)
+        self.scales[first : first + count] = scales
+        if self.precision == "binary":
+            self.bits = grow(self.bits, first, count)
+            self.bits[first : first + count] = added["bits"]
+        else:
+            self.codes = grow(self.codes, first, count)
+            self.codes[first : first + count] = codes
+        self.live = grow(self.live, first, count)
+        self.live[first : first + count] = False
+        return np.arange(first, first + count)
+
+    def _rows(self, ids=None, where=None):
+        """Row numbers of the stored chunks matching the ids and/or filter."""
+        condition, params = "1", []
+        if where:
+            condition = where_sql(where, params)
+        if ids is None:
+            return [
+                row
+                for (row,) in self.conn.execute(
+                    f"SELECT row FROM chunks WHERE {condition} ORDER BY row", params
+                )
+            ]
+        rows = []
+        ids = list(ids)
+        for start in range(0, len(ids), SQL_BATCH):
+            batch = ids[start : start + SQL_BATCH]
+            rows += [
+                row
+                for (row,) in self.conn.execute(
+                    f"SELECT row FROM chunks WHERE id IN ({placeholders(batch)})"
+                    f" AND {condition}",
+                    batch + params,
+                )
+            ]
+        return sorted(rows)
+
+    def _fetch(self, rows):
+        """{row: (id, document, metadata)} for the given rows."""
+        found = {}
+        rows = [int(row) for row in rows]
+        for start in range(0, len(rows), SQL_BATCH):
+            batch = rows[start : start + SQL_BATCH]
+            for row, chunk_id, document, metadata in self.conn.execute(
+                "SELECT row, id, document, metadata FROM chunks"
+                f" WHERE row IN ({placeholders(batch)})",
+                batch,
+            ):
+                found[row] = (chunk_id, document, json.loads(metadata))
+        return found
+
+    def _dequantize(self, rows):
+        codes = self._int8_codes(self.num_rows)[rows].astype(np.float32)
+        return codes * self.scales[rows][:, None]
+
+    # --- writing ---
+
+    def _check_writable(self):
+        if self.read_only:
+            raise ValueError(f"{self.path} was opened read-only")
+
+    def upsert(self, ids, embeddings, metadatas=None, documents=None):
+        self._check_writable()
+        ids = list(ids)
+        if len(set(ids)) != len(ids):
+            raise ValueError("Duplicate ids in upsert")
+        metadatas = metadatas or [{} for _ in ids]
+        documents = documents or [None for _ in ids]
+        with self.lock:
+            replaced = self._rows(ids)
+            rows = self._append_vectors(normalize(embeddings))
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?)",
+                    [
+                        (int(row), chunk_id, document, json.dumps(metadata))
+                        for row, chunk_id, document, metadata in zip(
+                            rows, ids, documents, metadatas
+                        )
+                    ],
+                )
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('num_rows', ?)",
+                    (str(self.num_rows + len(rows)),),
+                )
+            self.num_rows += len(rows)
+            self.live[replaced] = False
+            self.live[rows] = True
+            self.num_live += len(rows) - len(replaced)
+            self._maybe_compact()
+
+    def update(self, ids, embeddings=None, metadatas=None, documents=None):
+        """Replaces the given fields of existing chunks; unknown ids are ignored."""
+        self._check_writable()
+        ids = list(ids)
+        if embeddings is not None:
+            existing = self.get(ids=ids)
+            stored = dict(
+                zip(existing["ids"], zip(existing["documents"], existing["metadatas"]))
+            )
+            keep = [i for i, chunk_id in enumerate(ids) if chunk_id in stored]
+            self.upsert(
+                [ids[i] for i in keep],
+                [embeddings[i] for i in keep],
+                [metadatas[i] if metadatas else stored[ids[i]][1] for i in keep],
+                [documents[i] if documents else stored[ids[i]][0] for i in keep],
+            )
+            return
+        with self.lock, self.conn:
+            if metadatas is not None:
+                self.conn.executemany(
+                    "UPDATE chunks SET metadata = ? WHERE id = ?",
+                    [(json.dumps(m), chunk_id) for m, chunk_id in zip(metadatas, ids)],
+                )
+            if documents is not None:
+                self.conn.executemany(
+                    "UPDATE chunks SET document = ? WHERE id = ?",
+                    list(zip(documents, ids)),
+                )
+
+    def delete(self, ids=None, where=None):
+        self._check_writable()
+        with self.lock:
+            rows = self._rows(ids, where)
+            with self.conn:
+                for start in range(0, len(rows), SQL_BATCH):
+                    batch = rows[start : start + SQL_BATCH]
+                    self.conn.execute(
+                        f"DELETE FROM chunks WHERE row IN ({placeholders(batch)})",
+                        batch,
+                    )
+            self.live[rows] = False
+            self.num_live -= len(rows)
+            self._maybe_compact()
+
+    def _maybe_compact(self):
+        if self.num_rows - self.num_live > COMPACT_DEAD_FRACTION * self.num_rows:
+            self._compact()
+
+    def _compact(self):
+        """
+        Rewrites the vector files with only live rows and renumbers them.
+        New files get a new generation number, which is switched to in the same
+        SQLite transaction as the renumbering, so a crash leaves either version.
+        """
+        rows = np.flatnonzero(self.live[: self.num_rows])
+        generation = self.generation + 1
+        arrays = {"codes": self._int8_codes(self.num_rows), "scales": self.scales}
+        if self.precision == "binary":
+            arrays["bits"] = self.bits
+        for name, array in arrays.items():
+            with open(self._file(name, generation), "wb") as f:
+                f.write(np.ascontiguousarray(array[rows]).tobytes())
+
+        with self.conn:
+            # Rows only ever move down, in order, so no two ever collide
+            self.conn.executemany(
+                "UPDATE chunks SET row = ? WHERE row = ?",
+                [(new, int(old)) for new, old in enumerate(rows) if new != old],
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                [("num_rows", str(len(rows))), ("generation", str(generation))],
+            )
+        self.num_rows, self.generation = len(rows), generation
+        self._load_vectors()
+        self._repair()
+
+    # --- reading ---
+
+    def count(self):
+        if self.read_only:
+            with self.lock:
+                self._refresh()
+        return self.num_live
+
+    def nbytes(self):
+        """Bytes of vector data held in memory; binary codes are read from disk."""
+        arrays = [self.scales, self.live]
+        arrays.append(self.bits if self.precision == "binary" else self.codes)
+        return sum(array.nbytes for array in arrays)
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=None):
+        include = include or ["metadatas", "documents"]
+        with self.lock:
+            if self.read_only:
+                self._refresh()
+            rows = self._rows(ids, where)
+            rows = rows[offset or 0 :]
+            if limit is not None:
+                rows = rows[:limit]
+            found = self._fetch(rows)
+            embeddings = self._dequantize(rows) if "embeddings" in include else None
+        return {
+            "ids": [found[row][0] for row in rows],
+            "documents": (
+                [found[row][1] for row in rows] if "documents" in include else None
+            ),
+            "metadatas": (
+                [found[row][2] for row in rows] if "metadatas" in include else None
+            ),
+            "embeddings": embeddings,
+            "include": include,
+        }
+
+    def query(self, query_embeddings, n_results=10, where=None, include=None):
+        """
+        Nearest chunks for each query embedding, in Chroma's result layout, with
+        cosine distances.
+        """
+        include = include or ["metadatas", "documents", "distances"]
+        queries = normalize(query_embeddings)
+        with self.lock:
+            if self.read_only:
+                self._refresh()
+            # Appends and compaction replace these arrays rather than changing
+            # the rows seen here, so the scan itself runs without the lock
+            num_rows = self.num_rows
+            scales = self.scales[:num_rows]
+            codes = self._int8_codes(num_rows)
+            bits = self.bits[:num_rows] if self.precision == "binary" else None
+            if where:
+                candidates = np.array(self._rows(where=where), dtype=np.int64)
+            else:
+                candidates = np.flatnonzero(self.live[:num_rows])
+
+        rankings = []
+        for query in queries:
+            if self.precision == "binary":
+                shortlist = self._binary_shortlist(
+                    query, bits, candidates, n_results * BINARY_RESCORE_FACTOR
+                )
+            else:
+                shortlist = candidates
+            similarities = self._similarities(query, codes, scales, shortlist)
+            best = top_k(similarities, n_results)
+            rankings.append((shortlist[best], similarities[best]))
+
+        with self.lock:
+            found = self._fetch({int(row) for rows, _ in rankings for row in rows})
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for rows, similarities in rankings:
+            kept = [i for i, row in enumerate(rows) if int(row) in found]
+            results["ids"].append([found[int(rows[i])][0] for i in kept])
+            results["documents"].append([found[int(rows[i])][1] for i in kept])
+            results["metadatas"].append([found[int(rows[i])][2] for i in kept])
+            results["distances"].append([float(1 - similarities[i]) for i in kept])
+        for field in ("documents", "metadatas", "distances"):
+            if field not in include:
+                results[field] = None
+        results["include"] = include
+        return results
+
+    @staticmethod
+    def _similarities(query, codes, scales, rows):
+        """Float query against the int8 codes of `rows`, block by block."""
+        similarities = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), SCAN_BLOCK_ROWS):
+            block = rows[start : start + SCAN_BLOCK_ROWS]
+            similarities[start : start + len(block)] = (
+                codes[block].astype(np.float32) @ query
+            )
+        return similarities * scales[rows]
+
+    @staticmethod
+    def _binary_shortlist(query, bits, rows, size):
+        """The `size` rows whose sign bits are closest to the query's."""
+        query_bits = binarize(query[None, :])[0]
+        distances = np.empty(len(rows), dtype=np.int32)
+        for start in range(0, len(rows), SCAN_BLOCK_ROWS):
+            block = rows[start : start + SCAN_BLOCK_ROWS]
+            distances[start : start + len(block)] = hamming_distances(
+                query_bits, bits[block]
+            )
+        # Ties broken by row number keep results deterministic
+        return np.sort(rows[top_k(-distances.astype(np.float32), size)])
+
+    def close(self):
+        self.conn.close()
+        if self.writer_lock is not None:
+            self.writer_lock.close()
@@ -0,0 +1,122 @@
+import json
+import time
+import sqlite3
+from array import array
+
+# --- CONFIGURATION ---
+
+# Maximum number of distinct questions kept; least recently used ones are evicted
+MAX_CACHED_QUERIES = 5000
+# ---
+
+
+def normalize_query(query_text):
+    """Cache key for a question: case, spacing and trailing punctuation don't matter."""
+    return " ".join(query_text.lower().split()).rstrip("?.! ")
+
+
+def filter_key(where, mode="vector"):
+    """Results key for a filter; non-vector retrieval modes are cached separately."""
+    if mode != "vector":
+        where = {"mode": mode, "where": where}
+    return json.dumps(where, sort_keys=True)
+
+
+class QueryCache:
+    """
+    On-disk LRU cache for qa_agent. Stores each question's embedding, plus the
+    chunk IDs retrieved for it under a given filter and result count.
+    Retrieved IDs are tagged with the collection fingerprint they were computed
+    against and are ignored once the collection's contents change. Embeddings
+    stay valid because they depend only on the question and the model.
+    """
+
+    def __init__(self, path, max_queries=MAX_CACHED_QUERIES):
+        self.max_queries = max_queries
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS queries (
+                query TEXT PRIMARY KEY,
+                embedding BLOB NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS results (
+                query TEXT NOT NULL,
+                filter TEXT NOT NULL,
+                num_results INTEGER NOT NULL,
+                fingerprint TEXT NOT NULL,
+                ids TEXT NOT NULL,
+                PRIMARY KEY (query, filter, num_results)
+            );
+            CREATE INDEX IF NOT EXISTS queries_last_used ON queries (last_used);
+            """
+        )
+
+    def get_embedding(self, query):
+        """Returns the cached embedding of a normalized query, or None."""
+        row = self.conn.execute(
+            "SELECT embedding FROM queries WHERE query = ?", (query,)
+        ).fetchone()
+        if row is None:
+            return None
+        with self.conn:
+            self.conn.execute(
+                "UPDATE queries SET last_used = ? WHERE query = ?", (time.time(), query)
+            )
+        # float32 bytes; array keeps numpy out of the CLI's startup path
+        return array("f", row[0]).tolist()
+
+    def put_embedding(self, query, embedding):
+        """Stores a query embedding and evicts the least recently used queries."""
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO queries VALUES (?, ?, ?)",
+                (query, array("f", embedding).tobytes(), time.time()),
+            )
+            self._evict()
+
+    def get_ids(self, query, where, num_results, fingerprint, mode="vector"):
+        """Returns the chunk IDs cached for this search, or None if missing or stale."""
+        row = self.conn.execute(
+            "SELECT fingerprint, ids FROM results"
+            " WHERE query = ? AND filter = ? AND num_results = ?",
+            (query, filter_key(where, mode), num_results),
+        ).fetchone()
+        if row is None or row[0] != fingerprint:
+            return None
+        return json.loads(row[1])
+
+    def put_ids(self, query, where, num_results, fingerprint, ids, mode="vector"):
+        """Stores the chunk IDs retrieved for this search."""
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                (
+                    query,
+                    filter_key(where, mode),
+                    num_results,
+                    fingerprint,
+                    json.dumps(ids),
+                ),
+            )
+            # Results computed against an older collection will never be used again
+            self.conn.execute(
+                "DELETE FROM results WHERE fingerprint != ?", (fingerprint,)
+            )
+
+    def _evict(self):
+        count = self.conn.execute("SELECT COUNT(*) FROM queries").fetchone()[0]
+        if count <= self.max_queries:
+            return
+        self.conn.execute(
+            "DELETE FROM queries WHERE query IN"
+            " (SELECT query FROM queries ORDER BY last_used LIMIT ?)",
+            (count - self.max_queries,),
+        )
+        self.conn.execute(
+            "DELETE FROM results WHERE query NOT IN (SELECT query FROM queries)"
+        )
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,171 @@
+import re
+import datetime
+
+# --- CONFIGURATION ---
+
+# Phrases that restrict a question to one or more form types
+FORM_TYPE_PATTERNS = {
+    "10-K": r"\b10-?K\b|\bannual reports?\b",
+    "10-Q": r"\b10-?Q\b|\bquarterly reports?\b",
+    "8-K": r"\b8-?K\b|\bcurrent reports?\b",
+}
+
+# Years outside this window are treated as ordinary numbers (EDGAR starts in 1993)
+EARLIEST_YEAR = 1993
+
+# A bare year ("Apple's 2023 revenue") usually means a fiscal year, whose annual
+# report may be filed up to 90 days after it ends, so its filing-date range
+# runs into the following year up to this (month, day)
+FISCAL_YEAR_FILED_BY = (3, 31)
+# ---
+
+YEAR = r"((?:19|20)\d{2})"
+BETWEEN_RE = re.compile(
+    rf"\b(?:between|from)\s+{YEAR}\s+(?:and|to|through|until)\s+{YEAR}\b"
+    rf"|\b{YEAR}\s*(?:-|–|to|through)\s*{YEAR}\b",
+    re.IGNORECASE,
+)
+SINCE_RE = re.compile(
+    rf"\b(since|after|before|until|through)\s+{YEAR}\b", re.IGNORECASE
+)
+YEAR_RE = re.compile(rf"\b{YEAR}\b")
+SYMBOL_RE = re.compile(r"\b[A-Z]{1,5}\b")
+
+
+def date_value(year, month=1, day=1):
+    """Numeric form of a date as stored in chunk metadata: 2024-11-01 -> 20241101."""
+    return year * 10000 + month * 100 + day
+
+
+def format_date(value):
+    """20241101 -> '2024-11-01'."""
+    return f"{value // 10000}-{value // 100 % 100:02d}-{value % 100:02d}"
+
+
+def is_year(value):
+    return EARLIEST_YEAR <= int(value) <= datetime.date.today().year + 1
+
+
+def extract_tickers(query, company_map):
+    """
+    Every company mentioned by name (via company_map) or by ticker symbol,
+    in the order they appear in the question, without duplicates.
+    """
+    query_lower = query.lower()
+    found = []
+    for name, ticker in company_map.items():
+        for match in re.finditer(rf"\b{re.escape(name)}\b", query_lower):
+            found.append((match.start(), ticker))
+    symbols = set(company_map.values())
+    for match in SYMBOL_RE.finditer(query):
+        if match.group() in symbols:
+            found.append((match.start(), match.group()))
+
+    tickers = []
+    for _, ticker in sorted(found):
+        if ticker not in tickers:
+            tickers.append(ticker)
+    return tickers
+
+
+def extract_form_types(query):
+    """Form types named in the question, e.g. ['10-K'] for '... in the 2023 10-K'."""
+    return [
+        form_type
+        for form_type, pattern in FORM_TYPE_PATTERNS.items()
+        if re.search(pattern, query, re.IGNORECASE)
+    ]
+
+
+def extract_date_range(query):
+    """
+    Filing-date range implied by the question, as (start, end) numeric dates where
+    either end may be None, or None if no years are mentioned.
+    'between 2021 and 2023' and '2021-2023' are inclusive, 'since 2022' and
+    'before 2020' are open-ended, and bare years are read as fiscal years: from
+    the earliest one to FISCAL_YEAR_FILED_BY in the year after the latest.
+    """
+    match = BETWEEN_RE.search(query)
+    if match:
+        years = sorted(int(y) for y in match.groups() if y and is_year(y))
+        if len(years) == 2:
+            return date_value(years[0]), date_value(years[1], 12, 31)
+
+    match = SINCE_RE.search(query)
+    if match and is_year(match.group(2)):
+        word, year = match.group(1).lower(), int(match.group(2))
+        if word == "since":
+            return date_value(year), None
+        if word == "after":
+            return date_value(year + 1), None
+        if word == "before":
+            return None, date_value(year - 1, 12, 31)
+        return None, date_value(year, 12, 31)
+
+    years = [int(y) for y in YEAR_RE.findall(query) if is_year(y)]
+    if years:
+        return date_value(min(years)), date_value(max(years) + 1, *FISCAL_YEAR_FILED_BY)
+    return None
+
+
+def combine(conditions):
+    """Joins filter conditions with $and (Chroma rejects a single-element $and)."""
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+def plan_query(query, company_map, section=None):
+    """
+    Works out which partitions of the collection a question needs.
+    Returns a dict with the extracted tickers, form_types, date_range and section,
+    and 'filters': one Chroma where filter per sub-query. Questions naming several
+    companies get one sub-query per ticker so each searches a small partition;
+    otherwise there is a single filter (None when nothing restricts the search).
+    """
+    tickers = extract_tickers(query, company_map)
+    form_types = extract_form_types(query)
+    date_range = extract_date_range(query)
+
+    shared = []
+    if len(form_types) == 1:
+        shared.append({"form_type": form_types[0]})
+    elif form_types:
+        shared.append({"form_type": {"$in": form_types}})
+    if date_range and date_range[0] is not None:
+        shared.append({"date": {"$gte": date_range[0]}})
+    if date_range and date_range[1] is not None:
+        shared.append({"date": {"$lte": date_range[1]}})
+    if section:
+        shared.append({"section": section})
+
+    if tickers:
+        filters = [combine([{"ticker": ticker}] + shared) for ticker in tickers]
+    else:
+        filters = [combine(shared)]
+
+    return {
+        "tickers": tickers,
+        "form_types": form_types,
+        "date_range": date_range,
+        "section": section,
+        "filters": filters,
+    }
+
+
+def describe_plan(plan):
+    """One line per restriction, for the CLI's status output."""
+    lines = []
+    if plan["tickers"]:
+        lines.append(f"tickers: {', '.join(plan['tickers'])}")
+    if plan["form_types"]:
+        lines.append(f"form types: {', '.join(plan['form_types'])}")
+    if plan["date_range"]:
+        start, end = plan["date_range"]
+        lines.append(
+            f"filing date: {format_date(start) if start else 'any'}"
+            f" to {format_date(end) if end else 'any'}"
+        )
+    if plan["section"]:
+        lines.append(f"section: {plan['section']}")
+    return lines
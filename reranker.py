@@ -0,0 +1,74 @@
+import threading
+from context_builder import DEFAULT_TOKEN_BUDGET, count_tokens
+
+# --- CONFIGURATION ---
+
+# Small local cross-encoder that scores (question, chunk) pairs jointly
+RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+# Pairs scored per forward pass
+RERANK_BATCH_SIZE = 32
+# Longest (question + chunk) input the cross-encoder sees, in model tokens
+RERANK_MAX_LENGTH = 512
+
+# Vector hits fetched for reranking, before the best -n are kept
+DEFAULT_RERANK_CANDIDATES = 40
+# ---
+
+
+def select_within_budget(scores, documents, max_chunks, token_budget):
+    """
+    Positions of the best-scoring documents, at most max_chunks of them and
+    together no longer than token_budget. A chunk that doesn't fit is skipped
+    so a shorter, lower-ranked one still can; the top chunk is always kept.
+    """
+    selected = []
+    used = 0
+    tokens_per_document = count_tokens(documents)
+    for i in sorted(range(len(documents)), key=lambda i: scores[i], reverse=True):
+        if len(selected) == max_chunks:
+            break
+        tokens = tokens_per_document[i]
+        if selected and used + tokens > token_budget:
+            continue
+        selected.append(i)
+        used += tokens
+    return selected
+
+
+class CrossEncoderReranker:
+    """
+    Scores candidate chunks against the question with a cross-encoder, which
+    reads both together and ranks far more precisely than cosine distance.
+    Pairs are scored in batches; the model is loaded once and shared.
+    """
+
+    def __init__(self, model_name=RERANK_MODEL, batch_size=RERANK_BATCH_SIZE):
+        from sentence_transformers import CrossEncoder
+
+        self.model = CrossEncoder(model_name, max_length=RERANK_MAX_LENGTH)
+        self.batch_size = batch_size
+        # Server and batch threads share the model; one forward pass at a time
+        self.lock = threading.Lock()
+
+    def score(self, pairs):
+        """Relevance scores for a list of (question, document) pairs."""
+        if not pairs:
+            return []
+        with self.lock:
+            scores = self.model.predict(
+                pairs, batch_size=self.batch_size, show_progress_bar=False
+            )
+        return [float(score) for score in scores]
+
+    def rerank(self, query_text, ids, documents, metadatas, max_chunks, token_budget):
+        """
+        The best max_chunks of the candidates within token_budget, as
+        (ids, documents, metadatas) in reranked order.
+        """
+        scores = self.score([(query_text, doc) for doc in documents])
+        keep = select_within_budget(scores, documents, max_chunks, token_budget)
+        return (
+            [ids[i] for i in keep],
+            [documents[i] for i in keep],
+            [metadatas[i] for i in keep],
+        )
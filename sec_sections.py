@@ -0,0 +1,127 @@
+import re
+from bisect import bisect_left, bisect_right
+
+# --- CONFIGURATION ---
+
+# An Item heading followed by another within this many characters is treated as
+# a table-of-contents entry rather than the start of a section
+MIN_SECTION_CHARS = 400
+
+# Label for the cover page and table of contents before the first Item
+FRONT_MATTER = "Front Matter"
+# ---
+
+# "Item 1A. Risk Factors", "ITEM 7 — MANAGEMENT'S ...", "Item 2.02 Results of ..."
+# Cross-references such as "Item 1A, “Risk Factors”" or "Item 7 of this report"
+# don't match because the number must be followed by a heading-like title.
+ITEM_HEADING_RE = re.compile(
+    r"\b(?:ITEM|Item)\s+(\d{1,2}\.\d{2}|\d{1,2}[A-Ca-c]?)\b\s*[.:\-–—]?\s*"
+    r"(?=[A-Z\"“])"
+)
+PART_RE = re.compile(r"\bPART\s+(IV|III|II|I)\b")
+ROMAN = {"I": 1, "II": 2, "III": 3, "IV": 4}
+
+# What users may pass as a section: '1a', 'Item 7', 'Part II, Item 1A', '2.02'
+SECTION_ARG_RE = re.compile(
+    r"^\s*(?:part\s+(iv|iii|ii|i)\s*,?\s*)?(?:item\s+)?"
+    r"(\d{1,2}\.\d{2}|\d{1,2}[a-c]?)\s*$",
+    re.IGNORECASE,
+)
+
+
+def normalize_item(item):
+    """'1a' -> '1A', '2.02' -> '2.02'."""
+    return item.upper()
+
+
+def item_order(item):
+    """Sort key within a filing: 1 < 1A < 1B < 2 < ... and 1.01 < 2.02 for 8-Ks."""
+    if "." in item:
+        major, minor = item.split(".")
+        return int(major) * 100 + int(minor)
+    letter = item[-1] if item[-1].isalpha() else ""
+    number = int(item[: len(item) - len(letter)])
+    return number * 10 + (ord(letter) - ord("A") + 1 if letter else 0)
+
+
+def section_label(item, part=None):
+    """'Item 1A', or 'Part II Item 1A' when item numbers restart per part (10-Q)."""
+    label = f"Item {normalize_item(item)}"
+    return f"Part {part} {label}" if part else label
+
+
+def find_sections(text, form_type=None):
+    """
+    Locates Item headings in cleaned filing text.
+    Returns [(start_offset, label)] in document order, starting with FRONT_MATTER at 0.
+    Table-of-contents entries are skipped, and the headings kept are the longest run
+    that moves forward through the filing (per Part for 10-Qs, whose item numbers
+    restart in Part II), so a long last TOC entry can't hide the real headings.
+    """
+    per_part = form_type is not None and form_type.upper().startswith("10-Q")
+    parts = (
+        [(m.start(), m.group(1)) for m in PART_RE.finditer(text)] if per_part else []
+    )
+    part_starts = [start for start, _ in parts]
+
+    candidates = [(m.start(), m.group(1)) for m in ITEM_HEADING_RE.finditer(text)]
+    ends = [start for start, _ in candidates[1:]] + [len(text)]
+
+    headings = []
+    for (start, item), end in zip(candidates, ends):
+        if end - start < MIN_SECTION_CHARS:
+            continue
+        part = None
+        if per_part:
+            index = bisect_right(part_starts, start) - 1
+            part = parts[index][1] if index >= 0 else None
+        key = (ROMAN.get(part, 0), item_order(normalize_item(item)))
+        headings.append((key, start, section_label(item, part)))
+
+    sections = [(0, FRONT_MATTER)]
+    sections.extend((start, label) for _, start, label in increasing_run(headings))
+    return sections
+
+
+def increasing_run(headings):
+    """The longest subsequence of (key, ...) tuples whose keys strictly increase."""
+    tail_keys, tail_indexes = [], []
+    previous = [None] * len(headings)
+    for index, heading in enumerate(headings):
+        length = bisect_left(tail_keys, heading[0])
+        previous[index] = tail_indexes[length - 1] if length else None
+        if length == len(tail_keys):
+            tail_keys.append(heading[0])
+            tail_indexes.append(index)
+        else:
+            tail_keys[length] = heading[0]
+            tail_indexes[length] = index
+    run = []
+    index = tail_indexes[-1] if tail_indexes else None
+    while index is not None:
+        run.append(headings[index])
+        index = previous[index]
+    return run[::-1]
+
+
+def split_sections(text, form_type=None):
+    """Splits cleaned filing text into [(label, section_text)], skipping empty ones."""
+    sections = find_sections(text, form_type)
+    ends = [start for start, _ in sections[1:]] + [len(text)]
+    return [
+        (label, text[start:end].strip())
+        for (start, label), end in zip(sections, ends)
+        if text[start:end].strip()
+    ]
+
+
+def parse_section(text):
+    """
+    Turns user input such as '1a', 'Item 7' or 'Part II Item 1A' into the label
+    stored in chunk metadata. Raises ValueError if it isn't an Item reference.
+    """
+    match = SECTION_ARG_RE.match(text)
+    if not match:
+        raise ValueError(f"Not an SEC Item reference: {text!r}")
+    part, item = match.groups()
+    return section_label(item, part.upper() if part else None)
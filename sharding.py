@@ -0,0 +1,195 @@
+import os
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+# --- CONFIGURATION ---
+
+# 'ticker' gives every company its own shard; 'hash' spreads companies over a
+# fixed number of buckets. Either way one company's filings share a shard, so
+# ticker-filtered questions search a single small index.
+SHARD_MODES = ["ticker", "hash"]
+DEFAULT_NUM_SHARDS = 8
+
+# Written by bulk_embedder.py next to the shard directories
+SHARD_MAP_FILE = "shards.json"
+
+# Shards searched at the same time by one query
+MAX_PARALLEL_SHARDS = 16
+# ---
+
+
+def shard_name(ticker, shard_by, num_shards=DEFAULT_NUM_SHARDS):
+    """Shard holding a company's chunks: 'AAPL', or 'bucket_03' when hashing."""
+    if shard_by == "ticker":
+        return ticker
+    bucket = int(hashlib.sha1(ticker.encode("utf-8")).hexdigest(), 16) % num_shards
+    return f"bucket_{bucket:02d}"
+
+
+def db_path(db_dir, default_path):
+    """
+    `default_path` (a path under the default database directory, such as
+    'chroma_db/lexical_index') in another database directory, e.g. a shard's.
+    """
+    return os.path.join(db_dir, *default_path.split(os.sep)[1:])
+
+
+def chunk_ticker(chunk_id):
+    """Chunk IDs start with the source file name, 'TICKER_FORM_DATE_chunk_N'."""
+    return chunk_id.split("_", 1)[0]
+
+
+def read_shard_map(shards_dir):
+    """The shard layout written by bulk_embedder.py, or None if unsharded."""
+    path = os.path.join(shards_dir, SHARD_MAP_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_shard_map(shards_dir, shard_by, num_shards, shards):
+    os.makedirs(shards_dir, exist_ok=True)
+    path = os.path.join(shards_dir, SHARD_MAP_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(
+            {"shard_by": shard_by, "num_shards": num_shards, "shards": sorted(shards)},
+            f,
+            indent=1,
+        )
+    os.replace(path + ".tmp", path)
+
+
+def route(shards, tickers, shard_by, num_shards):
+    """Values of `shards` ({name: ...}) that can hold the tickers; all if None."""
+    if tickers is None:
+        return list(shards.values())
+    names = {shard_name(ticker, shard_by, num_shards) for ticker in tickers}
+    return [shards[name] for name in sorted(names & set(shards))]
+
+
+def filter_tickers(where):
+    """
+    Tickers a Chroma where filter restricts results to, or None if it allows
+    any ticker. Handles {'ticker': ...} with $eq/$in, inside $and and $or.
+    """
+    if not where:
+        return None
+    if "$and" in where:
+        for clause in where["$and"]:
+            tickers = filter_tickers(clause)
+            if tickers is not None:
+                return tickers
+        return None
+    if "$or" in where:
+        tickers = [filter_tickers(clause) for clause in where["$or"]]
+        if any(t is None for t in tickers):
+            return None
+        return sorted({ticker for t in tickers for ticker in t})
+    value = where.get("ticker")
+    if isinstance(value, dict):
+        if "$eq" in value:
+            return [value["$eq"]]
+        return list(value["$in"]) if "$in" in value else None
+    return None if value is None else [value]
+
+
+class ShardedCollection:
+    """
+    Presents per-shard collections as one, for qa_agent and qa_batch.
+    Queries go only to the shards a ticker filter points at (all of them
+    otherwise), in parallel, and the per-shard top-k lists are merged by
+    distance. Lookups by chunk ID go straight to the ID's shard.
+    """
+
+    def __init__(self, collections, shard_by, num_shards):
+        self.collections = collections
+        self.shard_by = shard_by
+        self.num_shards = num_shards
+
+    def _shards_for(self, where):
+        return route(
+            self.collections, filter_tickers(where), self.shard_by, self.num_shards
+        )
+
+    def _fan_out(self, collections, call):
+        if len(collections) <= 1:
+            return [call(collection) for collection in collections]
+        with ThreadPoolExecutor(
+            max_workers=min(len(collections), MAX_PARALLEL_SHARDS)
+        ) as executor:
+            return list(executor.map(call, collections))
+
+    def count(self):
+        return sum(collection.count() for collection in self.collections.values())
+
+    def query(self, query_embeddings, n_results=10, where=None):
+        per_shard = self._fan_out(
+            self._shards_for(where),
+            lambda collection: collection.query(
+                query_embeddings=query_embeddings, n_results=n_results, where=where
+            ),
+        )
+        fields = ["distances", "ids", "documents", "metadatas"]
+        merged = {field: [] for field in fields}
+        for row in range(len(query_embeddings)):
+            hits = []
+            for results in per_shard:
+                hits += zip(*(results[field][row] for field in fields))
+            hits = sorted(hits, key=lambda hit: hit[0])[:n_results]
+            for position, field in enumerate(fields):
+                merged[field].append([hit[position] for hit in hits])
+        return merged
+
+    def get(self, ids=None, where=None, include=None, limit=None, offset=None):
+        include = include or ["metadatas", "documents"]
+        if ids is not None:
+            by_shard = {}
+            for chunk_id in ids:
+                name = shard_name(
+                    chunk_ticker(chunk_id), self.shard_by, self.num_shards
+                )
+                if name in self.collections:
+                    by_shard.setdefault(name, []).append(chunk_id)
+            calls = [
+                (self.collections[name], shard_ids)
+                for name, shard_ids in sorted(by_shard.items())
+            ]
+        else:
+            calls = [(collection, None) for collection in self._shards_for(where)]
+
+        per_shard = self._fan_out(
+            calls,
+            lambda call: call[0].get(ids=call[1], where=where, include=include),
+        )
+        merged = {"ids": []}
+        for field in include:
+            merged[field] = []
+        for results in per_shard:
+            merged["ids"] += results["ids"]
+            for field in include:
+                merged[field] += list(results[field])
+        start = offset or 0
+        end = None if limit is None else start + limit
+        return {field: values[start:end] for field, values in merged.items()}
+
+
+class ShardedLexicalIndex:
+    """
+    BM25 search over per-shard lexical indexes, merged by score. Each shard
+    scores with its own document statistics, so merged scores are approximate;
+    hybrid retrieval only uses the resulting ranks.
+    """
+
+    def __init__(self, indexes, shard_by, num_shards):
+        self.indexes = indexes
+        self.shard_by = shard_by
+        self.num_shards = num_shards
+
+    def search(self, query_text, k=10, where=None):
+        indexes = route(
+            self.indexes, filter_tickers(where), self.shard_by, self.num_shards
+        )
+        hits = [hit for index in indexes for hit in index.search(query_text, k, where)]
+        return sorted(hits, key=lambda hit: hit[1], reverse=True)[:k]
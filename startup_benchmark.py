@@ -0,0 +1,173 @@
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+from instrumentation import new_run_id
+
+# --- CONFIGURATION ---
+RESULTS_DIR = "benchmark_results"
+
+# Command timed by default: it only parses arguments, so it should load nothing heavy
+DEFAULT_COMMAND = ["qa_agent.py", "--help"]
+
+# Timed runs, after one untimed run that writes the bytecode caches
+RUNS = 5
+
+# Median cold-start wall time allowed before the check fails
+TARGET_MS = 500
+
+# Packages that must not be imported until a question actually needs them
+HEAVY_MODULES = [
+    "chromadb",
+    "google.generativeai",
+    "numpy",
+    "torch",
+    "sentence_transformers",
+    "tokenizers",
+    "onnxruntime",
+]
+
+# Slowest imports (by cumulative time) listed in the report
+TOP_IMPORTS = 15
+# ---
+
+
+def run_command(command, importtime=False):
+    """Runs `python [-X importtime] command` and returns (seconds, stderr)."""
+    flags = ["-X", "importtime"] if importtime else []
+    start = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, *flags, *command],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    seconds = time.perf_counter() - start
+    if completed.returncode != 0:
+        raise RuntimeError(
+            f"{' '.join(command)} exited with {completed.returncode}:\n"
+            + completed.stderr[-2000:]
+        )
+    return seconds, completed.stderr
+
+
+def parse_importtime(stderr):
+    """
+    Parses `-X importtime` output into [(module, self_us, cumulative_us, depth)],
+    where depth 0 marks imports made directly by the program.
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|", 2)
+        module = name.strip()
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append((module, int(self_us), int(cumulative_us), depth))
+    return imports
+
+
+def heavy_imports(modules):
+    """The HEAVY_MODULES (or their submodules) among the imported modules."""
+    return sorted(
+        heavy
+        for heavy in HEAVY_MODULES
+        if any(module == heavy or module.startswith(heavy + ".") for module in modules)
+    )
+
+
+def measure_startup(command, runs=RUNS):
+    """Times `runs` fresh interpreters running command and breaks down one's imports."""
+    run_command(command)
+    wall_ms = [run_command(command)[0] * 1000 for _ in range(runs)]
+    imports = parse_importtime(run_command(command, importtime=True)[1])
+    slowest = sorted(imports, key=lambda item: -item[2])[:TOP_IMPORTS]
+    return {
+        "command": command,
+        "python": sys.version.split()[0],
+        "runs": runs,
+        "median_ms": round(statistics.median(wall_ms), 1),
+        "min_ms": round(min(wall_ms), 1),
+        "max_ms": round(max(wall_ms), 1),
+        "import_ms": round(
+            sum(cumulative for _, _, cumulative, depth in imports if depth == 0) / 1000,
+            1,
+        ),
+        "modules_imported": len(imports),
+        "heavy_modules": heavy_imports(module for module, _, _, _ in imports),
+        "slowest_imports": [
+            {"module": module, "cumulative_ms": round(cumulative / 1000, 1)}
+            for module, _, cumulative, _ in slowest
+        ],
+    }
+
+
+def print_report(results, target_ms):
+    print(f"\n--- Startup of `python {' '.join(results['command'])}` ---")
+    print(
+        f"  wall time: median {results['median_ms']} ms "
+        f"(min {results['min_ms']}, max {results['max_ms']}; target {target_ms} ms)"
+    )
+    print(
+        f"  imports: {results['import_ms']} ms across "
+        f"{results['modules_imported']} modules"
+    )
+    if results["heavy_modules"]:
+        print(f"  heavy modules imported: {', '.join(results['heavy_modules'])}")
+    print("  slowest imports (cumulative):")
+    for item in results["slowest_imports"]:
+        print(f"    {item['cumulative_ms']:>8.1f} ms  {item['module']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check qa_agent.py's cold-start time against a target, with a "
+        "-X importtime breakdown of where it goes."
+    )
+    parser.add_argument(
+        "command",
+        nargs=argparse.REMAINDER,
+        help=f"Script and arguments to time (default: {' '.join(DEFAULT_COMMAND)}).",
+    )
+    parser.add_argument("--runs", type=int, default=RUNS)
+    parser.add_argument(
+        "--target_ms",
+        type=float,
+        default=TARGET_MS,
+        help="Fail if the median wall time is above this.",
+    )
+    parser.add_argument(
+        "--allow_heavy",
+        action="store_true",
+        help="Don't fail when heavy packages (chromadb, numpy, ...) are imported.",
+    )
+    parser.add_argument(
+        "--output",
+        help="Results JSON path (default: a timestamped file in benchmark_results/).",
+    )
+
+    args = parser.parse_args()
+    results = measure_startup(args.command or DEFAULT_COMMAND, args.runs)
+    results["target_ms"] = args.target_ms
+    print_report(results, args.target_ms)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"startup_{new_run_id()}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\n--- Results written to {output} ---")
+
+    failures = []
+    if results["median_ms"] > args.target_ms:
+        failures.append(f"median {results['median_ms']} ms > target {args.target_ms} ms")
+    if results["heavy_modules"] and not args.allow_heavy:
+        failures.append(f"imported {', '.join(results['heavy_modules'])}")
+    if failures:
+        print(f"FAIL: {'; '.join(failures)}")
+        sys.exit(1)
+    print("PASS")
@@ -0,0 +1,109 @@
+import os
+import io
+import gzip
+import tempfile
+import contextlib
+import zstandard
+
+# --- CONFIGURATION ---
+
+# How pipeline files may be stored on disk. The compression of an existing file
+# is always read from its extension, so every stage can read every mode.
+COMPRESSIONS = ["none", "gzip", "zstd"]
+COMPRESSION_EXTENSIONS = {"gzip": ".gz", "zstd": ".zst"}
+DEFAULT_COMPRESSION = "none"
+
+GZIP_LEVEL = 6
+# iXBRL markup is highly repetitive; level 10 gets most of zstd's ratio at speed
+ZSTD_LEVEL = 10
+# ---
+
+
+def _umask():
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+# mkstemp creates files readable only by their owner; atomically written files
+# get the mode a plain open() would have given them. Read once, since changing
+# the umask to read it isn't thread-safe.
+FILE_MODE = 0o666 & ~_umask()
+
+
+def split_compression(path):
+    """Splits 'name.txt.zst' into ('name.txt', '.zst'); uncompressed paths get ''."""
+    for extension in COMPRESSION_EXTENSIONS.values():
+        if path.endswith(extension):
+            return path[: -len(extension)], extension
+    return path, ""
+
+
+def with_compression(path, compression):
+    """Returns the on-disk path of a logical file stored with the given compression."""
+    return path + COMPRESSION_EXTENSIONS.get(compression, "")
+
+
+def find_existing(path):
+    """Returns the on-disk path of a logical file in any compression, or None."""
+    for extension in [""] + list(COMPRESSION_EXTENSIONS.values()):
+        if os.path.exists(path + extension):
+            return path + extension
+    return None
+
+
+def open_text(path, newline=None):
+    """
+    Opens a possibly-compressed UTF-8 file for streaming reads. Pass
+    newline="" to read line endings untranslated, exactly as stored.
+    """
+    _, extension = split_compression(path)
+    if extension == ".gz":
+        return gzip.open(path, "rt", encoding="utf-8", newline=newline)
+    if extension == ".zst":
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"))
+        return io.TextIOWrapper(reader, encoding="utf-8", newline=newline)
+    return open(path, "r", encoding="utf-8", newline=newline)
+
+
+def read_text(path, newline=None):
+    """Reads a whole possibly-compressed UTF-8 file."""
+    with open_text(path, newline) as f:
+        return f.read()
+
+
+@contextlib.contextmanager
+def atomic_write_text(path):
+    """
+    Yields a text stream that writes to a temporary file next to `path`,
+    compressed according to its extension. The file is renamed into place only
+    if the block succeeds, so a crash never leaves a half-written file behind.
+    """
+    target_dir = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=target_dir, suffix=".tmp")
+    raw = os.fdopen(fd, "wb")
+    try:
+        _, extension = split_compression(path)
+        if extension == ".gz":
+            stream = gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=GZIP_LEVEL)
+        elif extension == ".zst":
+            stream = zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(raw)
+        else:
+            stream = raw
+
+        with io.TextIOWrapper(stream, encoding="utf-8") as f:
+            yield f
+        raw.close()
+        os.chmod(tmp_path, FILE_MODE)
+        os.replace(tmp_path, path)
+    except BaseException:
+        raw.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_text_atomic(path, text):
+    """Writes text atomically, compressed according to the path's extension."""
+    with atomic_write_text(path) as f:
+        f.write(text)
@@ -0,0 +1,121 @@
+import os
+import re
+import json
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+import storage
+
+# --- CONFIGURATION ---
+
+# A local stand-in for the sec-api.io query API and sec.gov, for trying
+# `--sync` runs offline. Filings are served from a directory laid out like
+# data/ (<dir>/<TICKER>/<TICKER>_<FORM>_<DATE>.html); dropping a new file in
+# makes it show up as a new filing.
+STUB_HOST = "127.0.0.1"
+STUB_PORT = 8766
+
+# Time of day given to every filing's filedAt
+FILED_AT_TIME = "T16:05:00-04:00"
+# ---
+
+TICKER_RE = re.compile(r"ticker:(\S+)")
+FORM_TYPES_RE = re.compile(r"formType:\(([^)]*)\)")
+FILED_AT_RE = re.compile(r"filedAt:\[(\S+) TO \*\]")
+
+
+def list_filings(data_dir, base_url):
+    """Every filing under data_dir, in the shape the query API returns them."""
+    filings = []
+    for root, _, files in os.walk(data_dir):
+        for file in files:
+            name = storage.split_compression(file)[0]
+            if not name.endswith(".html"):
+                continue
+            ticker_form, date = os.path.splitext(name)[0].rsplit("_", 1)
+            ticker, form_type = ticker_form.split("_", 1)
+            relative_path = os.path.relpath(os.path.join(root, file), data_dir)
+            filings.append(
+                {
+                    "ticker": ticker,
+                    "formType": form_type.replace("_", "/"),
+                    "filedAt": date + FILED_AT_TIME,
+                    "linkToFilingDetails": f"{base_url}/filings/{relative_path}",
+                }
+            )
+    return filings
+
+
+def run_query(filings, query):
+    """Applies the ticker, formType and filedAt terms and the paging of a query."""
+    query_string = query["query"]["query_string"]["query"]
+    ticker = TICKER_RE.search(query_string)
+    form_types = FORM_TYPES_RE.search(query_string)
+    filed_at = FILED_AT_RE.search(query_string)
+
+    matches = [
+        filing
+        for filing in filings
+        if (ticker is None or filing["ticker"] == ticker.group(1))
+        and (
+            form_types is None
+            or filing["formType"] in form_types.group(1).split(" OR ")
+        )
+        and (filed_at is None or filing["filedAt"][:10] >= filed_at.group(1))
+    ]
+    matches.sort(key=lambda filing: filing["filedAt"], reverse=True)
+    offset = int(query.get("from", 0))
+    return matches[offset : offset + int(query.get("size", 50))]
+
+
+def make_handler(data_dir, base_url):
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            page = run_query(list_filings(data_dir, base_url), json.loads(body))
+            self.send(200, "application/json", json.dumps({"filings": page}))
+
+        def do_GET(self):
+            if not self.path.startswith("/filings/"):
+                self.send(404, "text/plain", "not found")
+                return
+            relative_path = unquote(self.path[len("/filings/") :])
+            path = os.path.realpath(os.path.join(data_dir, relative_path))
+            if not path.startswith(os.path.realpath(data_dir)) or not os.path.isfile(path):
+                self.send(404, "text/plain", "not found")
+                return
+            self.send(200, "text/html; charset=utf-8", storage.read_text(path))
+
+        def send(self, status, content_type, text):
+            payload = text.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    return StubHandler
+
+
+def serve(data_dir, host=STUB_HOST, port=STUB_PORT):
+    base_url = f"http://{host}:{port}"
+    server = ThreadingHTTPServer((host, port), make_handler(data_dir, base_url))
+    print(f"--- Serving filings from {data_dir} at {base_url} ---")
+    print(f"--- Use --api_url {base_url} (any SEC_API_KEY works) ---")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve filings from a local directory as a stub SEC query API."
+    )
+    parser.add_argument("data_dir", help="Directory laid out like data/.")
+    parser.add_argument("--host", default=STUB_HOST)
+    parser.add_argument("--port", type=int, default=STUB_PORT)
+    args = parser.parse_args()
+    serve(args.data_dir, args.host, args.port)
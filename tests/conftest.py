@@ -0,0 +1,44 @@
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+# The modules live at the repository root rather than in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import download_filings  # noqa: E402
+import stub_sec_api  # noqa: E402
+
+
+def write_fixture(fixtures, name, text=None):
+    ticker = name.split("_", 1)[0]
+    os.makedirs(fixtures / ticker, exist_ok=True)
+    (fixtures / ticker / name).write_text(
+        text or f"<html><body><p>{name}</p></body></html>", encoding="utf-8"
+    )
+
+
+def serve_in_thread(make_handler):
+    """Starts an HTTP server on a free port; returns (server, base URL)."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), BaseHTTPRequestHandler)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    server.RequestHandlerClass = make_handler(base_url)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, base_url
+
+
+@pytest.fixture
+def stub_api(tmp_path, monkeypatch):
+    """A stub_sec_api.py server over tmp_path/fixtures, run from tmp_path."""
+    fixtures = tmp_path / "fixtures"
+    fixtures.mkdir()
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(download_filings, "API_KEY", "test-key")
+    server, base_url = serve_in_thread(
+        lambda url: stub_sec_api.make_handler(str(fixtures), url)
+    )
+    yield fixtures, base_url
+    server.shutdown()
+    server.server_close()
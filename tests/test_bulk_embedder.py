@@ -0,0 +1,191 @@
+import os
+
+import pytest
+
+# bulk_embedder imports the embedding and vector store packages at load time
+for module in ("chromadb", "langchain.text_splitter", "sentence_transformers"):
+    pytest.importorskip(module)
+
+import bulk_embedder  # noqa: E402
+from bulk_embedder import chunk_text, make_text_splitter, parse_filename  # noqa: E402
+from chunk_store import END_FIELD, START_FIELD  # noqa: E402
+
+
+def test_parse_filename():
+    assert parse_filename("AAPL_10-K_2023-11-03.txt") == ("AAPL", "10-K", "2023-11-03")
+    assert parse_filename("notes.txt") is None
+
+
+def test_parse_amended_filename():
+    assert parse_filename("AAPL_10-K_A_2023-11-03.txt") == (
+        "AAPL",
+        "10-K/A",
+        "2023-11-03",
+    )
+
+
+def test_chunk_amended_filing():
+    text = "Item 1A. Risk Factors\nDemand may fall."
+
+    _, metadatas, ids = chunk_text(
+        "AAPL_10-K_A_2023-11-03.txt",
+        text,
+        "hash",
+        make_text_splitter("recursive"),
+    )
+
+    assert ids == ["AAPL_10-K_A_2023-11-03_chunk_0"]
+    assert metadatas[0]["form_type"] == "10-K/A"
+    assert metadatas[0]["date"] == 20231103
+    assert metadatas[0]["file_hash"] == "hash"
+    assert metadatas[0]["chunk_hash"] == bulk_embedder.hash_text(text)
+
+
+def stored(chunks):
+    """Collection.get() output for {chunk_id: (text, embedding)}."""
+    return {
+        "ids": list(chunks),
+        "documents": [text for text, _ in chunks.values()],
+        "metadatas": [
+            {"chunk_hash": bulk_embedder.hash_text(text)} for text, _ in chunks.values()
+        ],
+        "embeddings": [embedding for _, embedding in chunks.values()],
+    }
+
+
+def new_chunks(texts):
+    ids = [f"AAPL_10-K_2023-11-03_chunk_{i}" for i in range(len(texts))]
+    metadatas = [{"chunk_hash": bulk_embedder.hash_text(text)} for text in texts]
+    return metadatas, ids
+
+
+def test_diff_chunks_unchanged_edited_and_removed():
+    existing = stored(
+        {
+            "AAPL_10-K_2023-11-03_chunk_0": ("Risk factors.", [0.1]),
+            "AAPL_10-K_2023-11-03_chunk_1": ("Old outlook.", [0.2]),
+            "AAPL_10-K_2023-11-03_chunk_2": ("Legal proceedings.", [0.3]),
+        }
+    )
+    metadatas, ids = new_chunks(["Risk factors.", "New outlook."])
+
+    unchanged, reusable, to_embed, orphan_ids = bulk_embedder.diff_chunks(
+        existing, metadatas, ids
+    )
+
+    assert unchanged == [0]
+    assert reusable == {}
+    assert to_embed == [1]
+    assert orphan_ids == ["AAPL_10-K_2023-11-03_chunk_2"]
+
+
+def test_diff_chunks_reuses_embeddings_of_moved_text():
+    existing = stored(
+        {
+            "AAPL_10-K_2023-11-03_chunk_0": ("Risk factors.", [0.1]),
+            "AAPL_10-K_2023-11-03_chunk_1": ("Outlook.", [0.2]),
+        }
+    )
+    # A chunk inserted at the start shifts the others to new IDs
+    metadatas, ids = new_chunks(["Overview.", "Risk factors.", "Outlook."])
+
+    unchanged, reusable, to_embed, orphan_ids = bulk_embedder.diff_chunks(
+        existing, metadatas, ids
+    )
+
+    assert unchanged == []
+    assert reusable == {1: [0.1], 2: [0.2]}
+    assert to_embed == [0]
+    assert orphan_ids == []
+
+
+def test_diff_chunks_hashes_chunks_stored_without_a_hash():
+    existing = stored({"AAPL_10-K_2023-11-03_chunk_0": ("Risk factors.", [0.1])})
+    del existing["metadatas"][0]["chunk_hash"]
+    metadatas, ids = new_chunks(["Risk factors."])
+
+    assert bulk_embedder.diff_chunks(existing, metadatas, ids) == ([0], {}, [], [])
+
+
+def test_diff_chunks_rewrites_chunks_switching_to_offsets():
+    existing = stored({"AAPL_10-K_2023-11-03_chunk_0": ("Risk factors.", [0.1])})
+    metadatas, ids = new_chunks(["Risk factors."])
+    metadatas[0].update({START_FIELD: 0, END_FIELD: 13})
+
+    # Same text, but the stored document must be dropped: reuse the vector
+    assert bulk_embedder.diff_chunks(existing, metadatas, ids) == (
+        [],
+        {0: [0.1]},
+        [],
+        [],
+    )
+
+
+class CountedCollection:
+    """Just enough of a collection for the manifest: count() and metadata."""
+
+    def __init__(self, metadatas):
+        self.metadatas = metadatas
+
+    def count(self):
+        return len(self.metadatas)
+
+    def get(self, include):
+        return {"metadatas": self.metadatas}
+
+
+ENTRY = {"file_hash": "h1", "chunker": "section:1000:0:m2", "chunks": 1}
+
+
+def test_manifest_round_trip(tmp_path):
+    manifest_path = str(tmp_path / "db" / "indexed_files.json")
+    collection = CountedCollection([{"source_file": "AAPL_10-K_2023-11-03.txt"}])
+    files = {"AAPL_10-K_2023-11-03.txt": dict(ENTRY, size=10, mtime=1.5)}
+
+    bulk_embedder.save_manifest(collection, files, "int8", manifest_path)
+
+    assert bulk_embedder.load_manifest(collection, "int8", manifest_path) == files
+
+
+def test_manifest_journal_is_replayed_and_folded_in(tmp_path):
+    manifest_path = str(tmp_path / "indexed_files.json")
+    journal_path = manifest_path + bulk_embedder.MANIFEST_JOURNAL_SUFFIX
+    collection = CountedCollection([{"source_file": "AAPL_10-K_2023-11-03.txt"}])
+    files = {"AAPL_10-K_2023-11-03.txt": ENTRY}
+    bulk_embedder.save_manifest(collection, files, "chroma", manifest_path)
+
+    collection.metadatas.append({"source_file": "MSFT_10-K_2023-07-27.txt"})
+    bulk_embedder.append_manifest(
+        collection, {"MSFT_10-K_2023-07-27.txt": ENTRY}, "chroma", manifest_path
+    )
+    # A checkpoint cut short by a crash is ignored
+    with open(journal_path, "a", encoding="utf-8") as f:
+        f.write('{"collection_count": 3, "fil')
+
+    loaded = bulk_embedder.load_manifest(collection, "chroma", manifest_path)
+    assert sorted(loaded) == ["AAPL_10-K_2023-11-03.txt", "MSFT_10-K_2023-07-27.txt"]
+
+    bulk_embedder.save_manifest(collection, loaded, "chroma", manifest_path)
+    assert not os.path.exists(journal_path)
+    assert bulk_embedder.load_manifest(collection, "chroma", manifest_path) == loaded
+
+
+def test_manifest_is_rebuilt_when_out_of_date(tmp_path, capsys):
+    manifest_path = str(tmp_path / "indexed_files.json")
+    collection = CountedCollection([])
+    bulk_embedder.save_manifest(collection, {}, "chroma", manifest_path)
+    collection.metadatas += [
+        {"source_file": "AAPL_10-K_2023-11-03.txt", "file_hash": "h1"},
+        {"source_file": "AAPL_10-K_2023-11-03.txt", "file_hash": "h1", "streamed": 1},
+    ]
+
+    loaded = bulk_embedder.load_manifest(collection, "chroma", manifest_path)
+
+    assert "Manifest is out of date" in capsys.readouterr().out
+    assert loaded == {
+        "AAPL_10-K_2023-11-03.txt": {"file_hash": "h1", "chunks": 2, "streamed": 1}
+    }
+    # A different vector store also means the manifest describes another index
+    bulk_embedder.save_manifest(collection, loaded, "chroma", manifest_path)
+    assert bulk_embedder.load_manifest(collection, "int8", manifest_path) == loaded
+    assert "Manifest is out of date" in capsys.readouterr().out
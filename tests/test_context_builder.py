@@ -0,0 +1,167 @@
+import pytest
+
+import chunk_store
+import context_builder
+from chunk_store import ChunkTextReader, locate_chunks
+from context_builder import assemble_context, drop_near_duplicates, merge_adjacent
+
+TEXT = (
+    "Item 1A. Risk Factors\n"
+    "Our business depends on the continued demand for premium smartphones. "
+    "Supply of components, including semiconductors, may be constrained. "
+    "Changes in foreign exchange rates could reduce our reported revenue. "
+    "We face intense competition in every market where we operate today."
+)
+FILE = "AAPL_10-K_2023-11-03.txt"
+
+
+@pytest.fixture
+def chunks(tmp_path, monkeypatch):
+    """Three overlapping chunks of TEXT, with the byte offsets of each."""
+    (tmp_path / "AAPL").mkdir()
+    (tmp_path / "AAPL" / FILE).write_text(TEXT, encoding="utf-8")
+    monkeypatch.setattr(chunk_store, "_reader", ChunkTextReader(str(tmp_path)))
+
+    bounds = [(0, 110), (80, 200), (170, len(TEXT))]
+    documents = [TEXT[start:end] for start, end in bounds]
+    ids = [f"AAPL_10-K_2023-11-03_chunk_{i}" for i in range(len(documents))]
+    metadatas = []
+    for start, end in locate_chunks(TEXT, documents):
+        metadatas.append(
+            {
+                "ticker": "AAPL",
+                "source_file": FILE,
+                "section": "Item 1A",
+                chunk_store.START_FIELD: start,
+                chunk_store.END_FIELD: end,
+            }
+        )
+    return ids, documents, metadatas
+
+
+def stored_text(metadata):
+    """The same chunk metadata, as if its text had been stored instead."""
+    return {
+        key: value
+        for key, value in metadata.items()
+        if key not in (chunk_store.START_FIELD, chunk_store.END_FIELD)
+    }
+
+
+def test_offset_neighbours_are_read_as_one_span(chunks):
+    ids, documents, metadatas = chunks
+
+    [(rank, _, text)] = merge_adjacent(ids, documents, metadatas)
+
+    assert rank == 0
+    assert text == TEXT
+
+
+def test_neighbour_without_offsets_is_joined(chunks):
+    ids, documents, metadatas = chunks
+    metadatas[2] = stored_text(metadatas[2])
+
+    [(_, _, text)] = merge_adjacent(ids, documents, metadatas)
+
+    assert text == TEXT
+
+
+def test_offsets_after_a_stored_neighbour_are_joined(chunks):
+    ids, documents, metadatas = chunks
+    metadatas[0] = stored_text(metadatas[0])
+
+    [(_, _, text)] = merge_adjacent(ids, documents, metadatas)
+
+    assert text == TEXT
+
+
+def test_gaps_split_spans(chunks):
+    ids, documents, metadatas = chunks
+
+    spans = merge_adjacent(
+        [ids[2], ids[0]], [documents[2], documents[0]], [metadatas[2], metadatas[0]]
+    )
+
+    assert [(rank, text) for rank, _, text in spans] == [
+        (0, documents[2]),
+        (1, documents[0]),
+    ]
+
+
+WORDS = (
+    "net sales increased due to higher iphone and services revenue partially "
+    "offset by lower mac sales in greater china during the fiscal year"
+).split()
+
+
+def span(rank, words):
+    return (rank, {"source_file": FILE}, " ".join(words))
+
+
+def test_near_duplicates_over_the_threshold_are_dropped():
+    # One changed word at the end leaves 18 of 19 shingles shared (0.95)
+    repeated = WORDS[:-1] + ["quarter"]
+    # One changed word in the middle leaves 14 of 19 shingles shared (0.74)
+    edited = WORDS[:10] + ["lower"] + WORDS[11:]
+
+    kept = drop_near_duplicates(
+        [span(0, WORDS), span(1, repeated), span(2, edited)]
+    )
+
+    assert [rank for rank, _, _ in kept] == [0, 2]
+
+
+def test_short_exact_duplicates_are_dropped():
+    kept = drop_near_duplicates(
+        [span(0, ["risk", "factors"]), span(1, ["Risk", "Factors"])]
+    )
+
+    assert [rank for rank, _, _ in kept] == [0]
+
+
+@pytest.fixture
+def estimated_tokens(monkeypatch):
+    # len(text) // 4 + 1 tokens, without loading a tokenizer
+    monkeypatch.setattr(context_builder, "get_tokenizer", lambda: None)
+
+
+def test_assemble_context_merges_adjacent_chunks(estimated_tokens):
+    left = TEXT[:110]
+    right = TEXT[80:200]
+
+    context, sources = assemble_context(
+        ["AAPL_10-K_2023-11-03_chunk_1", "AAPL_10-K_2023-11-03_chunk_0"],
+        [right, left],
+        [{"source_file": FILE}, {"source_file": FILE}],
+    )
+
+    assert context == context_builder.format_span({"source_file": FILE}, TEXT[:200])
+    assert sources == [FILE]
+
+
+def test_assemble_context_cuts_a_first_span_over_the_budget(estimated_tokens):
+    text = "word " * 800
+
+    context, sources = assemble_context(
+        ["AAPL_10-K_2023-11-03_chunk_0"], [text], [{"source_file": FILE}], 300
+    )
+
+    assert sources == [FILE]
+    assert context.startswith(f"Source File: {FILE}\nContent: word word")
+    # About 300 tokens of 4 characters, header included
+    assert 1100 < len(context) < 1300
+
+
+def test_assemble_context_skips_a_span_too_big_to_cut(estimated_tokens):
+    other = "MSFT_10-K_2023-07-27.txt"
+
+    context, sources = assemble_context(
+        ["AAPL_10-K_2023-11-03_chunk_0", "MSFT_10-K_2023-07-27_chunk_0"],
+        ["word " * 800, "Cloud revenue grew."],
+        [{"source_file": FILE}, {"source_file": other}],
+        token_budget=50,
+    )
+
+    # Fewer than MIN_PARTIAL_TOKENS would be left for the first span's text
+    assert sources == [other]
+    assert "Cloud revenue grew." in context
@@ -0,0 +1,217 @@
+import os
+import time
+from http.server import BaseHTTPRequestHandler
+
+import download_filings
+import storage
+import stub_sec_api
+from conftest import serve_in_thread, write_fixture
+
+
+def downloaded(tmp_path):
+    return sorted(
+        storage.split_compression(name)[0]
+        for _, _, files in os.walk(tmp_path / "data")
+        for name in files
+        if ".html" in name
+    )
+
+
+def test_token_bucket_limits_rate():
+    bucket = download_filings.TokenBucket(rate=50, capacity=1)
+    start = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+
+    # The first token is free; the other five each wait 1/50 s
+    assert time.monotonic() - start >= 0.09
+
+
+def test_request_with_retry_retries_server_errors(monkeypatch):
+    monkeypatch.setattr(download_filings, "BACKOFF_SECONDS", 0.01)
+    statuses = [503, 429, 200]
+
+    def make_handler(_):
+        class FlakyHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(statuses.pop(0))
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"ok")
+
+            def log_message(self, *args):
+                pass
+
+        return FlakyHandler
+
+    server, base_url = serve_in_thread(make_handler)
+    try:
+        response = download_filings.request_with_retry(
+            download_filings.create_session(2),
+            download_filings.TokenBucket(100),
+            "GET",
+            base_url,
+        )
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert response.status_code == 200
+    assert statuses == []
+
+
+def test_download_filings_from_stub_api(stub_api, tmp_path):
+    fixtures, base_url = stub_api
+    names = [
+        "AAPL_10-K_2023-11-03.html",
+        "AAPL_10-Q_2024-02-02.html",
+        "MSFT_8-K_2024-01-30.html",
+    ]
+    for name in names:
+        write_fixture(fixtures, name)
+
+    download_filings.download_filings(
+        ["AAPL", "MSFT"], base_url, max_workers=4, requests_per_second=100
+    )
+
+    assert downloaded(tmp_path) == sorted(names)
+    assert (tmp_path / "data" / "AAPL" / names[0]).read_text(
+        encoding="utf-8"
+    ) == (fixtures / "AAPL" / names[0]).read_text(encoding="utf-8")
+
+
+def test_download_filings_skips_existing_files(stub_api, tmp_path, capsys):
+    fixtures, base_url = stub_api
+    write_fixture(fixtures, "AAPL_10-K_2023-11-03.html")
+    download_filings.download_filings(["AAPL"], base_url, requests_per_second=100)
+    write_fixture(fixtures, "AAPL_10-Q_2024-02-02.html")
+
+    download_filings.download_filings(
+        ["AAPL"], base_url, requests_per_second=100, compression="gzip"
+    )
+
+    assert "Downloaded: 1, skipped (already exist): 1, failed: 0" in (
+        capsys.readouterr().out
+    )
+    assert os.path.exists(tmp_path / "data" / "AAPL" / "AAPL_10-Q_2024-02-02.html.gz")
+
+
+def sync(base_url, state_path):
+    download_filings.download_filings(
+        ["AAPL"],
+        base_url,
+        requests_per_second=100,
+        sync=True,
+        sync_state_path=state_path,
+    )
+
+
+def test_high_water_mark():
+    filings = [
+        {"filedAt": "2024-01-30T16:05:00-04:00"},
+        {"filedAt": "2023-11-03T16:05:00-04:00"},
+    ]
+
+    mark = download_filings.high_water_mark
+
+    assert mark(filings, lambda f: True) == "2024-01-30T16:05:00-04:00"
+    # Only the failed filing is listed again; newer finished ones are re-skipped
+    assert mark(filings, lambda f: f["filedAt"] > "2024") == "2023-11-03T16:05:00-04:00"
+    assert mark(filings, lambda f: f["filedAt"] < "2024") == "2024-01-30T16:05:00-04:00"
+    assert mark([], lambda f: True, "previous") == "previous"
+
+
+def test_sync_lists_only_filings_since_the_mark(stub_api, tmp_path):
+    fixtures, base_url = stub_api
+    state_path = str(tmp_path / "data" / "sync_state.json")
+    write_fixture(fixtures, "AAPL_10-K_2023-11-03.html")
+
+    sync(base_url, state_path)
+    assert download_filings.load_sync_state(state_path)["marks"] == {
+        "AAPL": "2023-11-03" + stub_sec_api.FILED_AT_TIME
+    }
+
+    # An older filing appearing now is before the mark, so it isn't listed
+    write_fixture(fixtures, "AAPL_10-Q_2023-08-04.html")
+    write_fixture(fixtures, "AAPL_8-K_2024-02-01.html")
+    sync(base_url, state_path)
+
+    assert downloaded(tmp_path) == [
+        "AAPL_10-K_2023-11-03.html",
+        "AAPL_8-K_2024-02-01.html",
+    ]
+    assert download_filings.load_sync_state(state_path)["marks"] == {
+        "AAPL": "2024-02-01" + stub_sec_api.FILED_AT_TIME
+    }
+
+
+def test_sync_mark_stays_before_a_failed_filing(stub_api, tmp_path, monkeypatch):
+    fixtures, base_url = stub_api
+    state_path = str(tmp_path / "data" / "sync_state.json")
+    for name in ("AAPL_10-K_2023-11-03.html", "AAPL_10-Q_2024-02-02.html"):
+        write_fixture(fixtures, name)
+    download_filing = download_filings.download_filing
+
+    def failing_download(session, limiter, file_url, filepath, timings=None):
+        if "2023-11-03" in file_url:
+            raise OSError("disk full")
+        return download_filing(session, limiter, file_url, filepath, timings)
+
+    monkeypatch.setattr(download_filings, "download_filing", failing_download)
+    sync(base_url, state_path)
+    assert download_filings.load_sync_state(state_path)["marks"] == {
+        "AAPL": "2023-11-03" + stub_sec_api.FILED_AT_TIME
+    }
+
+    monkeypatch.setattr(download_filings, "download_filing", download_filing)
+    sync(base_url, state_path)
+
+    assert downloaded(tmp_path) == [
+        "AAPL_10-K_2023-11-03.html",
+        "AAPL_10-Q_2024-02-02.html",
+    ]
+    assert download_filings.load_sync_state(state_path) == {
+        "marks": {"AAPL": "2024-02-02" + stub_sec_api.FILED_AT_TIME},
+        "failures": {},
+    }
+
+
+def test_sync_gives_up_on_a_filing_that_never_downloads(
+    stub_api, tmp_path, monkeypatch
+):
+    fixtures, base_url = stub_api
+    state_path = str(tmp_path / "data" / "sync_state.json")
+    for name in ("AAPL_10-K_2023-11-03.html", "AAPL_10-Q_2024-02-02.html"):
+        write_fixture(fixtures, name)
+    download_filing = download_filings.download_filing
+
+    def failing_download(session, limiter, file_url, filepath, timings=None):
+        if "2023-11-03" in file_url:
+            raise OSError("corrupt filing")
+        return download_filing(session, limiter, file_url, filepath, timings)
+
+    monkeypatch.setattr(download_filings, "download_filing", failing_download)
+    for attempt in range(1, download_filings.MAX_SYNC_ATTEMPTS):
+        sync(base_url, state_path)
+        state = download_filings.load_sync_state(state_path)
+        assert state["marks"] == {"AAPL": "2023-11-03" + stub_sec_api.FILED_AT_TIME}
+        assert state["failures"] == {"AAPL_10-K_2023-11-03.html": attempt}
+
+    sync(base_url, state_path)
+
+    state = download_filings.load_sync_state(state_path)
+    assert state["marks"] == {"AAPL": "2024-02-02" + stub_sec_api.FILED_AT_TIME}
+    assert state["failures"] == {
+        "AAPL_10-K_2023-11-03.html": download_filings.MAX_SYNC_ATTEMPTS
+    }
+    assert downloaded(tmp_path) == ["AAPL_10-Q_2024-02-02.html"]
+
+
+def test_load_sync_state_reads_marks_only_files(tmp_path):
+    state_path = tmp_path / "sync_state.json"
+    state_path.write_text('{"AAPL": "2023-11-03T16:05:00-04:00"}', encoding="utf-8")
+
+    assert download_filings.load_sync_state(str(state_path)) == {
+        "marks": {"AAPL": "2023-11-03T16:05:00-04:00"},
+        "failures": {},
+    }
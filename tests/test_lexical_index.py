@@ -0,0 +1,135 @@
+import numpy as np
+
+import lexical_index
+from lexical_index import LexicalIndex, Segment, date_to_int, write_segment
+
+IDS = ["AAPL_10-K_2023-11-03_chunk_0", "MSFT_10-Q_2024-01-30_chunk_0"]
+DOCUMENTS = [
+    "Apple iPhone revenue depends on premium smartphone demand.",
+    "Microsoft cloud revenue grew with Azure consumption.",
+]
+METADATAS = [
+    {"ticker": "AAPL", "form_type": "10-K", "section": "Item 7", "date": 20231103},
+    {"ticker": "MSFT", "form_type": "10-Q", "section": "Item 2", "date": 20240130},
+]
+
+
+def ids(results):
+    return [chunk_id for chunk_id, _ in results]
+
+
+def test_date_to_int():
+    assert date_to_int("2024-11-01") == 20241101
+    assert date_to_int(np.int32(20241101)) == 20241101
+    # Amended filings once stored the "A" of "10-K_A" as their date
+    assert date_to_int("A") == 0
+    assert date_to_int("") == 0
+
+
+def test_segment_round_trip(tmp_path):
+    directory = str(tmp_path / "seg")
+
+    write_segment(directory, IDS, DOCUMENTS, METADATAS)
+    segment = Segment(directory)
+
+    assert segment.num_docs == 2
+    assert segment.all_doc_ids() == IDS
+    assert list(segment.doc_dates) == [20231103, 20240130]
+    found = segment.postings(np.array([lexical_index.term_hash("azure")], np.uint64))
+    [(docs, tfs)] = found.values()
+    assert list(docs) == [1] and list(tfs) == [1]
+
+
+def test_segment_accepts_unparseable_dates(tmp_path):
+    directory = str(tmp_path / "seg")
+    metadatas = [dict(METADATAS[0], date="A"), METADATAS[1]]
+
+    write_segment(directory, IDS, DOCUMENTS, metadatas)
+
+    assert list(Segment(directory).doc_dates) == [0, 20240130]
+
+
+def test_filter_mask(tmp_path):
+    directory = str(tmp_path / "seg")
+    write_segment(directory, IDS, DOCUMENTS, METADATAS)
+    segment = Segment(directory)
+    docs = np.arange(2)
+
+    def mask(where):
+        return list(segment.filter_mask(where, docs))
+
+    assert mask(None) == [True, True]
+    assert mask({"ticker": "MSFT"}) == [False, True]
+    assert mask({"ticker": {"$in": ["AAPL", "JPM"]}}) == [True, False]
+    assert mask({"ticker": "JPM"}) == [False, False]
+    assert mask({"date": {"$gte": 20240101}}) == [False, True]
+    assert mask({"$and": [{"form_type": "10-K"}, {"date": {"$lt": 20240101}}]}) == [
+        True,
+        False,
+    ]
+    assert mask({"$or": [{"ticker": "AAPL"}, {"section": "Item 2"}]}) == [True, True]
+    # Fields the index doesn't store never restrict results
+    assert mask({"source_file": "other.txt"}) == [True, True]
+
+
+def test_search_and_filters(tmp_path):
+    index = LexicalIndex(str(tmp_path / "lexical"))
+    index.add(IDS, DOCUMENTS, METADATAS)
+    index.commit()
+
+    reopened = LexicalIndex(str(tmp_path / "lexical"))
+
+    assert ids(reopened.search("Azure cloud")) == [IDS[1]]
+    # "revenue" is in every chunk, so only the rarer "iphone" is scored
+    assert ids(reopened.search("revenue iphone")) == [IDS[0]]
+    assert ids(reopened.search("revenue", where={"ticker": "MSFT"})) == [IDS[1]]
+    assert reopened.search("stopwords the and of") == []
+
+
+def test_replace_and_delete_mask_old_chunks(tmp_path):
+    path = str(tmp_path / "lexical")
+    index = LexicalIndex(path)
+    index.add(IDS, DOCUMENTS, METADATAS)
+    index.commit()
+
+    index.add([IDS[0]], ["Apple wearables revenue."], [METADATAS[0]])
+    index.delete([IDS[1]])
+    index.commit()
+
+    reopened = LexicalIndex(path)
+    assert reopened.num_live_docs() == 1
+    assert list(reopened.segments[0].deleted) == [True, True]
+    assert ids(reopened.search("wearables")) == [IDS[0]]
+    assert reopened.search("iphone") == []
+    assert reopened.search("azure") == []
+
+
+def test_compaction_drops_deleted_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(lexical_index, "MAX_SEGMENTS", 2)
+    path = str(tmp_path / "lexical")
+    index = LexicalIndex(path)
+    for i in range(2):
+        index.add(
+            [f"AAPL_10-K_2023-11-03_chunk_{i}"],
+            [f"Apple segment {i} revenue"],
+            [METADATAS[0]],
+        )
+        index.commit()
+    # The third segment goes over MAX_SEGMENTS
+    index.delete(["AAPL_10-K_2023-11-03_chunk_1"])
+    index.add(IDS[1:], DOCUMENTS[1:], METADATAS[1:])
+    index.commit()
+
+    reopened = LexicalIndex(path)
+
+    assert len(reopened.segments) == 1
+    # The merged-away segment directories are removed
+    segment_dirs = [p.name for p in (tmp_path / "lexical").glob("seg_*")]
+    assert segment_dirs == reopened.segment_names
+    assert reopened.segments[0].all_doc_ids() == [
+        "AAPL_10-K_2023-11-03_chunk_0",
+        IDS[1],
+    ]
+    assert not reopened.segments[0].deleted.any()
+    assert ids(reopened.search("revenue", where={"ticker": "MSFT"})) == [IDS[1]]
+    assert list(reopened.segments[0].doc_dates) == [20231103, 20240130]
@@ -0,0 +1,133 @@
+import hashlib
+import os
+
+import numpy as np
+import pytest
+
+# pipeline imports the embedding and vector store packages through bulk_embedder
+for module in ("chromadb", "langchain.text_splitter", "sentence_transformers"):
+    pytest.importorskip(module)
+
+import bulk_embedder  # noqa: E402
+import download_filings  # noqa: E402
+import pipeline  # noqa: E402
+import stub_sec_api  # noqa: E402
+from conftest import write_fixture  # noqa: E402
+from lexical_index import LexicalIndex  # noqa: E402
+from quantized_store import QuantizedCollection  # noqa: E402
+
+FILINGS = [
+    "AAPL_10-K_2023-11-03.html",
+    "AAPL_10-Q_2024-02-02.html",
+    "MSFT_10-K_2023-07-27.html",
+]
+
+
+class StubEmbedder:
+    """Deterministic unit vectors derived from each text's hash."""
+
+    encoded = []
+
+    def __init__(self, name):
+        pass
+
+    def encode(self, documents, batch_size, normalize_embeddings):
+        StubEmbedder.encoded += documents
+        vectors = np.array(
+            [
+                np.frombuffer(hashlib.sha256(d.encode("utf-8")).digest(), np.uint8)
+                for d in documents
+            ],
+            dtype=np.float32,
+        )
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+@pytest.fixture
+def filings(stub_api, monkeypatch):
+    fixtures, base_url = stub_api
+    for name in FILINGS:
+        # Short enough that either chunker keeps each filing as one chunk
+        write_fixture(
+            fixtures,
+            name,
+            f"<html><body><p>{name} reports</p><p>revenue and risks.</p></body></html>",
+        )
+    monkeypatch.setattr(bulk_embedder, "SentenceTransformer", StubEmbedder)
+    StubEmbedder.encoded = []
+    return base_url
+
+
+def run(base_url, chunker=bulk_embedder.DEFAULT_CHUNKER, **kwargs):
+    pipeline.run_pipeline(
+        ["AAPL", "MSFT"],
+        batch_size=2,
+        chunker=chunker,
+        vector_store="int8",
+        clean_workers=2,
+        requests_per_second=100,
+        queue_size=1,
+        api_url=base_url,
+        **kwargs,
+    )
+
+
+def indexed():
+    """The store (opened read-only) and manifest the pipeline left behind."""
+    collection = QuantizedCollection(
+        bulk_embedder.QUANTIZED_STORE_DIR, read_only=True
+    )
+    return collection, bulk_embedder.load_manifest(collection, "int8")
+
+
+def test_pipeline_indexes_every_filing(filings):
+    run(filings)
+
+    collection, manifest = indexed()
+    assert sorted(manifest) == sorted(name[:-5] + ".txt" for name in FILINGS)
+    assert all(entry["streamed"] for entry in manifest.values())
+    assert collection.count() == len(StubEmbedder.encoded) == len(FILINGS)
+    assert LexicalIndex(bulk_embedder.LEXICAL_INDEX_DIR).num_live_docs() == 3
+    # The per-batch checkpoints are folded into the manifest at the end
+    journal_path = bulk_embedder.MANIFEST_PATH + bulk_embedder.MANIFEST_JOURNAL_SUFFIX
+    assert not os.path.exists(journal_path)
+
+    # Everything is checkpointed, so a second run embeds nothing
+    run(filings)
+    assert len(StubEmbedder.encoded) == len(FILINGS)
+
+
+def test_pipeline_rechunking_reuses_unchanged_chunks(filings, capsys):
+    run(filings)
+    capsys.readouterr()
+
+    run(filings, chunker="recursive")
+
+    # Same text under the new chunker: only the metadata is rewritten
+    assert len(StubEmbedder.encoded) == len(FILINGS)
+    assert "Chunks embedded: 0, reused: 0, unchanged: 3" in capsys.readouterr().out
+    collection, manifest = indexed()
+    assert {entry["chunker"] for entry in manifest.values()} == {
+        bulk_embedder.chunker_id("recursive")
+    }
+    assert collection.count() == len(FILINGS)
+
+
+def test_pipeline_sync_gives_up_on_a_filing_that_never_cleans(filings, stub_api):
+    fixtures, _ = stub_api
+    # Nothing to extract, so cleaning fails on every run
+    write_fixture(fixtures, FILINGS[0], "<html><body></body></html>")
+    state_path = "sync_state.json"
+    for _ in range(download_filings.MAX_SYNC_ATTEMPTS - 1):
+        run(filings, sync=True, sync_state_path=state_path)
+        marks = download_filings.load_sync_state(state_path)["marks"]
+        assert marks["AAPL"] == "2023-11-03" + stub_sec_api.FILED_AT_TIME
+
+    run(filings, sync=True, sync_state_path=state_path)
+
+    state = download_filings.load_sync_state(state_path)
+    assert state["marks"] == {
+        "AAPL": "2024-02-02" + stub_sec_api.FILED_AT_TIME,
+        "MSFT": "2023-07-27" + stub_sec_api.FILED_AT_TIME,
+    }
+    assert state["failures"] == {FILINGS[0]: download_filings.MAX_SYNC_ATTEMPTS}
@@ -0,0 +1,93 @@
+import io
+
+import pytest
+
+import process_all_files
+from process_all_files import clean_file, clean_html, stream_clean_html
+
+FILING = "<html><body><p>Item 1A. Risk Factors</p><p>Demand may fall.</p></body></html>"
+
+
+def test_clean_file(tmp_path):
+    source = tmp_path / "AAPL_10-K_2023-11-03.html"
+    source.write_text(FILING, encoding="utf-8")
+    target = tmp_path / "AAPL_10-K_2023-11-03.txt"
+
+    _, _, error, details = clean_file(str(source), str(target))
+
+    assert error is None
+    assert target.read_text(encoding="utf-8") == "Item 1A. Risk Factors Demand may fall."
+    assert details["bytes_in"] == len(FILING)
+    assert details["bytes_out"] == target.stat().st_size
+
+
+def test_clean_file_reports_missing_source(tmp_path):
+    missing = str(tmp_path / "gone.html")
+
+    path, _, error, details = clean_file(missing, str(tmp_path / "gone.txt"))
+
+    assert path == missing
+    assert "No such file" in error
+    assert details["bytes_in"] is None
+
+
+PARITY_CASES = {
+    "table": (
+        "<html><body><table><tr><th>Segment</th><th>2023</th></tr>"
+        "<tr><td>iPhone</td><td>$ 200,583</td></tr>"
+        "<tr><td> Services </td><td>85,200</td></tr></table></body></html>"
+    ),
+    "script_and_style": (
+        "<html><head><style>p { color: red; }</style>"
+        "<script>var total = 1 < 2;</script></head>"
+        "<body><p>Net sales</p><script type='text/javascript'>track();</script>"
+        "<p>increased 3%.</p></body></html>"
+    ),
+    "nested_divs": (
+        "<html><body><div><div><span>Item 7.</span> <b>Management’s</b>"
+        "<div>Discussion <i>and</i> Analysis</div></div>\n\n<div>  </div>"
+        "<div>of Financial Condition</div></div></body></html>"
+    ),
+    "entities": (
+        "<html><body><p>AT&amp;T&nbsp;Inc. &lt;Parent&gt; &#8220;quoted&#8221;"
+        " R&amp;D&#160;costs &copy; 2023 &#x2014; net</p></body></html>"
+    ),
+    "inline_xbrl": (
+        "<html><body><div style='display:none'><ix:header><ix:hidden>"
+        "<ix:nonNumeric name='dei:EntityRegistrantName'>Apple Inc.</ix:nonNumeric>"
+        "</ix:hidden></ix:header></div><p>Revenue was "
+        "<ix:nonFraction name='us-gaap:Revenues' scale='6'>383,285</ix:nonFraction>"
+        " million.</p><ix:continuation id='c1'><p>Continued.</p></ix:continuation>"
+        "<p>Done.</p></body></html>"
+    ),
+    "comments_and_breaks": (
+        "<html><body><!-- page 12 --><p>First line<br/>second line</p>"
+        "<hr/><p>Third<!-- inline -->fourth</p></body></html>"
+    ),
+    "no_body_wrapper": "<p>Loose paragraph</p> trailing text &amp; more",
+}
+
+
+@pytest.mark.parametrize("case", sorted(PARITY_CASES))
+def test_stream_engine_matches_soup_engine(tmp_path, case):
+    html = PARITY_CASES[case]
+    source = tmp_path / "filing.html"
+    source.write_text(html, encoding="utf-8")
+    out = io.StringIO()
+
+    stream_clean_html(str(source), out)
+
+    assert out.getvalue() == clean_html(html)
+
+
+def test_stream_engine_matches_soup_engine_across_chunks(tmp_path, monkeypatch):
+    # Text nodes and tags split between parser feeds must not change the output
+    monkeypatch.setattr(process_all_files, "STREAM_CHUNK_SIZE", 7)
+    html = "".join(PARITY_CASES[case] for case in sorted(PARITY_CASES))
+    source = tmp_path / "filing.html"
+    source.write_text(html, encoding="utf-8")
+    out = io.StringIO()
+
+    stream_clean_html(str(source), out)
+
+    assert out.getvalue() == clean_html(html)
@@ -0,0 +1,86 @@
+import context_builder
+import qa_agent
+
+CHUNKS = (
+    ["AAPL_10-K_2023-11-03_chunk_0"],
+    ["Apple's results depend on iPhone demand."],
+    [{"ticker": "AAPL", "source_file": "AAPL_10-K_2023-11-03.txt", "date": 20231103}],
+)
+
+
+def test_main_streams_the_answer_of_answer_question(monkeypatch, capsys):
+    searched = []
+
+    def fake_retrieve(collection, query_text, num_results, where, cache, hybrid):
+        searched.append(where)
+        return CHUNKS
+
+    monkeypatch.setattr(qa_agent, "get_collection", lambda: None)
+    monkeypatch.setattr(qa_agent, "retrieve", fake_retrieve)
+    # Estimate tokens rather than load a tokenizer
+    monkeypatch.setattr(context_builder, "get_tokenizer", lambda: None)
+
+    qa_agent.main(
+        "What are Apple's risk factors?",
+        use_cache=False,
+        generator=qa_agent.EchoGenerator(),
+    )
+    output = capsys.readouterr().out
+
+    assert searched == [[{"ticker": "AAPL"}]]
+    assert "Filtering results by tickers: AAPL" in output
+    assert "Retrieved context from: AAPL_10-K_2023-11-03.txt" in output
+    assert "First token after" in output
+
+
+def test_main_without_documents(monkeypatch, capsys):
+    monkeypatch.setattr(qa_agent, "get_collection", lambda: None)
+    monkeypatch.setattr(qa_agent, "retrieve", lambda *args: ([], [], []))
+
+    qa_agent.main("Anything new?", use_cache=False)
+
+    assert "No relevant documents found" in capsys.readouterr().out
+
+
+class FailingGenerator(qa_agent.Generator):
+    def stream(self, prompt):
+        yield "Revenue grew"
+        raise RuntimeError("connection reset")
+
+
+def test_generate_response_streams_pieces():
+    pieces = []
+    context = "Source File: AAPL_10-K_2023-11-03.txt\nContent: ..."
+
+    answer = qa_agent.generate_response(
+        context, "Question?", qa_agent.EchoGenerator(), pieces.append
+    )
+
+    assert len(pieces) > 1
+    assert "".join(pieces) == answer
+    assert answer == qa_agent.EchoGenerator().generate(
+        qa_agent.build_prompt(context, "Question?")
+    )
+
+
+def test_generate_response_keeps_pieces_streamed_before_an_error():
+    pieces = []
+
+    answer = qa_agent.generate_response(
+        "", "Question?", FailingGenerator(), pieces.append
+    )
+
+    assert pieces[0] == "Revenue grew"
+    assert pieces[1].startswith("\nAn error occurred during generation")
+    assert answer.startswith("Revenue grew") and "connection reset" in answer
+
+
+def test_generation_timer():
+    pieces = []
+    timer = qa_agent.GenerationTimer(pieces.append)
+    timer("a")
+    timer("b")
+    timer.stop()
+
+    assert pieces == ["a", "b"]
+    assert 0 <= timer.first_token <= timer.total
@@ -0,0 +1,133 @@
+import pytest
+
+import qa_agent
+import qa_batch
+from query_cache import QueryCache
+
+
+class RecordingCollection:
+    """Answers each query embedding with chunks of the filtered ticker."""
+
+    def __init__(self):
+        self.queries = []
+
+    def count(self):
+        return 10
+
+    def query(self, query_embeddings, n_results, where):
+        self.queries.append((where, n_results, len(query_embeddings)))
+        ticker = where["ticker"] if where else "ALL"
+        row = [f"{ticker}_chunk_{k}" for k in range(n_results)]
+        ids = [row for _ in query_embeddings]
+        return {
+            "ids": ids,
+            "documents": [[f"text of {chunk_id}" for chunk_id in row] for _ in ids],
+            "metadatas": [[{"ticker": ticker} for _ in row] for _ in ids],
+        }
+
+    def get(self, ids, include):
+        return {
+            "ids": ids,
+            "documents": [f"text of {chunk_id}" for chunk_id in ids],
+            "metadatas": [{"ticker": chunk_id.split("_")[0]} for chunk_id in ids],
+        }
+
+
+@pytest.fixture
+def embedded(monkeypatch, tmp_path):
+    """Records the texts embedded; the collection fingerprint is its count."""
+    monkeypatch.chdir(tmp_path)
+    texts = []
+
+    def embed(batch):
+        texts.extend(batch)
+        return [[float(len(text))] for text in batch]
+
+    monkeypatch.setattr(qa_agent, "get_embedding_function", lambda: embed)
+    return texts
+
+
+def question(query, tickers, num_results=2):
+    return {
+        "query": query,
+        "num_results": num_results,
+        "filters": [{"ticker": ticker} for ticker in tickers],
+    }
+
+
+QUESTIONS = [
+    question("apple risks", ["AAPL"]),
+    question("apple revenue", ["AAPL"]),
+    question("apple margins", ["AAPL"], num_results=3),
+    question("apple versus microsoft", ["AAPL", "MSFT"]),
+]
+
+
+def test_questions_are_searched_once_per_filter_and_num_results(embedded):
+    collection = RecordingCollection()
+
+    retrieved = qa_batch.retrieve_all(collection, QUESTIONS)
+
+    # All queries are embedded in one call
+    assert embedded == [q["query"] for q in QUESTIONS]
+    assert sorted(collection.queries, key=str) == sorted(
+        [
+            ({"ticker": "AAPL"}, 2, 3),
+            ({"ticker": "AAPL"}, 3, 1),
+            ({"ticker": "MSFT"}, 2, 1),
+        ],
+        key=str,
+    )
+    assert retrieved[0][0] == ["AAPL_chunk_0", "AAPL_chunk_1"]
+    assert retrieved[2][0] == ["AAPL_chunk_0", "AAPL_chunk_1", "AAPL_chunk_2"]
+    assert retrieved[0][1] == ["text of AAPL_chunk_0", "text of AAPL_chunk_1"]
+    # A comparison question merges its per-company sub-queries
+    ids, _, metadatas = retrieved[3]
+    assert len(ids) == 2
+    assert {m["ticker"] for m in metadatas} == {"AAPL", "MSFT"}
+
+
+def test_unfiltered_questions_share_a_group(embedded):
+    collection = RecordingCollection()
+    questions = [
+        {"query": "risks", "num_results": 2, "filters": [None]},
+        {"query": "revenue", "num_results": 2, "filters": [None]},
+    ]
+
+    retrieved = qa_batch.retrieve_all(collection, questions)
+
+    assert collection.queries == [(None, 2, 2)]
+    assert [ids for ids, _, _ in retrieved] == [["ALL_chunk_0", "ALL_chunk_1"]] * 2
+
+
+def test_cached_questions_skip_embedding_and_search(embedded, tmp_path):
+    cache = QueryCache(str(tmp_path / "query_cache.sqlite"))
+    first = qa_batch.retrieve_all(RecordingCollection(), QUESTIONS, cache)
+    embedded.clear()
+    collection = RecordingCollection()
+
+    again = qa_batch.retrieve_all(collection, QUESTIONS, cache)
+
+    assert again == first
+    assert embedded == []
+    assert collection.queries == []
+    cache.close()
+
+
+def test_batch_and_single_retrieval_share_cache_entries(embedded, tmp_path):
+    cache = QueryCache(str(tmp_path / "query_cache.sqlite"))
+    comparison = QUESTIONS[3]
+    ids, documents, metadatas = qa_agent.retrieve(
+        RecordingCollection(),
+        comparison["query"],
+        comparison["num_results"],
+        comparison["filters"],
+        cache,
+    )
+    collection = RecordingCollection()
+
+    [retrieved] = qa_batch.retrieve_all(collection, [comparison], cache)
+
+    assert retrieved == (ids, documents, metadatas)
+    assert collection.queries == []
+    cache.close()
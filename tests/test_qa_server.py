@@ -0,0 +1,175 @@
+import json
+import asyncio
+import threading
+
+import pytest
+
+import qa_agent
+import qa_server
+
+
+class FakeCollection:
+    def count(self):
+        return 3
+
+
+def fake_answer(
+    collection,
+    query_text,
+    num_results,
+    generator,
+    use_cache,
+    hybrid,
+    section,
+    rerank,
+    rerank_candidates,
+    token_budget,
+    on_token=None,
+):
+    if query_text == "fail":
+        raise RuntimeError("model unavailable")
+    for piece in ("Apple ", "sells ", "phones."):
+        if on_token:
+            on_token(piece)
+        if query_text == "fail midway":
+            raise RuntimeError("stream broke")
+    return {
+        "answer": "Apple sells phones.",
+        "hybrid": hybrid,
+        "rerank": rerank,
+        "num_results": num_results,
+    }
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(qa_agent, "open_collection", FakeCollection)
+    monkeypatch.setattr(qa_agent, "get_embedding_function", lambda: len)
+    monkeypatch.setattr(qa_agent, "answer_question", fake_answer)
+    return qa_server.QAServer(generator=object())
+
+
+@pytest.fixture
+def server_url(monkeypatch):
+    """URL of a hybrid-by-default server running on a background event loop."""
+    monkeypatch.setattr(qa_agent, "open_collection", FakeCollection)
+    monkeypatch.setattr(qa_agent, "get_embedding_function", lambda: len)
+    monkeypatch.setattr(qa_agent, "get_lexical_index", lambda: None)
+    monkeypatch.setattr(qa_agent, "answer_question", fake_answer)
+    server = qa_server.QAServer(generator=object(), hybrid=True)
+    loop = asyncio.new_event_loop()
+    listener = loop.run_until_complete(
+        asyncio.start_server(server.handle_connection, "127.0.0.1", 0)
+    )
+    port = listener.sockets[0].getsockname()[1]
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{port}"
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    listener.close()
+    loop.run_until_complete(listener.wait_closed())
+    loop.close()
+
+
+def request(server, method, path, body=None):
+    """Sends one request through handle_connection; returns (status, body lines)."""
+
+    async def exchange():
+        listener = await asyncio.start_server(server.handle_connection, "127.0.0.1", 0)
+        port = listener.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        payload = json.dumps(body).encode() if body is not None else b""
+        writer.write(
+            f"{method} {path} HTTP/1.1\r\nContent-Length: {len(payload)}\r\n\r\n".encode()
+            + payload
+        )
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        listener.close()
+        await listener.wait_closed()
+        return response
+
+    head, _, content = asyncio.run(exchange()).partition(b"\r\n\r\n")
+    status = int(head.split()[1])
+    return status, [json.loads(line) for line in content.splitlines() if line]
+
+
+def test_health(server):
+    assert request(server, "GET", "/health") == (200, [{"status": "ok", "items": 3}])
+
+
+def test_ask_uses_server_defaults(server):
+    status, [answer] = request(server, "POST", "/ask", {"query": "Apple?"})
+
+    assert status == 200
+    assert answer["answer"] == "Apple sells phones."
+    assert answer["hybrid"] is False and answer["rerank"] is False
+
+
+def test_ask_overrides(server):
+    status, [answer] = request(
+        server, "POST", "/ask", {"query": "Apple?", "hybrid": True, "num_results": 3}
+    )
+
+    assert status == 200
+    assert answer["hybrid"] is True and answer["num_results"] == 3
+
+
+def test_bad_request(server):
+    status, [error] = request(server, "POST", "/ask", {"num_results": 3})
+
+    assert status == 400
+    assert "query" in error["error"]
+
+
+def test_unknown_route(server):
+    assert request(server, "GET", "/nope")[0] == 404
+
+
+def test_failed_answer_is_500(server):
+    status, [error] = request(server, "POST", "/ask", {"query": "fail"})
+
+    assert status == 500
+    assert "model unavailable" in error["error"]
+
+
+def test_stream(server):
+    status, events = request(server, "POST", "/ask", {"query": "Apple?", "stream": True})
+
+    assert status == 200
+    assert [event["token"] for event in events[:-1]] == ["Apple ", "sells ", "phones."]
+    assert events[-1]["done"] is True
+    assert events[-1]["result"]["answer"] == "Apple sells phones."
+
+
+def test_failed_stream_ends_with_error_event(server):
+    status, events = request(
+        server, "POST", "/ask", {"query": "fail midway", "stream": True}
+    )
+
+    assert status == 200
+    assert events[0] == {"token": "Apple "}
+    assert "stream broke" in events[-1]["error"]
+
+
+def test_client_leaves_unset_modes_to_the_server(server_url):
+    default = qa_agent.ask_server("Apple?", 7, server_url=server_url)
+    overridden = qa_agent.ask_server("Apple?", 7, hybrid=False, server_url=server_url)
+
+    assert default["hybrid"] is True and default["rerank"] is False
+    assert overridden["hybrid"] is False
+
+
+def test_client_streams_and_raises_stream_errors(server_url):
+    pieces = []
+    answer = qa_agent.ask_server(
+        "Apple?", 7, on_token=pieces.append, server_url=server_url
+    )
+
+    assert "".join(pieces) == answer["answer"]
+    with pytest.raises(RuntimeError, match="stream broke"):
+        qa_agent.ask_server(
+            "fail midway", 7, on_token=pieces.append, server_url=server_url
+        )
@@ -0,0 +1,97 @@
+import os
+
+import numpy as np
+import pytest
+
+from quantized_store import QuantizedCollection
+
+DIMENSIONS = 8
+
+
+def vectors(count, seed=0):
+    return np.random.default_rng(seed).normal(size=(count, DIMENSIONS)).tolist()
+
+
+def chunk_ids(count, prefix="chunk"):
+    return [f"{prefix}_{i}" for i in range(count)]
+
+
+def file_sizes(path):
+    return {
+        name: os.path.getsize(os.path.join(path, name))
+        for name in os.listdir(path)
+        if name.endswith(".bin")
+    }
+
+
+@pytest.fixture(params=["int8", "binary"])
+def store(tmp_path, request):
+    path = str(tmp_path / "store")
+    writer = QuantizedCollection(path, request.param)
+    writer.upsert(chunk_ids(10), vectors(10), [{"ticker": "AAPL"}] * 10)
+    yield path, writer
+    writer.close()
+
+
+def test_reader_ignores_torn_append_without_truncating(store):
+    path, writer = store
+    with open(os.path.join(path, "codes.0.bin"), "ab") as f:
+        f.write(b"\x7f" * DIMENSIONS * 3)
+    open(os.path.join(path, "codes.1.bin"), "wb").close()
+    sizes = file_sizes(path)
+
+    reader = QuantizedCollection(path, read_only=True)
+    result = reader.query(vectors(1), n_results=3)
+
+    assert reader.count() == 10
+    assert len(result["ids"][0]) == 3
+    assert file_sizes(path) == sizes
+    reader.close()
+
+
+def test_writer_repairs_on_open(store):
+    path, writer = store
+    codes = os.path.join(path, "codes.0.bin")
+    committed = os.path.getsize(codes)
+    with open(codes, "ab") as f:
+        f.write(b"\x7f" * DIMENSIONS)
+    open(os.path.join(path, "codes.1.bin"), "wb").close()
+    writer.close()
+
+    reopened = QuantizedCollection(path)
+
+    assert os.path.getsize(codes) == committed
+    assert not os.path.exists(os.path.join(path, "codes.1.bin"))
+    reopened.close()
+
+
+def test_only_one_writer(store):
+    path, _ = store
+    with pytest.raises(RuntimeError):
+        QuantizedCollection(path)
+
+
+def test_reader_is_read_only(store):
+    path, _ = store
+    reader = QuantizedCollection(path, read_only=True)
+    with pytest.raises(ValueError):
+        reader.upsert(["new"], vectors(1))
+    reader.close()
+
+
+def test_reader_reloads_after_append_and_compaction(store):
+    path, writer = store
+    reader = QuantizedCollection(path, read_only=True)
+    assert reader.count() == 10
+
+    writer.upsert(chunk_ids(5, "new"), vectors(5, seed=1))
+    assert reader.count() == 15
+
+    # Deleting most rows compacts the files into a new generation
+    writer.delete(ids=chunk_ids(10))
+    assert writer.generation == 1
+    result = reader.query(vectors(1, seed=1), n_results=5)
+
+    assert reader.generation == 1
+    assert sorted(result["ids"][0]) == chunk_ids(5, "new")
+    reader.close()
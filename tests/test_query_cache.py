@@ -0,0 +1,123 @@
+import os
+import time
+
+import pytest
+
+import qa_agent
+from query_cache import QueryCache, filter_key, normalize_query
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = QueryCache(str(tmp_path / "query_cache.sqlite"), max_queries=2)
+    yield cache
+    cache.close()
+
+
+def test_normalize_query():
+    assert normalize_query("  What are Apple's   RISK factors?? ") == (
+        "what are apple's risk factors"
+    )
+    assert normalize_query("Revenue in 2023!") == normalize_query("revenue in 2023")
+
+
+def test_filter_key():
+    assert filter_key({"ticker": "AAPL", "date": 1}) == filter_key(
+        {"date": 1, "ticker": "AAPL"}
+    )
+    assert filter_key(None) != filter_key(None, "hybrid")
+
+
+def test_embeddings_are_evicted_least_recently_used_first(cache, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+
+    for query in ("apple", "microsoft"):
+        cache.put_embedding(query, [0.5, 0.25])
+        cache.put_ids(query, None, 5, "fp", [f"{query}_chunk_0"])
+        now[0] += 1
+    # Using "apple" makes "microsoft" the least recently used
+    assert cache.get_embedding("apple") == [0.5, 0.25]
+    now[0] += 1
+    cache.put_embedding("walmart", [1.0, 0.0])
+
+    assert cache.get_embedding("microsoft") is None
+    assert cache.get_ids("microsoft", None, 5, "fp") is None
+    assert cache.get_embedding("apple") == [0.5, 0.25]
+    assert cache.get_ids("apple", None, 5, "fp") == ["apple_chunk_0"]
+
+
+def test_ids_are_keyed_by_filter_count_and_mode(cache):
+    cache.put_embedding("apple", [0.5])
+    cache.put_ids("apple", {"ticker": "AAPL"}, 5, "fp", ["a"])
+    cache.put_ids("apple", {"ticker": "AAPL"}, 5, "fp", ["b"], mode="hybrid")
+
+    assert cache.get_ids("apple", {"ticker": "AAPL"}, 5, "fp") == ["a"]
+    assert cache.get_ids("apple", {"ticker": "AAPL"}, 5, "fp", "hybrid") == ["b"]
+    assert cache.get_ids("apple", {"ticker": "AAPL"}, 10, "fp") is None
+    assert cache.get_ids("apple", None, 5, "fp") is None
+
+
+def test_ids_from_another_fingerprint_are_stale(cache):
+    cache.put_embedding("apple", [0.5])
+    cache.put_ids("apple", None, 5, "old", ["a"])
+
+    assert cache.get_ids("apple", None, 5, "new") is None
+    # Embeddings don't depend on the collection
+    assert cache.get_embedding("apple") == [0.5]
+
+
+class CountedCollection:
+    def count(self):
+        return 3
+
+
+@pytest.fixture
+def db_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(qa_agent.DB_DIR)
+    monkeypatch.setattr(qa_agent, "_file_digests", {})
+
+
+def write(path, text):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def test_fingerprint_changes_with_the_manifest_and_journal(db_dir):
+    collection = CountedCollection()
+    assert qa_agent.collection_fingerprint(collection) == "count:3"
+
+    write(qa_agent.MANIFEST_PATH, '{"files": {}}')
+    empty = qa_agent.collection_fingerprint(collection)
+    assert empty != "count:3"
+    assert qa_agent.collection_fingerprint(collection) == empty
+
+    # bulk_embedder appends checkpoints to the journal while it runs
+    journal_path = qa_agent.MANIFEST_PATH + qa_agent.MANIFEST_JOURNAL_SUFFIX
+    write(journal_path, '{"files": {"AAPL_10-K_2023-11-03.txt": {}}}\n')
+    checkpointed = qa_agent.collection_fingerprint(collection)
+    assert checkpointed != empty
+
+    os.remove(journal_path)
+    write(qa_agent.MANIFEST_PATH, '{"files": {"AAPL_10-K_2023-11-03.txt": {}}}')
+    assert qa_agent.collection_fingerprint(collection) not in (empty, checkpointed)
+
+
+def test_fingerprint_rereads_the_manifest_only_when_it_changes(db_dir, monkeypatch):
+    write(qa_agent.MANIFEST_PATH, '{"files": {}}')
+    first = qa_agent.collection_fingerprint(CountedCollection())
+    reads = []
+
+    def counting_open(path, *args, **kwargs):
+        reads.append(path)
+        return open(path, *args, **kwargs)
+
+    monkeypatch.setattr(qa_agent, "open", counting_open, raising=False)
+
+    assert qa_agent.collection_fingerprint(CountedCollection()) == first
+    assert reads == []
+
+    write(qa_agent.MANIFEST_PATH, '{"files": {"MSFT_10-K_2023-07-27.txt": {}}}')
+    assert qa_agent.collection_fingerprint(CountedCollection()) != first
+    assert reads == [qa_agent.MANIFEST_PATH]
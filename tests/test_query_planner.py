@@ -0,0 +1,36 @@
+from query_planner import extract_date_range, plan_query
+
+COMPANY_MAP = {"apple": "AAPL", "microsoft": "MSFT", "jpmorgan": "JPM"}
+
+
+def test_bare_year_is_a_fiscal_year():
+    # JPMorgan files its 2023 10-K in February 2024
+    assert extract_date_range("JPMorgan's revenue in 2023") == (20230101, 20240331)
+
+
+def test_several_bare_years():
+    assert extract_date_range("Compare 2021 and 2022 margins") == (20210101, 20230331)
+
+
+def test_explicit_ranges_are_filing_dates():
+    assert extract_date_range("between 2021 and 2023") == (20210101, 20231231)
+    assert extract_date_range("filings since 2022") == (20220101, None)
+    assert extract_date_range("filings before 2020") == (None, 20191231)
+
+
+def test_no_years():
+    assert extract_date_range("What are Apple's risk factors?") is None
+
+
+def test_plan_query_filters():
+    plan = plan_query("Compare Apple and Microsoft's 2023 10-K filings", COMPANY_MAP)
+
+    assert plan["tickers"] == ["AAPL", "MSFT"]
+    assert plan["filters"][0] == {
+        "$and": [
+            {"ticker": "AAPL"},
+            {"form_type": "10-K"},
+            {"date": {"$gte": 20230101}},
+            {"date": {"$lte": 20240331}},
+        ]
+    }
@@ -0,0 +1,37 @@
+import pytest
+
+import context_builder
+from reranker import select_within_budget
+
+
+@pytest.fixture(autouse=True)
+def estimated_tokens(monkeypatch):
+    # len(text) // 4 + 1 tokens per document, without loading a tokenizer
+    monkeypatch.setattr(context_builder, "get_tokenizer", lambda: None)
+
+
+def documents(*tokens):
+    """Documents that count as the given numbers of tokens."""
+    return ["x" * (4 * (n - 1)) for n in tokens]
+
+
+def test_best_scores_first_up_to_max_chunks():
+    scores = [0.2, 0.9, 0.5]
+
+    assert select_within_budget(scores, documents(10, 10, 10), 2, 1000) == [1, 2]
+
+
+def test_chunk_over_the_budget_is_skipped_for_a_shorter_one():
+    scores = [0.9, 0.8, 0.7]
+
+    assert select_within_budget(scores, documents(20, 40, 10), 5, 40) == [0, 2]
+
+
+def test_top_chunk_is_kept_even_alone_over_the_budget():
+    scores = [0.9, 0.1]
+
+    assert select_within_budget(scores, documents(100, 10), 5, 50) == [0]
+
+
+def test_no_documents():
+    assert select_within_budget([], [], 5, 100) == []
@@ -0,0 +1,79 @@
+from sec_sections import FRONT_MATTER, find_sections, split_sections
+
+TOC_ITEMS = [
+    ("1", "Business", 3),
+    ("1A", "Risk Factors", 12),
+    ("1B", "Unresolved Staff Comments", 24),
+    ("2", "Properties", 25),
+    ("3", "Legal Proceedings", 25),
+    ("7", "Management's Discussion and Analysis", 30),
+    ("8", "Financial Statements and Supplementary Data", 41),
+    ("9A", "Controls and Procedures", 55),
+    ("15", "Exhibit and Financial Statement Schedules", 56),
+    ("16", "Form 10-K Summary", 57),
+]
+
+FORWARD_LOOKING = (
+    "This Annual Report on Form 10-K contains forward-looking statements, within "
+    "the meaning of the Private Securities Litigation Reform Act of 1995, that "
+    "involve risks and uncertainties. Many of the forward-looking statements are "
+    "located in Part II, Item 7 of this Form 10-K under the heading "
+    "“Management’s Discussion and Analysis of Financial Condition and Results "
+    "of Operations.” Forward-looking statements can also be identified by words "
+    "such as “future,” “anticipates,” “believes,” “estimates,” “expects” and "
+    "“intends.” The Company assumes no obligation to revise or update any "
+    "forward-looking statements for any reason, except as required by law. "
+)
+
+
+def make_10k():
+    toc = "TABLE OF CONTENTS\nPart I\n" + "".join(
+        f"Item {item}. {title} {page}\n" for item, title, page in TOC_ITEMS
+    )
+    body = "PART I\n" + "".join(
+        f"Item {item}. {title}\n" + f"{title} discussion. " * 40 + "\n"
+        for item, title, _ in TOC_ITEMS
+    )
+    return toc + FORWARD_LOOKING * 2 + body
+
+
+def test_10k_toc_entries_are_skipped():
+    text = make_10k()
+    sections = find_sections(text, "10-K")
+    body_start = text.index("PART I\n")
+
+    assert sections[0] == (0, FRONT_MATTER)
+    assert [label for _, label in sections[1:]] == [
+        f"Item {item}" for item, _, _ in TOC_ITEMS
+    ]
+    assert all(start > body_start for start, _ in sections[1:])
+
+
+def test_front_matter_keeps_toc_and_cover_text():
+    sections = dict(split_sections(make_10k(), "10-K"))
+
+    assert "Item 16. Form 10-K Summary 57" in sections[FRONT_MATTER]
+    assert "forward-looking statements" in sections[FRONT_MATTER]
+    assert sections["Item 1A"].startswith("Item 1A. Risk Factors\nRisk Factors")
+
+
+def test_10q_items_restart_per_part():
+    text = (
+        "PART I\nItem 1. Financial Statements\n"
+        + "Balance sheet. " * 40
+        + "\nItem 2. Management's Discussion\n"
+        + "Results. " * 60
+        + "\nPART II\nItem 1. Legal Proceedings\n"
+        + "Litigation. " * 40
+        + "\nItem 1A. Risk Factors\n"
+        + "Risks. " * 70
+    )
+    labels = [label for _, label in find_sections(text, "10-Q")]
+
+    assert labels == [
+        FRONT_MATTER,
+        "Part I Item 1",
+        "Part I Item 2",
+        "Part II Item 1",
+        "Part II Item 1A",
+    ]
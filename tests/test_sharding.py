@@ -0,0 +1,54 @@
+import os
+
+from sharding import db_path, filter_tickers, route, shard_name
+
+SHARDS = {"AAPL": "aapl shard", "MSFT": "msft shard", "JPM": "jpm shard"}
+
+
+def test_filter_tickers_without_a_ticker_condition():
+    assert filter_tickers(None) is None
+    assert filter_tickers({}) is None
+    assert filter_tickers({"form_type": "10-K"}) is None
+    assert filter_tickers({"ticker": {"$ne": "AAPL"}}) is None
+
+
+def test_filter_tickers_eq_and_in():
+    assert filter_tickers({"ticker": "AAPL"}) == ["AAPL"]
+    assert filter_tickers({"ticker": {"$eq": "MSFT"}}) == ["MSFT"]
+    assert filter_tickers({"ticker": {"$in": ["AAPL", "JPM"]}}) == ["AAPL", "JPM"]
+
+
+def test_filter_tickers_and_or():
+    where = {"$and": [{"form_type": "10-K"}, {"ticker": "AAPL"}]}
+    assert filter_tickers(where) == ["AAPL"]
+    assert filter_tickers({"$and": [{"form_type": "10-K"}]}) is None
+    assert filter_tickers({"$or": [{"ticker": "MSFT"}, {"ticker": "AAPL"}]}) == [
+        "AAPL",
+        "MSFT",
+    ]
+    # One branch allows any ticker, so every shard must be searched
+    assert filter_tickers({"$or": [{"ticker": "MSFT"}, {"form_type": "8-K"}]}) is None
+
+
+def test_route_by_ticker():
+    assert route(SHARDS, None, "ticker", 8) == list(SHARDS.values())
+    assert route(SHARDS, ["MSFT", "AAPL"], "ticker", 8) == ["aapl shard", "msft shard"]
+    # A ticker with no shard of its own has nothing to search
+    assert route(SHARDS, ["GS"], "ticker", 8) == []
+
+
+def test_route_by_hash_bucket():
+    shards = {shard_name(t, "hash", 4): t for t in ("AAPL", "MSFT", "JPM")}
+
+    assert route(shards, ["AAPL"], "hash", 4) == [shards[shard_name("AAPL", "hash", 4)]]
+
+
+def test_db_path():
+    shard_dir = os.path.join("chroma_db", "shards", "AAPL")
+
+    assert db_path(shard_dir, os.path.join("chroma_db", "indexed_files.json")) == (
+        os.path.join(shard_dir, "indexed_files.json")
+    )
+    assert db_path("chroma_db", os.path.join("chroma_db", "lexical_index")) == (
+        os.path.join("chroma_db", "lexical_index")
+    )
@@ -0,0 +1,90 @@
+import gzip
+import os
+import stat
+
+import pytest
+import zstandard
+
+import storage
+
+# Non-ASCII text and both line endings must survive every codec unchanged
+TEXT = "Item 1A. Risk Factors\r\nCafé revenue — €1.2 billion.\nEnd\n"
+
+
+def test_atomic_write_uses_the_default_file_mode(tmp_path):
+    path = tmp_path / "AAPL_10-K_2023-11-03.html"
+
+    storage.write_text_atomic(str(path), "<html></html>")
+
+    assert stat.S_IMODE(os.stat(path).st_mode) == storage.FILE_MODE
+    # Same as a file created with open()
+    (tmp_path / "plain.txt").write_text("", encoding="utf-8")
+    assert storage.FILE_MODE == stat.S_IMODE(os.stat(tmp_path / "plain.txt").st_mode)
+    assert [p.name for p in tmp_path.iterdir() if p.suffix == ".tmp"] == []
+
+
+@pytest.mark.parametrize("compression", storage.COMPRESSIONS)
+def test_round_trip(tmp_path, compression):
+    path = storage.with_compression(str(tmp_path / "AAPL.txt"), compression)
+
+    storage.write_text_atomic(path, TEXT)
+
+    assert storage.read_text(path, newline="") == TEXT
+    with storage.open_text(path, newline="") as f:
+        assert f.readline() == "Item 1A. Risk Factors\r\n"
+    # Without newline="" line endings are translated, as with open()
+    assert storage.read_text(path) == TEXT.replace("\r\n", "\n")
+    assert [p.name for p in tmp_path.iterdir()] == [os.path.basename(path)]
+
+
+def test_files_are_compressed_in_their_format(tmp_path):
+    gzip_path = str(tmp_path / "a.txt.gz")
+    zstd_path = str(tmp_path / "a.txt.zst")
+
+    storage.write_text_atomic(gzip_path, TEXT)
+    storage.write_text_atomic(zstd_path, TEXT)
+
+    with gzip.open(gzip_path, "rb") as f:
+        assert f.read() == TEXT.encode("utf-8")
+    with open(zstd_path, "rb") as f:
+        reader = zstandard.ZstdDecompressor().stream_reader(f)
+        assert reader.read() == TEXT.encode("utf-8")
+
+
+def test_failed_write_leaves_no_file(tmp_path):
+    path = tmp_path / "a.txt.zst"
+    storage.write_text_atomic(str(path), "old")
+
+    with pytest.raises(RuntimeError):
+        with storage.atomic_write_text(str(path)) as f:
+            f.write("new")
+            raise RuntimeError("interrupted")
+
+    assert storage.read_text(str(path)) == "old"
+    assert [p.name for p in tmp_path.iterdir()] == ["a.txt.zst"]
+
+
+def test_split_compression():
+    assert storage.split_compression("AAPL.txt.zst") == ("AAPL.txt", ".zst")
+    assert storage.split_compression("dir/AAPL.html.gz") == ("dir/AAPL.html", ".gz")
+    assert storage.split_compression("AAPL.txt") == ("AAPL.txt", "")
+    # Only a trailing extension counts
+    assert storage.split_compression("AAPL.gz.txt") == ("AAPL.gz.txt", "")
+
+
+def test_with_compression():
+    assert storage.with_compression("AAPL.txt", "none") == "AAPL.txt"
+    assert storage.with_compression("AAPL.txt", "gzip") == "AAPL.txt.gz"
+    assert storage.with_compression("AAPL.txt", "zstd") == "AAPL.txt.zst"
+
+
+def test_find_existing(tmp_path):
+    path = str(tmp_path / "AAPL.txt")
+    assert storage.find_existing(path) is None
+
+    storage.write_text_atomic(path + ".zst", TEXT)
+    assert storage.find_existing(path) == path + ".zst"
+
+    # The uncompressed file wins when several are present
+    storage.write_text_atomic(path, TEXT)
+    assert storage.find_existing(path) == path